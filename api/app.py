@@ -1,34 +1,176 @@
 # Flask REST API for the IR system - handles search requests and serves the web interface
 
 import json
+import os
 import sys
 from pathlib import Path
 import numpy as np
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, Response, g, request, jsonify, render_template
+from werkzeug.exceptions import HTTPException
 sys.path.insert(0, str(Path(__file__).parent.parent))
+from src.inverted_index import ensure_postings
 from src.query_processor import QueryProcessor
-from src.indexer import DocumentIndexer
+from src.query_cache import QueryResultCache
+from src.metrics import MetricsRegistry, StageTimings
+from api.reloader import IndexReloader
 app = Flask(__name__)
 query_processor = None  # Global variables to store loaded index
+index_reloader = None  # Swaps in a new query_processor when the index is rebuilt
+result_cache = QueryResultCache()  # Ranked results of repeated queries; cleared whenever an index is loaded
 
+DEFAULT_INDEX_PATH = "data/output/index"
+LEGACY_INDEX_PATH = "data/output/index.json"  # Dense JSON index committed with the repo
 
-def initialize_index(index_path: str = "data/output/index.json"): # Load the TF-IDF index from JSON file into memory
-  
-    global query_processor 
+# Request-size limits for /search/batch
+MAX_BATCH_QUERIES = 256
+MAX_QUERY_LENGTH = 1000
+MAX_TOP_K = 1000
+app.config["MAX_CONTENT_LENGTH"] = 1024 * 1024  # Larger request bodies are rejected with 413
+# Send the X-Timing stage breakdown on every response, not only when the request asks for it
+app.config["TIMING_HEADER"] = os.environ.get("IR_TIMING_HEADER") == "1"
+
+# Request and per-stage metrics, served in Prometheus text format on /metrics
+metrics = MetricsRegistry()
+metrics.describe("ir_http_requests_total", "counter", "HTTP requests by endpoint, method and status")
+metrics.describe("ir_http_request_errors_total", "counter", "HTTP requests that failed with a 5xx status")
+metrics.describe("ir_http_request_duration_seconds", "histogram", "Time spent handling HTTP requests")
+metrics.describe("ir_search_stage_duration_seconds", "histogram",
+                 "Time spent in each stage of a search request (validate, vectorize, similarity, ...)")
+
+
+def default_index_path() -> str:
+    # IR_INDEX_PATH, else the binary index built by the pipeline. A fresh checkout has no binary
+    # index yet, so the committed JSON index is served until it is built.
+    index_path = os.environ.get("IR_INDEX_PATH")
+    if index_path:
+        return index_path
+    if not Path(DEFAULT_INDEX_PATH).exists() and Path(LEGACY_INDEX_PATH).exists():
+        print(f"{DEFAULT_INDEX_PATH} has not been built - serving {LEGACY_INDEX_PATH} "
+              f"(build it with: python run_pipeline.py --skip-crawler)")
+        return LEGACY_INDEX_PATH
+    return DEFAULT_INDEX_PATH
+
+
+def initialize_index(index_path: str = None, watch_interval=None): # Load the TF-IDF index from disk into memory
+    # With watch_interval (seconds) the index is reloaded in the background whenever it is rebuilt
+    global index_reloader
+    index_path = index_path or default_index_path()
+    index_reloader = IndexReloader(index_path, load_processor, install_processor, poll_interval=watch_interval)
     try:  
-        doc_ids, vocab, tfidf_matrix, params = DocumentIndexer.load_index(index_path) # Load index components
-        query_processor = QueryProcessor(doc_ids, vocab, tfidf_matrix, params)   # Initialize query processor   
+        index_reloader.reload(wait=True)   # Load index and initialize query processor
         print(f"\nAPI initialized with index from {index_path}")       
     except Exception as e:
         print(f"\nFailed to load index: {e}")
         raise
 
 
+def load_processor(index_path: str) -> QueryProcessor:  # Build a query processor for an index (used by the reloader)
+    # A rebuilt index comes without postings; storing them first keeps them memory-mapped and
+    # shared between workers after a reload, as prepare_index does at server start
+    ensure_postings(index_path)
+    return QueryProcessor.from_index(index_path, result_cache=result_cache)
+
+
+def install_processor(processor: QueryProcessor) -> None:
+    # Requests read query_processor once, so replacing the reference is an atomic swap. The shared
+    # result cache switches to the new index in the same step, never for a load that failed.
+    global query_processor
+    processor.activate_result_cache()
+    query_processor = processor
+
+
+@app.before_request
+def start_index_watcher():  # Each server process (including forked workers) runs its own watcher
+    if index_reloader is not None:
+        index_reloader.ensure_watching()
+
+
+@app.before_request
+def start_request_timer():  # Handlers call g.timings.lap(stage) as each stage finishes
+    g.timings = StageTimings()
+
+
+@app.after_request
+def record_request_metrics(response):  # Count the request and add its durations to the histograms
+    timings = g.get("timings")
+    if timings is None:
+        return response
+    endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    metrics.inc("ir_http_requests_total", (("endpoint", endpoint), ("method", request.method),
+                                           ("status", str(response.status_code))))
+    if response.status_code >= 500:
+        metrics.inc("ir_http_request_errors_total", (("endpoint", endpoint),))
+    for stage, seconds in timings.stages.items():
+        metrics.observe("ir_search_stage_duration_seconds", seconds, (("endpoint", endpoint), ("stage", stage)))
+    metrics.observe("ir_http_request_duration_seconds", timings.total(), (("endpoint", endpoint),))
+    if app.config["TIMING_HEADER"] or request.headers.get("X-Timing"):
+        response.headers["X-Timing"] = timings.header()  # Milliseconds per stage
+    return response
+
+
+def collect_index_metrics():  # Scrape-time values owned by the index, its reloader and the result cache
+    processor = query_processor
+    documents = len(processor.document_ids) if processor is not None else 0
+    yield "ir_index_documents", "gauge", "Documents in the served index", [((), documents)]
+    if index_reloader is not None:
+        yield "ir_index_loads_total", "counter", "Index loads, including hot reloads", [((), index_reloader.loads)]
+    if result_cache is not None:
+        stats = result_cache.stats()
+        yield "ir_result_cache_entries", "gauge", "Entries in the query result cache", [((), stats["entries"])]
+        for event in ("hits", "misses", "evictions", "expirations", "invalidations"):
+            yield f"ir_result_cache_{event}_total", "counter", f"Query result cache {event}", [((), stats[event])]
+
+
+metrics.add_collector(collect_index_metrics)
+
+
 @app.route("/")
 def home():  # Serve the main web interface page
     return render_template("index.html")
 
 
+def parse_search_request(body):  # Validate a /search payload; returns (query text, top_k, error message)
+    if not body or not isinstance(body, dict):
+        return None, None, "Missing JSON payload"
+    
+    # Extract query
+    query_text = body.get("query")
+    
+    if not query_text:
+        return None, None, "Field 'query' is required"
+    
+    if not isinstance(query_text, str) or not query_text.strip():
+        return None, None, "Field 'query' must be a non-empty string"
+    
+    # Extract top_k parameter
+    top_k = body.get("top_k", 3)
+    
+    try:
+        top_k = int(top_k)
+        if top_k < 1:
+            raise ValueError
+    except (ValueError, TypeError):
+        return None, None, "Field 'top_k' must be a positive integer"
+    
+    return query_text, top_k, None
+
+
+def format_results(query_text, ranked_results):  # Response body for one ranked query
+    output = [
+        {
+            "rank": rank,
+            "document_id": doc_id,
+            "score": round(float(score), 6)
+        }
+        for rank, doc_id, score in ranked_results
+    ]
+    return {
+        "query": query_text,
+        "count": len(output),
+        "results": output
+    }
+
+
 @app.route("/search", methods=["POST"])  # Search endpoint - accepts query and top_k, returns ranked documents with scores
 def search():
     try:
@@ -39,62 +181,112 @@ def search():
             }), 400
         
         body = request.get_json(silent=True)
-        
-        if not body:
+        query_text, top_k, error = parse_search_request(body)
+        if error:
             return jsonify({
-                "error": "Missing JSON payload"
+                "error": error
             }), 400
+        g.timings.lap("validate")
         
-        # Extract query
-        query_text = body.get("query")
-        
-        if not query_text:
+        # Check if index is loaded (one reference for the whole request, even if a reload swaps it)
+        processor = query_processor
+        if processor is None:
             return jsonify({
-                "error": "Field 'query' is required"
-            }), 400
+                "error": "Search index not initialized"
+            }), 503
+        
+        # Process query
+        ranked_results = processor.process_query(query_text, top_k=top_k, timings=g.timings)
+        
+        output = format_results(query_text, ranked_results)
+        g.timings.lap("format")
+        response = jsonify(output)
+        g.timings.lap("serialize")
+        return response, 200
+        
+    except HTTPException:
+        raise  # e.g. 413 for bodies over MAX_CONTENT_LENGTH
+    except Exception as e:
+        return jsonify({
+            "error": f"Internal server error: {str(e)}"
+        }), 500
+
+
+def parse_batch_queries(body):  # Validate a /search/batch payload; returns (query texts, per-query top_k, error message)
+    if not isinstance(body, dict):
+        return None, None, "Missing JSON payload"
+    queries = body.get("queries")
+    if not isinstance(queries, list) or not queries:
+        return None, None, "Field 'queries' must be a non-empty list"
+    if len(queries) > MAX_BATCH_QUERIES:
+        return None, None, f"At most {MAX_BATCH_QUERIES} queries per batch"
+    
+    default_top_k = body.get("top_k", 3)
+    query_texts = []
+    top_ks = []
+    for position, item in enumerate(queries):
+        # Each item is a query string or an object with "query" and an optional "top_k"
+        if isinstance(item, dict):
+            query_text = item.get("query")
+            top_k = item.get("top_k", default_top_k)
+        else:
+            query_text = item
+            top_k = default_top_k
         
         if not isinstance(query_text, str) or not query_text.strip():
+            return None, None, f"queries[{position}]: field 'query' must be a non-empty string"
+        if len(query_text) > MAX_QUERY_LENGTH:
+            return None, None, f"queries[{position}]: query longer than {MAX_QUERY_LENGTH} characters"
+        if isinstance(top_k, bool) or not isinstance(top_k, int) or not 1 <= top_k <= MAX_TOP_K:
+            return None, None, f"queries[{position}]: field 'top_k' must be an integer between 1 and {MAX_TOP_K}"
+        
+        query_texts.append(query_text)
+        top_ks.append(top_k)
+    
+    return query_texts, top_ks, None
+
+
+@app.route("/search/batch", methods=["POST"])  # Batch search - scores many queries together, results in request order
+def search_batch():
+    try:
+        if not request.is_json:
             return jsonify({
-                "error": "Field 'query' must be a non-empty string"
+                "error": "Content-Type must be application/json"
             }), 400
         
-        # Extract top_k parameter
-        top_k = body.get("top_k", 3)
-        
-        try:
-            top_k = int(top_k)
-            if top_k < 1:
-                raise ValueError
-        except (ValueError, TypeError):
+        body = request.get_json(silent=True)
+        query_texts, top_ks, error = parse_batch_queries(body)
+        if error:
             return jsonify({
-                "error": "Field 'top_k' must be a positive integer"
+                "error": error
             }), 400
+        g.timings.lap("validate")
         
-        # Check if index is loaded
-        if query_processor is None:
+        processor = query_processor
+        if processor is None:
             return jsonify({
                 "error": "Search index not initialized"
             }), 503
         
-        # Process query
-        ranked_results = query_processor.process_query(query_text)
+        # One vectorised pass over all queries instead of a process_query call each
+        batch_results = processor.process_queries(query_texts, top_k=top_ks)
+        g.timings.lap("score")
         
-        # Format results
         output = [
-            {
-                "rank": rank,
-                "document_id": doc_id,
-                "score": round(float(score), 6)
-            }
-            for rank, doc_id, score in ranked_results[:top_k]
+            format_results(query_text, ranked_results)
+            for query_text, ranked_results in zip(query_texts, batch_results)
         ]
+        g.timings.lap("format")
         
-        return jsonify({
-            "query": query_text,
+        response = jsonify({
             "count": len(output),
             "results": output
-        }), 200
+        })
+        g.timings.lap("serialize")
+        return response, 200
         
+    except HTTPException:
+        raise  # e.g. 413 for bodies over MAX_CONTENT_LENGTH
     except Exception as e:
         return jsonify({
             "error": f"Internal server error: {str(e)}"
@@ -103,19 +295,71 @@ def search():
 
 @app.route("/health", methods=["GET"]) # Health check - returns API status and number of indexed documents
 def health_check():
-   
-    if query_processor is None:
-        return jsonify({
+    body, status = health_status()
+    return jsonify(body), status
+
+
+def health_status():  # /health response body and status code
+    processor = query_processor
+    if processor is None:
+        return {
             "status": "unhealthy",
             "message": "Index not loaded",
             "documents_loaded": 0
-        }), 503
+        }, 503
     
-    return jsonify({
+    return {
         "status": "healthy",
         "message": "API is running",
-        "documents_loaded": len(query_processor.document_ids)
-    }), 200
+        "documents_loaded": len(processor.document_ids),
+        "index_version": processor.index_version,
+        "reload": index_reloader.status() if index_reloader is not None else None,
+        "cache": result_cache.stats() if result_cache is not None else None
+    }, 200
+
+
+@app.route("/metrics", methods=["GET"])  # Prometheus scrape endpoint - request counts, latency histograms, cache and index gauges
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.route("/admin/reload", methods=["POST"])  # Reload the index from disk while the current one keeps serving
+def admin_reload():
+    # Requires the X-Admin-Token header when IR_ADMIN_TOKEN is set, otherwise a local request
+    admin_token = os.environ.get("IR_ADMIN_TOKEN")
+    if admin_token:
+        if request.headers.get("X-Admin-Token") != admin_token:
+            return jsonify({
+                "error": "Invalid admin token"
+            }), 403
+    elif request.remote_addr not in ("127.0.0.1", "::1"):
+        return jsonify({
+            "error": "Reload is only allowed from localhost unless IR_ADMIN_TOKEN is set"
+        }), 403
+    
+    if index_reloader is None:
+        return jsonify({
+            "error": "Search index not initialized"
+        }), 503
+    
+    body = request.get_json(silent=True) or {}
+    wait = bool(body.get("wait", False))
+    if not index_reloader.reload(wait=wait):
+        return jsonify({
+            "error": "A reload is already in progress"
+        }), 409
+    
+    if wait:
+        processor = query_processor
+        status = 200 if index_reloader.last_reload.get("status") == "ok" else 500
+        return jsonify({
+            "index_version": processor.index_version,
+            "reload": index_reloader.status()
+        }), status
+    return jsonify({
+        "message": "Reload started",
+        "reload": index_reloader.status()
+    }), 202
 
 @app.route("/api/info", methods=["GET"])
 def api_info():
@@ -127,15 +371,30 @@ def api_info():
             "/": "Web interface",
             "/health": "Health check",
             "/search": "Search documents (POST)",
+            "/search/batch": f"Search up to {MAX_BATCH_QUERIES} queries at once (POST)",
+            "/admin/reload": "Reload the index without downtime (POST)",
+            "/metrics": "Prometheus metrics",
             "/api/info": "API info"
         }
     }), 200
 
 
-def run_api(host="0.0.0.0", port=5000, debug=False, index_path="data/output/index.json"):
-   # Start the Flask server with the web interface and load the index   
+def create_app(index_path=None, cache_size=1024, cache_ttl=None, watch_interval=None):
+    # App factory for WSGI servers (e.g. gunicorn --preload "api.app:create_app()"): loads the index
+    # into this process and returns the app. cache_size=0 disables the result cache; watch_interval
+    # (seconds) hot-reloads the index when it is rebuilt.
+    global result_cache
+    index_path = index_path or default_index_path()
+    result_cache = QueryResultCache(max_entries=cache_size, ttl_seconds=cache_ttl) if cache_size else None
+    initialize_index(index_path, watch_interval=watch_interval)  # Load index 
+    return app
+
+
+def run_api(host="0.0.0.0", port=5000, debug=False, index_path=None,
+            cache_size=1024, cache_ttl=None, watch_interval=5):
+   # Start the Flask development server with the web interface and load the index (see api/serve.py for production)
     print("Information retrieval Search Engine")
-    initialize_index(index_path)  # Load index 
+    create_app(index_path, cache_size=cache_size, cache_ttl=cache_ttl, watch_interval=watch_interval)
     app.run(host=host, port=port, debug=debug)
 
 if __name__ == "__main__":
@@ -143,6 +402,5 @@ if __name__ == "__main__":
     run_api(
         host="0.0.0.0",
         port=5000,
-        debug=True,
-        index_path="data/output/index.json"
+        debug=True
     )
\ No newline at end of file
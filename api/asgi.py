@@ -0,0 +1,310 @@
+# Async API - ASGI route layer that scores searches on a bounded thread pool with micro-batching
+
+import asyncio
+import functools
+import io
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import api.app as api_app
+from src.metrics import StageTimings
+
+ROUTES = {("POST", "/search"), ("POST", "/search/batch"), ("GET", "/health"), ("GET", "/metrics")}
+
+
+class MicroBatcher:
+    # Coalesces concurrent searches into batched scoring calls on a bounded thread pool. A request
+    # is dispatched at once while a worker thread is free, so an idle server adds no latency; while
+    # every worker is busy, new requests queue up and leave together as one batch (up to
+    # max_batch_size) when a worker frees up. window_ms > 0 additionally holds requests for that
+    # long to form larger batches. NumPy and SciPy release the GIL in the scoring kernels, so the
+    # worker threads overlap while the event loop keeps accepting requests.
+    def __init__(self, score_batch: Callable[[List[str], List[int]], List], max_workers: int = 4,
+                 max_batch_size: int = 64, window_ms: float = 0.0):
+        self.score_batch = score_batch
+        self.max_workers = max_workers
+        self.max_batch_size = max_batch_size
+        self.window = window_ms / 1000
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="search")
+        self.requests = 0
+        self.batches = 0
+        self.largest_batch = 0
+        self._pending: List[Tuple[str, int, asyncio.Future]] = []
+        self._in_flight = 0
+        self._timer = None
+
+    async def submit(self, query_text: str, top_k: int):  # Result of score_batch for this one query
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((query_text, top_k, future))
+        self.requests += 1
+        if not self.window or len(self._pending) >= self.max_batch_size:
+            self._dispatch(loop)
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._on_window_end, loop)
+        return await future
+
+    def _on_window_end(self, loop) -> None:
+        self._timer = None
+        self._dispatch(loop)
+
+    def _dispatch(self, loop) -> None:  # Hand pending requests to free workers, one batch per worker
+        while self._pending and self._in_flight < self.max_workers:
+            batch = self._pending[:self.max_batch_size]
+            del self._pending[:self.max_batch_size]
+            self._in_flight += 1
+            self.batches += 1
+            self.largest_batch = max(self.largest_batch, len(batch))
+            task = loop.run_in_executor(self.executor, self.score_batch,
+                                        [query_text for query_text, _, _ in batch],
+                                        [top_k for _, top_k, _ in batch])
+            task.add_done_callback(functools.partial(self._on_batch_done, loop, batch))
+        if not self._pending and self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _on_batch_done(self, loop, batch, task) -> None:
+        self._in_flight -= 1
+        error = task.exception()
+        for position, (_, _, future) in enumerate(batch):
+            if future.done():  # Client went away
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(task.result()[position])
+        self._dispatch(loop)  # Requests that queued meanwhile leave as the next batch
+
+    def stats(self) -> Dict:
+        return {
+            "workers": self.max_workers,
+            "max_batch_size": self.max_batch_size,
+            "window_ms": self.window * 1000,
+            "requests": self.requests,
+            "batches": self.batches,
+            "average_batch_size": self.requests / self.batches if self.batches else 0.0,
+            "largest_batch": self.largest_batch,
+            "queued": len(self._pending),
+            "in_flight": self._in_flight,
+        }
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=False)
+
+
+class IndexNotLoaded(Exception):
+    pass
+
+
+def score_and_serialize(query_texts: List[str], top_ks: List[int]) -> List[bytes]:
+    # Runs on a worker thread: scores the batch in one vectorised pass and encodes every /search
+    # response body there too, so JSON serialisation stays off the event loop
+    processor = api_app.query_processor  # One reference for the whole batch, even if a reload swaps it
+    if processor is None:
+        raise IndexNotLoaded()
+    batch_results = processor.process_queries(query_texts, top_k=top_ks)
+    return [
+        json.dumps(api_app.format_results(query_text, ranked_results)).encode("utf-8")
+        for query_text, ranked_results in zip(query_texts, batch_results)
+    ]
+
+
+class AsyncSearchApp:
+    # ASGI application serving /search (micro-batched), /search/batch, /health and /metrics with
+    # the same request and response formats as the Flask app. Every other request (the web UI,
+    # /api/info, /admin/reload, unknown paths) is handed to the Flask app itself on the thread
+    # pool. The index, result cache and hot reload are those set up by api.app.create_app.
+    def __init__(self, batcher: MicroBatcher):
+        self.batcher = batcher
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+        if api_app.index_reloader is not None:
+            api_app.index_reloader.ensure_watching()
+
+        route = (scope["method"], scope["path"])
+        if route not in ROUTES:
+            await self._call_flask(scope, receive, send)  # Flask records its own request metrics
+            return
+
+        timings = StageTimings()
+        content_type = b"application/json"
+        try:
+            if route == ("POST", "/search"):
+                status, body = await self._search(scope, receive, timings)
+            elif route == ("POST", "/search/batch"):
+                status, body = await self._search_batch(scope, receive, timings)
+            elif route == ("GET", "/health"):
+                health, status = api_app.health_status()
+                health["async"] = self.batcher.stats()
+                body = json.dumps(health).encode("utf-8")
+            else:
+                status, body = 200, api_app.metrics.render().encode("utf-8")
+                content_type = b"text/plain; version=0.0.4; charset=utf-8"
+        except IndexNotLoaded:
+            status, body = 503, _error("Search index not initialized")
+        except Exception as e:
+            status, body = 500, _error(f"Internal server error: {str(e)}")
+
+        headers = [(b"content-type", content_type), (b"content-length", str(len(body)).encode("ascii"))]
+        requested = any(name.lower() == b"x-timing" for name, _ in scope.get("headers", []))
+        if api_app.app.config["TIMING_HEADER"] or requested:
+            headers.append((b"x-timing", timings.header().encode("ascii")))
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
+        self._record(route, status, timings)
+
+    async def _call_flask(self, scope, receive, send) -> None:  # Serve the request with the Flask (WSGI) app
+        chunks = []
+        while True:
+            message = await receive()
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                break
+        environ = _wsgi_environ(scope, b"".join(chunks))
+        loop = asyncio.get_running_loop()
+        status, headers, body = await loop.run_in_executor(self.batcher.executor, _run_wsgi, api_app.app, environ)
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
+
+    @staticmethod
+    def _record(route, status, timings) -> None:  # Same metrics as the Flask app's record_request_metrics
+        endpoint = route[1]
+        metrics = api_app.metrics
+        metrics.inc("ir_http_requests_total", (("endpoint", endpoint), ("method", route[0]), ("status", str(status))))
+        if status >= 500:
+            metrics.inc("ir_http_request_errors_total", (("endpoint", endpoint),))
+        for stage, seconds in timings.stages.items():
+            metrics.observe("ir_search_stage_duration_seconds", seconds, (("endpoint", endpoint), ("stage", stage)))
+        metrics.observe("ir_http_request_duration_seconds", timings.total(), (("endpoint", endpoint),))
+
+    async def _search(self, scope, receive, timings: StageTimings) -> Tuple[int, bytes]:
+        payload, error = await _read_json(scope, receive)
+        if error:
+            return error
+        query_text, top_k, message = api_app.parse_search_request(payload)
+        if message:
+            return 400, _error(message)
+        timings.lap("validate")
+        body = await self.batcher.submit(query_text, top_k)
+        timings.lap("batch")  # Queueing, batched scoring and serialisation on the thread pool
+        return 200, body
+
+    async def _search_batch(self, scope, receive, timings: StageTimings) -> Tuple[int, bytes]:
+        payload, error = await _read_json(scope, receive)
+        if error:
+            return error
+        query_texts, top_ks, message = api_app.parse_batch_queries(payload)
+        if message:
+            return 400, _error(message)
+        timings.lap("validate")
+        # Already a batch: score it directly on the pool rather than through the batcher
+        loop = asyncio.get_running_loop()
+        bodies = await loop.run_in_executor(self.batcher.executor, score_and_serialize, query_texts, top_ks)
+        timings.lap("batch")
+        return 200, b'{"count": %d, "results": [%s]}' % (len(bodies), b", ".join(bodies))
+
+    async def _lifespan(self, receive, send) -> None:
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.batcher.shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+def _wsgi_environ(scope, body: bytes) -> Dict:  # WSGI environ for an ASGI HTTP request (PEP 3333)
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client")
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    if client:
+        environ["REMOTE_ADDR"] = client[0]
+    for name, value in scope.get("headers", []):
+        key = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if key == "CONTENT_TYPE":
+            environ[key] = value
+        elif key != "CONTENT_LENGTH":  # Set from the body actually received
+            key = f"HTTP_{key}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def _run_wsgi(wsgi_app, environ) -> Tuple[int, List[Tuple[bytes, bytes]], bytes]:  # (status, headers, body) of one WSGI call
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response["status"] = int(status.split(" ", 1)[0])
+        response["headers"] = [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers]
+
+    result = wsgi_app(environ, start_response)
+    try:
+        body = b"".join(result)
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+    return response["status"], response["headers"], body
+
+
+async def _read_json(scope, receive) -> Tuple[Optional[Dict], Optional[Tuple[int, bytes]]]:
+    # Request body as parsed JSON (None if it is not valid JSON), or an (status, body) error
+    # response. Whether the payload is usable is left to the request validators shared with Flask.
+    headers = dict(scope.get("headers", []))
+    content_type = headers.get(b"content-type", b"").split(b";")[0].strip()
+    if content_type != b"application/json" and not content_type.endswith(b"+json"):
+        return None, (400, _error("Content-Type must be application/json"))
+
+    max_length = api_app.app.config["MAX_CONTENT_LENGTH"]
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > max_length:
+            return None, (413, _error("Request body too large"))
+        chunks.append(chunk)
+        if not message.get("more_body", False):
+            break
+    try:
+        payload = json.loads(b"".join(chunks))
+    except ValueError:
+        payload = None
+    return payload, None
+
+
+def _error(message: str) -> bytes:
+    return json.dumps({"error": message}).encode("utf-8")
+
+
+def create_asgi_app(index_path=None, threads: int = 4, max_batch_size: int = 64, window_ms: float = 0.0,
+                    cache_size: int = 1024, cache_ttl=None, watch_interval=None) -> AsyncSearchApp:
+    # ASGI app factory (e.g. uvicorn --factory api.asgi:create_asgi_app); loads the index like create_app
+    api_app.create_app(index_path, cache_size=cache_size, cache_ttl=cache_ttl, watch_interval=watch_interval)
+    return AsyncSearchApp(MicroBatcher(score_and_serialize, max_workers=threads,
+                                       max_batch_size=max_batch_size, window_ms=window_ms))
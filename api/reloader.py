@@ -0,0 +1,109 @@
+# Index hot reload - loads a rebuilt index in the background and swaps it in without interrupting searches
+
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+from src.index_format import META_FILE, SHARDS_FILE
+
+
+def index_signature(index_path: str) -> Optional[str]:  # Identifies the index build at index_path (None while it is missing)
+    path = Path(index_path)
+    try:
+        if path.is_dir():
+            # A sharded index is identified by its top-level shards.json, a single index by meta.json
+            manifest = path / (SHARDS_FILE if (path / SHARDS_FILE).is_file() else META_FILE)
+            with manifest.open("r", encoding="utf-8") as f:
+                meta = json.load(f)
+            # Indexes written before index_id existed fall back to the time the manifest was written
+            return meta.get("index_id") or str(manifest.stat().st_mtime_ns)
+        stat = path.stat()  # Legacy single-file JSON index
+        return f"{stat.st_mtime_ns}-{stat.st_size}"
+    except (OSError, ValueError):
+        return None  # Missing, or caught mid-replacement
+
+
+class IndexReloader:
+    # Keeps the served processor in step with the index on disk. reload() builds a new processor
+    # with load_processor while the current one keeps serving, then hands it to install() - a
+    # single reference assignment, so a request sees either the old or the new index, never a
+    # half-loaded one. With poll_interval set, a watcher thread reloads whenever the index
+    # signature changes (e.g. after run_pipeline rebuilds it). Reloads never run concurrently.
+    def __init__(self, index_path: str, load_processor: Callable, install: Callable,
+                 poll_interval: Optional[float] = None):
+        self.index_path = index_path
+        self.load_processor = load_processor
+        self.install = install
+        self.poll_interval = poll_interval
+        self.signature = None
+        self.loads = 0
+        self.last_reload: Dict = {}
+        self._lock = threading.Lock()
+        self._watcher_pid = None
+        self._watcher_lock = threading.Lock()
+
+    def reload(self, wait: bool = True, force: bool = True) -> bool:
+        # Load and install the index; returns False if a reload is already running (or, with
+        # force=False, if the index is unchanged). Without wait the load runs on a background thread.
+        if not self._lock.acquire(blocking=False):
+            return False
+        signature = index_signature(self.index_path)
+        if not force and (signature is None or signature == self.signature):
+            self._lock.release()
+            return False
+        if wait:
+            self._reload(signature)
+        else:
+            threading.Thread(target=self._reload, args=(signature,), name="index-reload", daemon=True).start()
+        return True
+
+    def _reload(self, signature: Optional[str]) -> None:  # Runs with self._lock held; releases it when done
+        started = time.perf_counter()
+        try:
+            processor = self.load_processor(self.index_path)
+            self.install(processor)
+            self.loads += 1
+            self.last_reload = {"status": "ok", "error": None}
+        except Exception as e:
+            self.last_reload = {"status": "failed", "error": str(e)}
+            print(f"\nIndex reload failed, still serving the previous index: {e}")
+            if not self.loads:
+                raise  # Nothing to fall back to on the initial load
+        finally:
+            self.signature = signature  # Not retried until the index changes again
+            self.last_reload.update({
+                "duration_seconds": round(time.perf_counter() - started, 3),
+                "completed_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            })
+            self._lock.release()
+
+    def ensure_watching(self) -> None:
+        # Start the watcher thread in this process. Threads do not survive fork, so pre-forked
+        # server workers call this on their first request to get their own watcher.
+        if not self.poll_interval or self._watcher_pid == os.getpid():
+            return
+        with self._watcher_lock:
+            if self._watcher_pid != os.getpid():
+                self._watcher_pid = os.getpid()
+                threading.Thread(target=self._watch, name="index-watcher", daemon=True).start()
+
+    def _watch(self) -> None:
+        while True:
+            time.sleep(self.poll_interval)
+            if index_signature(self.index_path) != self.signature:
+                try:
+                    self.reload(force=False)
+                except Exception:
+                    pass  # Already reported in last_reload
+
+    def status(self) -> Dict:
+        return {
+            "index_path": str(self.index_path),
+            "reloading": self._lock.locked(),
+            "loads": self.loads,
+            "watch_interval_seconds": self.poll_interval,
+            "last_reload": self.last_reload,
+        }
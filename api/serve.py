@@ -0,0 +1,109 @@
+# Production server - runs the API on a multi-worker WSGI server with the index loaded once and shared
+
+import argparse
+import os
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from api.app import create_app, default_index_path
+from api.asgi import create_asgi_app
+from src.inverted_index import ensure_postings
+
+SERVERS = ("gunicorn", "waitress", "uvicorn")
+
+
+def prepare_index(index_path: str) -> None:
+    # Store the term-major postings next to the index (once) before the app loads it, so every
+    # worker memory-maps them from the page cache instead of building a private transposed copy
+    # of the matrix. Reloads do the same for a rebuilt index (see api.app.load_processor).
+    ensure_postings(index_path)
+
+
+def run_gunicorn(app, bind: str, workers: int, threads: int, timeout: int) -> None:
+    # Pre-fork server: the app (and its memory-mapped index) is loaded in the master before the
+    # workers fork, so they share its pages copy-on-write
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        raise SystemExit("gunicorn is not installed - run: pip install gunicorn (or use --server waitress)")
+
+    class PreloadedApplication(BaseApplication):
+        def load_config(self):
+            options = {"bind": bind, "workers": workers, "threads": threads,
+                       "timeout": timeout, "preload_app": True}
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return app
+
+    PreloadedApplication().run()
+
+
+def run_waitress(app, bind: str, threads: int) -> None:
+    # Single process, multi-threaded server (also runs on Windows)
+    try:
+        from waitress import serve
+    except ImportError:
+        raise SystemExit("waitress is not installed - run: pip install waitress (or use --server gunicorn)")
+    serve(app, listen=bind, threads=threads)
+
+
+def run_uvicorn(app, bind: str) -> None:
+    # Single process asyncio server for the ASGI app: requests are micro-batched onto its thread pool
+    try:
+        import uvicorn
+    except ImportError:
+        raise SystemExit("uvicorn is not installed - run: pip install uvicorn (or use --server gunicorn)")
+    host, port = bind.rsplit(":", 1)
+    uvicorn.run(app, host=host, port=int(port))
+
+
+def main():
+    # Every option can also be set through the environment, for container deployments
+    parser = argparse.ArgumentParser(description="Serve the IR Search API in production")
+    parser.add_argument("--server", choices=SERVERS,
+                        default=os.environ.get("IR_SERVER", "waitress" if os.name == "nt" else "gunicorn"),
+                        help="WSGI server (default: gunicorn, waitress on Windows)")
+    parser.add_argument("--bind", default=os.environ.get("IR_BIND", "0.0.0.0:5000"),
+                        help="host:port to listen on (default: 0.0.0.0:5000)")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WEB_CONCURRENCY", os.cpu_count() or 1)),
+                        help="Worker processes, gunicorn only (default: WEB_CONCURRENCY or all cores)")
+    parser.add_argument("--threads", type=int, default=int(os.environ.get("IR_THREADS", 4)),
+                        help="Request threads per worker (default: 4)")
+    parser.add_argument("--timeout", type=int, default=int(os.environ.get("IR_TIMEOUT", 30)),
+                        help="Worker timeout in seconds, gunicorn only (default: 30)")
+    parser.add_argument("--index", help="Index directory (default: IR_INDEX_PATH, or data/output/index once built)")
+    parser.add_argument("--cache-size", type=int, default=int(os.environ.get("IR_CACHE_SIZE", 1024)),
+                        help="Result cache entries per worker, 0 disables (default: 1024)")
+    parser.add_argument("--cache-ttl", type=float, default=os.environ.get("IR_CACHE_TTL"),
+                        help="Result cache TTL in seconds (default: none)")
+    parser.add_argument("--watch-interval", type=float, default=os.environ.get("IR_WATCH_INTERVAL", 5),
+                        help="Seconds between checks for a rebuilt index to hot-reload, 0 disables (default: 5)")
+    parser.add_argument("--max-batch-size", type=int, default=int(os.environ.get("IR_MAX_BATCH_SIZE", 64)),
+                        help="Most /search requests scored together, uvicorn only (default: 64)")
+    parser.add_argument("--batch-window-ms", type=float, default=os.environ.get("IR_BATCH_WINDOW_MS", 0),
+                        help="Extra time to wait for requests to batch, uvicorn only (default: 0)")
+    args = parser.parse_args()
+    args.index = args.index or default_index_path()
+
+    prepare_index(args.index)
+    if args.server == "uvicorn":
+        app = create_asgi_app(args.index, threads=args.threads, max_batch_size=args.max_batch_size,
+                              window_ms=args.batch_window_ms, cache_size=args.cache_size,
+                              cache_ttl=args.cache_ttl, watch_interval=args.watch_interval or None)
+    else:
+        app = create_app(args.index, cache_size=args.cache_size, cache_ttl=args.cache_ttl,
+                         watch_interval=args.watch_interval or None)
+    print(f"Serving on {args.bind} with {args.server} "
+          f"({args.workers if args.server == 'gunicorn' else 1} workers x {args.threads} threads)")
+    if args.server == "uvicorn":
+        run_uvicorn(app, args.bind)
+    elif args.server == "gunicorn":
+        run_gunicorn(app, args.bind, args.workers, args.threads, args.timeout)
+    else:
+        run_waitress(app, args.bind, args.threads)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+# Micro-benchmark for the HTML text extraction backends - reports docs/sec for each
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.utils import EXTRACTORS
+
+
+def bench_extractor(name, files, repeat=3):  # Best-of-repeat throughput of one backend in docs/sec
+    extract = EXTRACTORS[name]
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for path in files:
+            extract(path)
+        best = min(best, time.perf_counter() - start)
+    return len(files) / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Text extraction micro-benchmark")
+    parser.add_argument("corpus_dirs", nargs="*", default=["data/html_corpus", "data/wiki_corpus"],
+                        help="Directories of .html files to extract")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per backend (best is reported)")
+    args = parser.parse_args()
+
+    files = [path for corpus_dir in args.corpus_dirs for path in sorted(Path(corpus_dir).glob("*.html"))]
+    if not files:
+        print("No HTML files found")
+        return
+    size_mb = sum(path.stat().st_size for path in files) / 1e6
+    print(f"Extracting {len(files)} documents ({size_mb:.1f} MB)")
+
+    for name in EXTRACTORS:
+        docs_per_sec = bench_extractor(name, files, args.repeat)
+        print(f"  {name:5s} {docs_per_sec:8.1f} docs/sec  {docs_per_sec * size_mb / len(files):6.2f} MB/sec")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+# Benchmark suite - extraction, index build/save/load, query latency and /search throughput on synthetic corpora
+import argparse
+import json
+import multiprocessing
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.indexer import DocumentIndexer
+from src.index_format import index_size_bytes
+from src.profiler import peak_rss_bytes
+from src.query_processor import QueryProcessor
+from src.utils import read_clean_html, read_clean_html_lxml
+
+DEFAULT_WORK_DIR = "data/cache/bench"
+DEFAULT_OUTPUT_DIR = "data/output/benchmarks"
+VOCABULARY_SIZE = 50000
+SYLLABLES = ["ka", "lo", "mi", "ne", "ru", "ta", "shi", "vo", "den", "gar", "pel", "zu", "qua", "bri", "tor", "xen"]
+
+# Direction of every compared metric: -1 if lower is better (times, sizes, latencies), +1 if higher
+# is better (throughput). Metrics not listed (document, term and posting counts, top_k) describe
+# the workload, so changes to them are shown but never counted as regressions.
+METRIC_DIRECTIONS = {
+    "bs4_docs_per_sec": 1, "lxml_docs_per_sec": 1,
+    "build_seconds": -1, "build_peak_rss_bytes": -1, "build_peak_rss_delta_bytes": -1,
+    "save_seconds": -1, "index_size_bytes": -1,
+    "load_mmap_seconds": -1, "load_full_seconds": -1,
+    "p50_ms": -1, "p95_ms": -1, "p99_ms": -1, "mean_ms": -1,
+    "queries_per_sec": 1, "batched_queries_per_sec": 1, "requests_per_sec": 1,
+}
+
+
+def synthetic_vocabulary(size=VOCABULARY_SIZE, seed=0):  # Deterministic pseudo-words
+    rng = random.Random(seed)
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def generate_corpus(corpus_dir, num_docs, seed=0, words_per_doc=300):
+    # Write num_docs HTML pages whose words follow a Zipf distribution, like natural text.
+    # Corpora are reused across runs: an existing complete corpus is not regenerated.
+    corpus_dir = Path(corpus_dir)
+    marker = corpus_dir / ".complete"
+    if marker.exists():
+        return corpus_dir
+    shutil.rmtree(corpus_dir, ignore_errors=True)
+    corpus_dir.mkdir(parents=True)
+
+    vocabulary = np.array(synthetic_vocabulary(seed=seed))
+    ranks = np.arange(1, len(vocabulary) + 1)
+    probabilities = 1 / ranks
+    probabilities /= probabilities.sum()
+    rng = np.random.default_rng(seed)
+    for doc_number in range(num_docs):
+        length = max(20, int(rng.normal(words_per_doc, words_per_doc / 3)))
+        words = vocabulary[rng.choice(len(vocabulary), size=length, p=probabilities)]
+        paragraphs = "".join(f"<p>{' '.join(words[start:start + 50])}</p>\n" for start in range(0, length, 50))
+        html = (f"<html><head><title>Document {doc_number}</title><style>p {{margin: 0}}</style></head>"
+                f"<body><script>var id = {doc_number};</script><h1>{words[0]} {words[1]}</h1>\n"
+                f"{paragraphs}</body></html>")
+        (corpus_dir / f"doc_{doc_number:07d}.html").write_text(html, encoding="utf-8")
+    marker.touch()
+    return corpus_dir
+
+
+def generate_queries(num_queries, seed=0):  # 1-4 word queries drawn from the head and tail of the vocabulary
+    vocabulary = synthetic_vocabulary(seed=seed)
+    rng = random.Random(seed + 1)
+    return [" ".join(vocabulary[min(int(rng.paretovariate(0.8)) - 1, len(vocabulary) - 1)]
+                     for _ in range(rng.randint(1, 4)))
+            for _ in range(num_queries)]
+
+
+def percentiles_ms(latencies_ns):
+    latencies_ms = np.asarray(latencies_ns) / 1e6
+    return {
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p95_ms": float(np.percentile(latencies_ms, 95)),
+        "p99_ms": float(np.percentile(latencies_ms, 99)),
+        "mean_ms": float(latencies_ms.mean()),
+    }
+
+
+def bench_extraction(files):  # docs/sec of each text extraction backend
+    results = {}
+    for name, extract in (("bs4", read_clean_html), ("lxml", read_clean_html_lxml)):
+        start = time.perf_counter()
+        for path in files:
+            extract(path)
+        elapsed = time.perf_counter() - start
+        results[f"{name}_docs_per_sec"] = len(files) / elapsed
+    results["documents"] = len(files)
+    return results
+
+
+def _build_in_child(corpus_dir, index_path, extractor, connection):
+    # Runs in a fresh process so peak RSS belongs to the build alone
+    baseline = peak_rss_bytes()
+    indexer = DocumentIndexer(extractor=extractor)
+    start = time.perf_counter()
+    stats = indexer.build_index(corpus_dir)
+    build_seconds = time.perf_counter() - start
+    build_peak = peak_rss_bytes()
+
+    start = time.perf_counter()
+    indexer.save_index(index_path)
+    save_seconds = time.perf_counter() - start
+    connection.send({
+        "build_seconds": build_seconds,
+        "build_peak_rss_bytes": build_peak,
+        "build_peak_rss_delta_bytes": build_peak - baseline if build_peak is not None else None,
+        "save_seconds": save_seconds,
+        "num_terms": stats["num_terms"],
+        "nnz": int(indexer.tfidf_matrix.nnz),
+    })
+    connection.close()
+
+
+def bench_build_and_save(corpus_dir, index_path, extractor):
+    receiver, sender = multiprocessing.get_context("spawn").Pipe(duplex=False)
+    process = multiprocessing.get_context("spawn").Process(
+        target=_build_in_child, args=(str(corpus_dir), str(index_path), extractor, sender))
+    process.start()
+    sender.close()
+    results = receiver.recv()
+    process.join()
+    results["index_size_bytes"] = index_size_bytes(index_path)
+    return results
+
+
+def bench_load(index_path, repeat=3):  # Best-of-repeat load time, memory-mapped and fully read
+    results = {}
+    for label, mmap in (("load_mmap_seconds", True), ("load_full_seconds", False)):
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            DocumentIndexer.load_index_data(str(index_path), mmap=mmap)
+            best = min(best, time.perf_counter() - start)
+        results[label] = best
+    return results
+
+
+def bench_queries(processor, queries, top_k=10):  # Per-query latency of process_query
+    for query in queries[:20]:  # Warm up
+        processor.process_query(query, top_k=top_k)
+    latencies = []
+    for query in queries:
+        start = time.perf_counter_ns()
+        processor.process_query(query, top_k=top_k)
+        latencies.append(time.perf_counter_ns() - start)
+    results = percentiles_ms(latencies)
+    results["queries_per_sec"] = len(queries) / (sum(latencies) / 1e9)
+    results["top_k"] = top_k
+
+    start = time.perf_counter()
+    processor.process_queries(queries, top_k=top_k)
+    results["batched_queries_per_sec"] = len(queries) / (time.perf_counter() - start)
+    return results
+
+
+def bench_search_api(index_path, queries, top_k=10):  # /search throughput through the Flask test client
+    import api.app as api_app
+    client = api_app.create_app(str(index_path), cache_size=0).test_client()
+    latencies = []
+    start = time.perf_counter()
+    for query in queries:
+        request_start = time.perf_counter_ns()
+        response = client.post("/search", json={"query": query, "top_k": top_k})
+        latencies.append(time.perf_counter_ns() - request_start)
+        if response.status_code != 200:
+            raise RuntimeError(f"/search returned {response.status_code}: {response.get_json()}")
+    results = percentiles_ms(latencies)
+    results["requests_per_sec"] = len(queries) / (time.perf_counter() - start)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run_suite(sizes, work_dir=DEFAULT_WORK_DIR, num_queries=1000, extract_sample=2000,
+              extractor="lxml", seed=0):
+    work_dir = Path(work_dir)
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "machine": {"python": platform.python_version(), "numpy": np.__version__,
+                    "platform": platform.platform(), "processor": platform.machine()},
+        "config": {"num_queries": num_queries, "extract_sample": extract_sample,
+                   "extractor": extractor, "seed": seed},
+        "sizes": {},
+    }
+    queries = generate_queries(num_queries, seed)
+
+    for size in sizes:
+        print(f"\n=== {size} documents ===")
+        corpus_dir = generate_corpus(work_dir / f"corpus-{size}-{seed}", size, seed)
+        index_path = work_dir / f"index-{size}-{seed}"
+        files = sorted(corpus_dir.glob("*.html"))
+        results = {"extraction": bench_extraction(files[:extract_sample])}
+        results["build"] = bench_build_and_save(corpus_dir, index_path, extractor)
+        results["load"] = bench_load(index_path)
+        processor = QueryProcessor.from_index(str(index_path))
+        results["query"] = bench_queries(processor, queries)
+        results["search_api"] = bench_search_api(index_path, queries)
+        report["sizes"][str(size)] = results
+        print_results(size, results)
+    return report
+
+
+def print_results(size, results):
+    print(f"\nResults for {size} documents:")
+    for stage, metrics in results.items():
+        for name, value in metrics.items():
+            print(f"  {stage:12s} {name:28s} {_format(value)}")
+
+
+def _format(value):
+    return f"{value:,.3f}" if isinstance(value, float) else f"{value:,}" if isinstance(value, int) else str(value)
+
+
+def compare_reports(baseline, current, threshold=0.1):
+    # Print every metric present in both reports with its relative change; returns the number of
+    # metrics that got worse by more than threshold in their METRIC_DIRECTIONS direction
+    regressions = 0
+    print(f"\nComparing {current['commit']} against {baseline['commit']}")
+    for size, stages in current["sizes"].items():
+        for stage, metrics in stages.items():
+            for name, value in metrics.items():
+                old = baseline["sizes"].get(size, {}).get(stage, {}).get(name)
+                if not isinstance(value, (int, float)) or not isinstance(old, (int, float)) or not old:
+                    continue
+                change = (value - old) / old
+                worse = change * METRIC_DIRECTIONS.get(name, 0) < -threshold
+                regressions += worse
+                flag = "  REGRESSION" if worse else ""
+                print(f"  {size:>8s} {stage:12s} {name:28s} {_format(old):>14s} -> {_format(value):>14s} "
+                      f"({change:+.1%}){flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Indexing and query benchmark suite")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000],
+                        help="Synthetic corpus sizes in documents (e.g. 1000 10000 100000 1000000)")
+    parser.add_argument("--queries", type=int, default=1000, help="Queries for latency and throughput")
+    parser.add_argument("--extract-sample", type=int, default=2000,
+                        help="Documents used for the extraction benchmark")
+    parser.add_argument("--extractor", choices=["bs4", "lxml"], default="lxml",
+                        help="Extractor used when building the index")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--work-dir", default=DEFAULT_WORK_DIR,
+                        help=f"Where synthetic corpora and indexes are kept (default: {DEFAULT_WORK_DIR})")
+    parser.add_argument("--output", help=f"Results JSON (default: {DEFAULT_OUTPUT_DIR}/bench-<commit>.json)")
+    parser.add_argument("--compare", help="Earlier results JSON to diff against")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="Relative change reported as a regression by --compare (default: 0.1)")
+    args = parser.parse_args()
+
+    report = run_suite(args.sizes, args.work_dir, args.queries, args.extract_sample, args.extractor, args.seed)
+    output = Path(args.output or f"{DEFAULT_OUTPUT_DIR}/bench-{report['commit']}.json")
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"\nResults saved: {output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            regressions = compare_reports(json.load(f), report, args.threshold)
+        print(f"\n{regressions} regression(s) beyond {args.threshold:.0%}")
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
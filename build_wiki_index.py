@@ -1,12 +1,13 @@
 """Build TF-IDF index for Wikipedia corpus"""
 from pathlib import Path
 from src.indexer import DocumentIndexer
+from src.text_cache import DEFAULT_TEXT_CACHE_DIR
 
 def build_wikipedia_index():
     """Build TF-IDF index for all Wikipedia pages"""
     
     wiki_corpus = Path('data/wiki_corpus')
-    output_file = Path('data/output/wiki_index.json')
+    output_file = Path('data/output/wiki_index')
     print("Building Wikipedia TF-IDF Index")    
     html_files = list(wiki_corpus.glob('*.html'))   # Count pages
     print(f"\nFound {len(html_files)} Wikipedia pages")
@@ -25,10 +26,11 @@ def build_wikipedia_index():
     indexer = DocumentIndexer(
         lowercase=True,
         stop_words='english',
-        norm='l2'
+        norm='l2',
+        cache_dir=DEFAULT_TEXT_CACHE_DIR  # Reuses text extracted by earlier builds of unchanged pages
     )
     indexer.build_index(corpus_dir='data/wiki_corpus')   # Build index from wiki_corpus directory 
-    indexer.save_index(output_path=str(output_file))  # Save to wiki_index.json 
+    indexer.save_index(output_path=str(output_file))  # Save to wiki_index/ 
     print(" Wikipedia index complete!")
     print(f"Indexed: {len(indexer.document_ids)} documents")
     print(f"Vocabulary: {len(indexer.vocabulary)} terms")
@@ -1,14 +1,21 @@
 # Main pipeline - runs crawler, indexer, and query processor in sequence
 import argparse
+from contextlib import nullcontext
 from pathlib import Path
 
+from src.compaction import PRECISIONS, compact_index, evaluate_compaction
 from src.crawler import run_crawler
 from src.indexer import build_and_save_index
+from src.profiler import DEFAULT_PROFILE_DIR, PipelineProfiler, stage
+from src.text_cache import DEFAULT_TEXT_CACHE_DIR
+from src.vocabulary import DEFAULT_TOKEN_PATTERN
 from src.query_processor import run_queries
 from src.utils import ensure_directories
 
 
-def run_full_pipeline(skip_crawler=False):  # Execute the complete IR pipeline.
+def run_full_pipeline(skip_crawler=False, workers=1, cache_dir=DEFAULT_TEXT_CACHE_DIR,
+                      near_duplicate_threshold=None, vocabulary_options=None, num_shards=1,
+                      compaction_options=None):  # Execute the complete IR pipeline.
 
     print("Information Retrieval Pipeline") 
     # Ensure all directories exist
@@ -23,7 +30,8 @@ def run_full_pipeline(skip_crawler=False):  # Execute the complete IR pipeline.
     if not skip_crawler:
         print("[STEP 1] Running Wikipedia Crawler (Demo Corpus)")
         try:
-            run_crawler(output_dir="data/wiki_corpus")
+            with stage("crawl"):
+                run_crawler(output_dir="data/wiki_corpus")
             print("\nCrawling completed successfully")
         except Exception as e:
             print(f"\nCrawling failed: {e}")
@@ -33,10 +41,16 @@ def run_full_pipeline(skip_crawler=False):  # Execute the complete IR pipeline.
     # Step 2: Build index for Wikipedia corpus (demo)
     print("[STEP 2] Building Index for Wikipedia Corpus (Demo)")
     try:
-        build_and_save_index(
-            corpus_dir="data/wiki_corpus",
-            output_path="data/output/wikipedia_index.json"
-        )
+        with stage("index:wikipedia"):
+            build_and_save_index(
+                corpus_dir="data/wiki_corpus",
+                output_path="data/output/wikipedia_index",
+                workers=workers,
+                cache_dir=cache_dir,
+                near_duplicate_threshold=near_duplicate_threshold,
+                vocabulary_options=vocabulary_options,
+                num_shards=num_shards
+            )
         print("\nWikipedia index built successfully")
     except Exception as e:
         print(f"\nWikipedia indexing failed: {e}")
@@ -44,14 +58,22 @@ def run_full_pipeline(skip_crawler=False):  # Execute the complete IR pipeline.
     print("[STEP 3] Building Index for Official Corpus ")
    
     try:
-        build_and_save_index(
-            corpus_dir="data/html_corpus",
-            output_path="data/output/index.json"
-        )
+        with stage("index:official"):
+            build_and_save_index(
+                corpus_dir="data/html_corpus",
+                output_path="data/output/index",
+                workers=workers,
+                cache_dir=cache_dir,
+                near_duplicate_threshold=near_duplicate_threshold,
+                vocabulary_options=vocabulary_options,
+                num_shards=num_shards
+            )
         print("\nOfficial index built successfully")
     except Exception as e:
         print(f"\nOfficial indexing failed: {e}")
         raise
+    if compaction_options:
+        run_compaction("data/output/index", compaction_options)
     
     # Step 4: Process queries
     
@@ -62,11 +84,12 @@ def run_full_pipeline(skip_crawler=False):  # Execute the complete IR pipeline.
         print(f"\n queries.csv not found at {queries_file.absolute()}")
     else:
         try:
-            run_queries(
-                index_path="data/output/index.json",
-                queries_csv="queries.csv",
-                output_csv="data/output/results.csv"
-            )
+            with stage("queries"):
+                run_queries(
+                    index_path="data/output/index",
+                    queries_csv="queries.csv",
+                    output_csv="data/output/results.csv"
+                )
             print("\nQuery processing completed successfully")
         except Exception as e:
             print(f"\nQuery processing failed: {e}")
@@ -77,8 +100,8 @@ def run_full_pipeline(skip_crawler=False):  # Execute the complete IR pipeline.
     print("Pipeline execution complete")
     print("\nGenerated artifacts:")
     print("data/wiki_corpus/              - Crawled Wikipedia pages")
-    print("data/output/wikipedia_index.json - Wikipedia TF-IDF index")
-    print("data/output/index.json          - Official TF-IDF index")
+    print("data/output/wikipedia_index/    - Wikipedia TF-IDF index")
+    print("data/output/index/              - Official TF-IDF index")
     print("data/output/results.csv         - Query results")
     print("\nNext steps:")
 
@@ -86,40 +109,67 @@ def run_crawler_only():
     """Run only the crawler component."""
     print("\n[Running Crawler Only]")
     ensure_directories("data/wiki_corpus")
-    run_crawler(output_dir="data/wiki_corpus")
+    with stage("crawl"):
+        run_crawler(output_dir="data/wiki_corpus")
     print("\n Crawler completed")
 
 
-def run_indexer_only(corpus_type="official"):  # Run only the indexer for specified corpus (official or wikipedia)
+def run_indexer_only(corpus_type="official", workers=1, incremental=False, cache_dir=DEFAULT_TEXT_CACHE_DIR,
+                     streaming=False, memory_budget_mb=256, near_duplicate_threshold=None,
+                     vocabulary_options=None, num_shards=1, compaction_options=None):  # Run only the indexer for specified corpus (official or wikipedia)
     print(f"\n[Running Indexer Only - {corpus_type.upper()}]")
     
     if corpus_type == "official":
-        build_and_save_index(
-            corpus_dir="data/html_corpus",
-            output_path="data/output/index.json"
-        )
+        corpus_dir, output_path = "data/html_corpus", "data/output/index"
     elif corpus_type == "wikipedia":
-        build_and_save_index(
-            corpus_dir="data/wiki_corpus",
-            output_path="data/output/wikipedia_index.json"
-        )
+        corpus_dir, output_path = "data/wiki_corpus", "data/output/wikipedia_index"
     else:
         raise ValueError("corpus_type must be 'official' or 'wikipedia'")
+    with stage(f"index:{corpus_type}"):
+        build_and_save_index(
+            corpus_dir=corpus_dir,
+            output_path=output_path,
+            workers=workers,
+            incremental=incremental,
+            cache_dir=cache_dir,
+            streaming=streaming,
+            memory_budget_mb=memory_budget_mb,
+            near_duplicate_threshold=near_duplicate_threshold,
+            vocabulary_options=vocabulary_options,
+            num_shards=num_shards
+        )
+    if compaction_options:
+        run_compaction(output_path, compaction_options)
     
     print("\nIndexer completed")
 
 
+def run_compaction(index_path, compaction_options):  # Write a compacted serving copy next to the index and compare its rankings on queries.csv
+    compact_path = f"{index_path}_compact"
+    print(f"\n[Compacting {index_path}]")
+    with stage("compact"):
+        compact_index(index_path, compact_path, **compaction_options)
+    if Path("queries.csv").exists():
+        with stage("evaluate:compaction"):
+            evaluate_compaction(index_path, compact_path, "queries.csv")
+
+
 def run_query_processor_only():  # Run only the query processor component.
     print("\n[Running Query Processor Only]")
     
-    run_queries(
-        index_path="data/output/index.json",
-        queries_csv="queries.csv",
-        output_csv="data/output/results.csv"
-    )
+    with stage("queries"):
+        run_queries(
+            index_path="data/output/index",
+            queries_csv="queries.csv",
+            output_csv="data/output/results.csv"
+        )
     print("\nQuery processor completed")
 
 
+def document_frequency(value):  # argparse type for --min-df/--max-df: a document count, or a fraction with a decimal point
+    return float(value) if "." in value else int(value)
+
+
 def main():
     # Set up command line arguments
     parser = argparse.ArgumentParser(description="IR System Pipeline Runner")
@@ -136,18 +186,81 @@ def main():
     parser.add_argument("--corpus", choices=["official", "wikipedia"], 
                        default="official",
                        help="Which corpus to index (default: official)")
+    parser.add_argument("--workers", type=int, default=1,
+                       help="Processes for HTML text extraction (0 = all cores, default: 1)")
+    parser.add_argument("--text-cache", default=DEFAULT_TEXT_CACHE_DIR,
+                       help=f"Extracted-text cache directory (default: {DEFAULT_TEXT_CACHE_DIR})")
+    parser.add_argument("--no-text-cache", action="store_true",
+                       help="Always re-extract text from HTML")
+    parser.add_argument("--incremental", action="store_true",
+                       help="With --indexer-only: update the existing index, re-reading only changed files")
+    parser.add_argument("--streaming", action="store_true",
+                       help="With --indexer-only: build the index in constant memory, spilling to disk")
+    parser.add_argument("--memory-budget", type=float, default=256,
+                       help="Memory budget in MB for --streaming builds (default: 256)")
+    parser.add_argument("--dedup", type=float, nargs="?", const=0.8, metavar="THRESHOLD",
+                       help="Leave near-duplicate documents out of the index (MinHash Jaccard similarity, default 0.8)")
+    parser.add_argument("--min-df", type=document_frequency, default=1,
+                       help="Drop terms in fewer documents than this (count, or fraction like 0.001; default: 1)")
+    parser.add_argument("--max-df", type=document_frequency, default=1.0,
+                       help="Drop terms in more documents than this (count, or fraction like 0.5; default: 1.0)")
+    parser.add_argument("--max-features", type=int, default=None,
+                       help="Keep only this many of the most frequent terms")
+    parser.add_argument("--token-pattern", default=DEFAULT_TOKEN_PATTERN,
+                       help="Token regular expression, or 'words' to drop numbers and markup debris")
+    parser.add_argument("--shards", type=int, default=1,
+                       help="Split the index into this many shards, searched by one worker process each (default: 1)")
+    parser.add_argument("--compact", choices=[precision for precision in PRECISIONS if precision != "float64"],
+                       help="Also write a compacted serving copy of the index (<index>_compact) with float32 or 8-bit weights")
+    parser.add_argument("--keep-fraction", type=float, default=1.0,
+                       help="With --compact: keep this fraction of each document's highest-weight terms (default: 1.0)")
+    parser.add_argument("--profile", action="store_true",
+                       help="Record wall time, CPU time and peak RSS per step and print a summary table")
+    parser.add_argument("--cprofile", action="store_true",
+                       help="With --profile: write a cProfile .prof file per stage")
+    parser.add_argument("--tracemalloc", action="store_true",
+                       help="With --profile: trace Python allocations and write top allocations per stage")
+    parser.add_argument("--profile-dir", default=DEFAULT_PROFILE_DIR,
+                       help=f"Where profile files and summary.json go (default: {DEFAULT_PROFILE_DIR})")
     
     args = parser.parse_args()
+    if args.streaming and args.shards > 1:  # Streaming builds write a single binary index
+        parser.error("--streaming cannot be combined with --shards")
+    if args.streaming and args.incremental:
+        parser.error("--streaming cannot be combined with --incremental")
+    if args.compact and args.shards > 1:  # Checked before the build: only a single binary index can be compacted
+        parser.error("--compact cannot be combined with --shards")
+    cache_dir = None if args.no_text_cache else args.text_cache
+    vocabulary_options = {"token_pattern": args.token_pattern, "min_df": args.min_df,
+                          "max_df": args.max_df, "max_features": args.max_features}
+    compaction_options = None
+    if args.compact:
+        compaction_options = {"precision": args.compact, "keep_fraction": args.keep_fraction}
+    profiling = args.profile or args.cprofile or args.tracemalloc
+    profiler = PipelineProfiler(args.profile_dir, cprofile=args.cprofile, trace_memory=args.tracemalloc)
     
     # Run the requested component(s)
-    if args.crawler_only:
-        run_crawler_only()
-    elif args.indexer_only:
-        run_indexer_only(args.corpus)
-    elif args.query_only:
-        run_query_processor_only()
-    else:
-        run_full_pipeline(skip_crawler=args.skip_crawler)
+    try:
+        with profiler if profiling else nullcontext():
+            if args.crawler_only:
+                run_crawler_only()
+            elif args.indexer_only:
+                run_indexer_only(args.corpus, workers=args.workers, incremental=args.incremental,
+                                 cache_dir=cache_dir, streaming=args.streaming,
+                                 memory_budget_mb=args.memory_budget, near_duplicate_threshold=args.dedup,
+                                 vocabulary_options=vocabulary_options, num_shards=args.shards,
+                                 compaction_options=compaction_options)
+            elif args.query_only:
+                run_query_processor_only()
+            else:
+                run_full_pipeline(skip_crawler=args.skip_crawler, workers=args.workers, cache_dir=cache_dir,
+                                  near_duplicate_threshold=args.dedup, vocabulary_options=vocabulary_options,
+                                  num_shards=args.shards, compaction_options=compaction_options)
+    finally:
+        if profiling:  # Also after a failed step, to show where the time went
+            print("\nProfile summary")
+            print(profiler.summary_table())
+            print(f"\nProfile saved: {profiler.save_summary()}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,167 @@
+# Index compaction - float32 or 8-bit quantised weights and static pruning for a low-memory serving index
+
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from scipy import sparse
+
+try:
+    from src.index_format import index_size_bytes, is_binary_index, read_index, write_index
+    from src.query_processor import QueryProcessor, load_queries
+except ModuleNotFoundError:
+    from index_format import index_size_bytes, is_binary_index, read_index, write_index
+    from query_processor import QueryProcessor, load_queries
+
+PRECISIONS = ("float64", "float32", "uint8")
+QUANTIZATION_LEVELS = 255  # uint8 codes: a document's largest weight becomes 255
+
+
+def prune_documents(matrix, keep_fraction: float) -> sparse.csr_matrix:
+    # Document-centric static pruning: every document keeps the ceil(keep_fraction * n) of its n
+    # postings with the highest weights (ties: lower term ID), so each keeps at least one term
+    if not 0 < keep_fraction <= 1:
+        raise ValueError("keep_fraction must be greater than 0 and at most 1")
+    matrix = sparse.csr_matrix(matrix)
+    matrix.sort_indices()
+    if keep_fraction == 1:
+        return matrix
+
+    lengths = np.diff(matrix.indptr)
+    keep = np.ceil(lengths * keep_fraction - 1e-9).astype(np.int64)  # 1e-9: 10 * 0.3 keeps 3, not 4
+    keep = np.where(lengths > 0, np.maximum(keep, 1), 0)
+    rows = np.repeat(np.arange(matrix.shape[0]), lengths)
+    order = np.lexsort((matrix.indices, -matrix.data, rows))
+    rank_in_row = np.empty(matrix.nnz, dtype=np.int64)
+    rank_in_row[order] = np.arange(matrix.nnz) - np.repeat(matrix.indptr[:-1], lengths)
+    kept = rank_in_row < keep[rows]  # Postings stay in term order within each row
+
+    indptr = np.zeros(matrix.shape[0] + 1, dtype=np.int64)
+    np.cumsum(keep, out=indptr[1:])
+    return sparse.csr_matrix((matrix.data[kept], matrix.indices[kept], indptr), shape=matrix.shape)
+
+
+def quantize_rows(matrix) -> Tuple[sparse.csr_matrix, np.ndarray]:
+    # 8-bit codes with one scale per document: weight ~= code * scale, with the document's largest
+    # weight coded as 255, so the rounding error is at most 1/510 of that weight. Weights that
+    # round to code 0 are dropped from the matrix.
+    matrix = sparse.csr_matrix(matrix)
+    if matrix.nnz and matrix.data.min() < 0:
+        raise ValueError("8-bit quantisation needs non-negative weights")
+    lengths = np.diff(matrix.indptr)
+    maxima = np.zeros(matrix.shape[0])
+    nonempty = lengths > 0
+    if matrix.nnz:
+        maxima[nonempty] = np.maximum.reduceat(matrix.data, matrix.indptr[:-1][nonempty])
+    scales = maxima / QUANTIZATION_LEVELS
+
+    divisors = np.repeat(np.where(scales > 0, scales, 1.0), lengths)
+    codes = np.rint(matrix.data / divisors).astype(np.uint8)
+    quantized = sparse.csr_matrix((codes, matrix.indices.copy(), matrix.indptr.copy()), shape=matrix.shape)
+    quantized.eliminate_zeros()
+    return quantized, scales
+
+
+def compact_matrix(matrix, precision: str = "uint8",
+                   keep_fraction: float = 1.0) -> Tuple[sparse.csr_matrix, Optional[np.ndarray]]:  # (compacted matrix, per-document scales of uint8 codes or None)
+    if precision not in PRECISIONS:
+        raise ValueError(f"precision must be one of {', '.join(PRECISIONS)}")
+    pruned = prune_documents(matrix, keep_fraction)
+    if precision == "uint8":
+        return quantize_rows(pruned)
+    return pruned.astype(precision), None
+
+
+def compact_index(index_path: str, output_path: str, precision: str = "uint8",
+                  keep_fraction: float = 1.0) -> Dict:
+    # Write a serving copy of a binary index with float32 or 8-bit quantised weights, optionally
+    # pruned to each document's highest-weight terms. The vocabulary and IDF are unchanged, so
+    # queries are vectorized exactly as before; counts and the corpus manifest are left out,
+    # so the copy cannot be updated incrementally. Returns size statistics.
+    if not is_binary_index(index_path):
+        raise ValueError("Only a single binary index can be compacted")
+    data = read_index(index_path)
+    if "compaction" in data["meta"]:
+        raise ValueError(f"{index_path} is already compacted")
+
+    source = data["tfidf_matrix"]
+    matrix, scales = compact_matrix(source, precision, keep_fraction)
+    compaction = {
+        "precision": precision,
+        "keep_fraction": keep_fraction,
+        "source_index_id": data["meta"].get("index_id"),
+        "source_nnz": int(source.nnz),
+    }
+    write_index(output_path, data["document_ids"], data["vocabulary"], matrix, data["vectorizer_params"],
+                idf=data["idf"], duplicates=data["duplicates"], scales=scales, compaction=compaction)
+
+    stats = {
+        "precision": precision,
+        "keep_fraction": keep_fraction,
+        "source_nnz": int(source.nnz),
+        "nnz": int(matrix.nnz),
+        "pruned_postings": int(source.nnz - matrix.nnz),
+        "source_matrix_bytes": _matrix_bytes(source),
+        "matrix_bytes": _matrix_bytes(matrix),
+        "source_bytes": index_size_bytes(index_path),
+        "bytes": index_size_bytes(output_path),
+    }
+    print(f"\n Compacted index saved: {output_path}")
+    print(f"  Weights: {precision}, keeping {keep_fraction:.0%} of each document's terms")
+    print(f"  Postings: {stats['nnz']} of {stats['source_nnz']} ({stats['pruned_postings']} pruned)")
+    print(f"  Matrix: {stats['matrix_bytes'] / 1024:.2f} KB (was {stats['source_matrix_bytes'] / 1024:.2f} KB)")
+    print(f"  Size: {stats['bytes'] / 1024:.2f} KB (was {stats['source_bytes'] / 1024:.2f} KB)")
+    return stats
+
+
+def evaluate_compaction(index_path: str, compact_path: str, queries_csv: str = "queries.csv",
+                        top_k: int = 10) -> Dict:
+    # Ranking agreement of a compacted index with its full-precision index over the queries in
+    # queries_csv. Only matching documents (score > 0) are compared: the mean share of the full
+    # index's top_k that the compacted index also returns, the share of queries with an
+    # identical top_k and with the same first result, and the largest score difference of a
+    # document both return.
+    full = QueryProcessor.from_index(index_path)
+    compact = QueryProcessor.from_index(compact_path)
+    query_texts = [query["query_text"] for query in load_queries(queries_csv)]
+    if not query_texts:
+        raise ValueError(f"No queries in {queries_csv}")
+
+    overlaps = []
+    identical = same_first = 0
+    max_score_error = 0.0
+    for expected, actual in zip(full.process_queries(query_texts, top_k), compact.process_queries(query_texts, top_k)):
+        expected_scores = {doc_id: score for _, doc_id, score in expected if score > 0}
+        actual_scores = {doc_id: score for _, doc_id, score in actual if score > 0}
+        expected_ids, actual_ids = list(expected_scores), list(actual_scores)  # In rank order
+        overlaps.append(len(expected_scores.keys() & actual_scores.keys()) / len(expected_ids) if expected_ids else 1.0)
+        identical += expected_ids == actual_ids
+        same_first += expected_ids[:1] == actual_ids[:1]
+        for doc_id in expected_scores.keys() & actual_scores.keys():
+            max_score_error = max(max_score_error, abs(expected_scores[doc_id] - actual_scores[doc_id]))
+
+    report = {
+        "queries": len(query_texts),
+        "top_k": top_k,
+        "overlap": float(np.mean(overlaps)),
+        "identical": identical / len(query_texts),
+        "same_first": same_first / len(query_texts),
+        "max_score_error": max_score_error,
+    }
+    print(f"\nRanking agreement with the full index ({report['queries']} queries, top {top_k})")
+    print(f"  Top-{top_k} overlap: {report['overlap']:.1%}")
+    print(f"  Identical top-{top_k}: {report['identical']:.1%}")
+    print(f"  Same first result: {report['same_first']:.1%}")
+    print(f"  Max score error: {report['max_score_error']:.5f}")
+    return report
+
+
+def _matrix_bytes(matrix: sparse.csr_matrix) -> int:  # Memory the CSR arrays take once loaded
+    return int(matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes)
+
+
+if __name__ == "__main__":
+    print("Compacting official index")
+    compact_index("data/output/index", "data/output/index_compact", precision="uint8")
+    if Path("queries.csv").exists():
+        evaluate_compaction("data/output/index", "data/output/index_compact", "queries.csv")
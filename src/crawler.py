@@ -1,16 +1,135 @@
 # Scrapy-based web crawler for Wikipedia pages (demo corpus)
 
+import argparse
+import hashlib
+import os
 import scrapy
+from datetime import datetime, timezone
 from pathlib import Path
+from typing import Dict, List, Optional
+from urllib.parse import quote, unquote, urlsplit
 from scrapy.crawler import CrawlerProcess
+from scrapy.exceptions import CloseSpider, IgnoreRequest
+from scrapy.http import HtmlResponse
+from scrapy.settings import Settings
+try:
+    from src.record_segments import SegmentWriter, record_urls, DEFAULT_SEGMENT_RECORDS
+    from src.utils import clean_html_bytes, EXTRACTOR_VERSIONS
+except ModuleNotFoundError:
+    from record_segments import SegmentWriter, record_urls, DEFAULT_SEGMENT_RECORDS
+    from utils import clean_html_bytes, EXTRACTOR_VERSIONS
 
-class WikipediaIRSpider(scrapy.Spider):  # Wikipedia spider - crawls IR-related pages with depth limit and politeness settings 
+DEFAULT_JOB_DIR = "data/cache/crawl-job"
+DEFAULT_RECORDS_DIR = "data/wiki_records"
+OUTPUT_FORMATS = ("html", "records")
+MAX_NAME_LENGTH = 200
+# Characters Wikipedia leaves unescaped in /wiki/ links that are also safe in file names everywhere
+FILENAME_SAFE = "()_,-.!~"
+REDIRECTS_FILE = ".redirects.txt"  # HTML crawls: "<requested URL>\t<page URL>" for every redirect followed
+
+# Large-crawl preset: several requests per domain at once, no page or depth cap, resumable
+LARGE_CRAWL = {"concurrency": 8, "download_delay": 0.25, "max_pages": 0, "depth_limit": 0}
+
+
+def page_filename(url: str) -> str:
+    # Stable file name for a page: the article title for /wiki/ URLs, as Wikipedia escapes it
+    # (e.g. Is_Google_Making_Us_Stupid%3F.html), otherwise the escaped host and path.
+    # A /wiki/ URL with a query string (?oldid=, ?action=) gets a hash of the query appended,
+    # so it never overwrites the article's own file. The same URL always maps to the same file,
+    # so reruns never overwrite other pages.
+    parts = urlsplit(url)
+    if parts.path.startswith("/wiki/"):
+        name = parts.path[len("/wiki/"):]
+        if parts.query:
+            name += f"-{hashlib.sha1(parts.query.encode('utf-8')).hexdigest()[:10]}"
+    else:
+        name = parts.netloc + parts.path + (f"?{parts.query}" if parts.query else "")
+    name = quote(unquote(name), safe=FILENAME_SAFE) or "index"
+    if len(name) > MAX_NAME_LENGTH:  # Keep under file system limits, unique through a hash suffix
+        name = f"{name[:MAX_NAME_LENGTH - 11]}-{hashlib.sha1(name.encode('utf-8')).hexdigest()[:10]}"
+    return f"{name}.html"
+
+
+def read_redirects(output_dir: Path) -> Dict[str, str]:  # Requested URL -> page URL, from REDIRECTS_FILE
+    path = Path(output_dir) / REDIRECTS_FILE
+    if not path.is_file():
+        return {}
+    return dict(line.split("\t", 1) for line in path.read_text(encoding="utf-8").splitlines() if "\t" in line)
+
+
+class SavedPageMiddleware:
+    # Downloader middleware that answers requests for pages already in the output directory from
+    # disk, so pages fetched by an earlier run are never downloaded again, including pages first
+    # reached through a redirect. Their links are still followed, so a rerun extends the corpus
+    # instead of stopping at the first known page.
+    # Record segments keep no HTML to follow links from, so known URLs are dropped instead;
+    # continue a records crawl through its job directory.
+    def __init__(self, crawler):
+        self.crawler = crawler
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def process_request(self, request, spider=None):  # spider is only passed by older Scrapy versions
+        spider = self.crawler.spider
+        if not hasattr(spider, "output_dir"):
+            return None
+        if spider.output_format == "records":
+            if request.url in spider.known_urls:
+                raise IgnoreRequest(f"Already stored: {request.url}")
+            return None
+        url = spider.redirects.get(request.url, request.url)  # Stored under the URL it redirected to
+        filepath = spider.output_dir / page_filename(url)
+        if not filepath.exists():
+            return None
+        return HtmlResponse(url, body=filepath.read_bytes(), request=request, flags=["stored"])
+
+
+class ExtractedRecordPipeline:
+    # Item pipeline for output_format="records": extracts each page's text at crawl time (lxml,
+    # the same text the indexer would extract) and appends a record to compressed JSONL segments
+    # in the output directory, instead of keeping the raw HTML
+    def __init__(self, crawler):
+        self.crawler = crawler
+        self.writer = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def process_item(self, item, spider=None):  # spider is only passed by older Scrapy versions
+        html = item.pop("html")
+        redirect_urls = item.pop("redirect_urls")
+        if self.writer is None:  # Opened on the first record, so HTML crawls never create segments
+            self.writer = SegmentWriter(self.crawler.spider.output_dir,
+                                        max_records=self.crawler.settings.getint("RECORD_SEGMENT_RECORDS",
+                                                                                 DEFAULT_SEGMENT_RECORDS))
+        record = {
+            "url": item["url"],
+            "doc_id": page_filename(item["url"])[:-len(".html")],  # Same document ID as the page's HTML file
+            "title": item["title"],
+            "fetched_at": item["fetched_at"],
+            "sha256": hashlib.sha256(html).hexdigest(),
+            "extractor": f"lxml-v{EXTRACTOR_VERSIONS['lxml']}",
+            "text": clean_html_bytes(html),
+        }
+        if redirect_urls:  # Requested URLs that led to this page, so reruns skip them too
+            record["redirect_urls"] = redirect_urls
+        self.writer.write(record)
+        return item
+
+    def close_spider(self, spider=None):
+        if self.writer is not None:
+            self.writer.close()
+
+
+class WikipediaIRSpider(scrapy.Spider):  # Wikipedia spider - crawls IR-related pages with depth limit and politeness settings
     name = "wikipedia_ir"
     start_urls = ["https://en.wikipedia.org/wiki/Information_retrieval"]
-    
+
     custom_settings = {
         "DEPTH_LIMIT": 2,
-        "CLOSESPIDER_PAGECOUNT": 100,
         "ROBOTSTXT_OBEY": True,
         "DOWNLOAD_DELAY": 1.0,
         "AUTOTHROTTLE_ENABLED": True,
@@ -19,44 +138,142 @@ class WikipediaIRSpider(scrapy.Spider):  # Wikipedia spider - crawls IR-related
         "AUTOTHROTTLE_TARGET_CONCURRENCY": 1.0,
         "LOG_LEVEL": "INFO",
         "USER_AGENT": "IRCourseCrawler/1.0 (student project)",
+        "DOWNLOADER_MIDDLEWARES": {SavedPageMiddleware: 50},  # Before robots.txt: stored pages need no checks
+        "ITEM_PIPELINES": {ExtractedRecordPipeline: 300},
     }
-    
-    def __init__(self, output_dir="data/wiki_corpus", *args, **kwargs):  # Initialize spider and set output directory for saving HTML files
+
+    def __init__(self, output_dir="data/wiki_corpus", start_urls: Optional[List[str]] = None,
+                 max_pages: int = 100, output_format: str = "html", *args, **kwargs):  # Initialize spider and set output directory for saving HTML files
         super().__init__(*args, **kwargs)
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"output_format must be one of {OUTPUT_FORMATS}")
         self.output_dir = Path(output_dir)
         self.output_dir.mkdir(parents=True, exist_ok=True)
-        self.page_counter = 0
-    
+        if start_urls:
+            self.start_urls = list(start_urls)
+        self.max_pages = int(max_pages)  # New pages to save in this job (0 = no limit)
+        self.output_format = output_format  # "html" files, or extracted "records" segments
+        self.known_urls = record_urls(self.output_dir) if output_format == "records" else set()
+        self.redirects = read_redirects(self.output_dir) if output_format == "html" else {}
+        self.pages_reused = 0
+        self.state = {}  # Replaced by the saved job state when resuming from a JOBDIR
+
+    @property
+    def pages_saved(self) -> int:  # Counted in the job state, so the page limit spans resumed runs
+        return self.state.get("pages_saved", 0)
+
     def parse(self, response): # Parse page, save HTML, and follow valid Wikipedia links
-        self.page_counter += 1  # Save page with incremental naming
-        page_id = f"page_{self.page_counter:03d}"
-        filepath = self.output_dir / f"{page_id}.html"
-        
-        filepath.write_bytes(response.body)
-        self.logger.info(f"Saved {filepath} ({response.url})")
-        
-        # Follow internal Wikipedia links only
+        if "stored" in response.flags:
+            self.pages_reused += 1
+        elif self.output_format == "records":  # Text is extracted and stored by ExtractedRecordPipeline
+            self.state["pages_saved"] = self.pages_saved + 1
+            yield {
+                "url": response.url,
+                "title": " ".join(response.css("title::text").get("").split()),
+                "fetched_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                "html": response.body,
+                "redirect_urls": response.meta.get("redirect_urls", []),
+            }
+        else:
+            self._save(response)
+
+        # Follow internal Wikipedia links only, skipping revision and action views (?oldid=, ?action=)
         excluded_prefixes = (
             "/wiki/Special:", "/wiki/Talk:", "/wiki/Help:",
             "/wiki/Wikipedia:", "/wiki/File:", "/wiki/Category:"
         )
-        
+
         for href in response.css("a::attr(href)").getall():
-            if href.startswith("/wiki/") and not any(
+            if href.startswith("/wiki/") and "?" not in href and not any(
                 href.startswith(prefix) for prefix in excluded_prefixes
             ):
                 yield response.follow(href, callback=self.parse)
 
+        if self.max_pages and self.pages_saved >= self.max_pages:
+            # Links above are still queued: with a job directory they resume with the next run
+            raise CloseSpider("max_pages")
+
+    def _save(self, response) -> None:  # Write the page under its URL-based name, atomically
+        filepath = self.output_dir / page_filename(response.url)
+        temp_path = filepath.with_name(f".{filepath.name}.{os.getpid()}.tmp")
+        temp_path.write_bytes(response.body)
+        os.replace(temp_path, filepath)  # An interrupted crawl never leaves a truncated page behind
+        redirect_urls = response.meta.get("redirect_urls", [])
+        if redirect_urls:  # Reruns answer the requested URLs from this file too
+            with open(self.output_dir / REDIRECTS_FILE, "a", encoding="utf-8") as f:
+                f.write("".join(f"{url}\t{response.url}\n" for url in redirect_urls))
+        self.state["pages_saved"] = self.pages_saved + 1
+        self.logger.info(f"Saved {filepath} ({response.url})")
+
+    def closed(self, reason):
+        self.logger.info(f"Crawl finished ({reason}): {self.pages_saved} pages saved, "
+                         f"{self.pages_reused} already in {self.output_dir}")
+
+
+def crawl_settings(concurrency: int = 1, download_delay: float = 1.0, depth_limit: int = 2,
+                   job_dir: Optional[str] = None, log_level: str = "INFO") -> Settings:
+    # Crawl options at command-line priority, so they override the spider's demo defaults
+    overrides: Dict = {
+        "CONCURRENT_REQUESTS_PER_DOMAIN": concurrency,
+        "CONCURRENT_REQUESTS": max(16, concurrency),
+        "DOWNLOAD_DELAY": download_delay,
+        "AUTOTHROTTLE_START_DELAY": max(download_delay, 0.1),
+        "AUTOTHROTTLE_TARGET_CONCURRENCY": float(concurrency),
+        "DEPTH_LIMIT": depth_limit,
+        "LOG_LEVEL": log_level,
+    }
+    if job_dir:
+        overrides["JOBDIR"] = str(job_dir)  # Persistent frontier, seen-request filter and spider state
+    settings = Settings()
+    settings.setdict(overrides, priority="cmdline")
+    return settings
+
 
-def run_crawler(output_dir="data/wiki_corpus"):
-    # Run the Wikipedia crawler and save pages to specified directory
-    process = CrawlerProcess()
-    process.crawl(WikipediaIRSpider, output_dir=output_dir)
+def run_crawler(output_dir="data/wiki_corpus", start_urls: Optional[List[str]] = None, max_pages: int = 100,
+                concurrency: int = 1, download_delay: float = 1.0, depth_limit: int = 2,
+                job_dir: Optional[str] = None, log_level: str = "INFO", output_format: str = "html"):
+    # Run the Wikipedia crawler and save pages to specified directory. With job_dir, an
+    # interrupted crawl (Ctrl-C once, or max_pages reached) resumes where it stopped when run
+    # again with the same job_dir. output_format="records" stores extracted text in compressed
+    # segments (src/record_segments.py) instead of one HTML file per page.
+    process = CrawlerProcess(crawl_settings(concurrency, download_delay, depth_limit, job_dir, log_level))
+    process.crawl(WikipediaIRSpider, output_dir=output_dir, start_urls=start_urls, max_pages=max_pages,
+                  output_format=output_format)
     process.start()
 
 
+def main():
+    parser = argparse.ArgumentParser(description="Crawl Wikipedia pages into an HTML corpus")
+    parser.add_argument("--output", help=f"Corpus directory (default: data/wiki_corpus, {DEFAULT_RECORDS_DIR} with --records)")
+    parser.add_argument("--records", action="store_true",
+                        help="Store extracted text in compressed JSONL segments instead of HTML files")
+    parser.add_argument("--start-url", action="append", dest="start_urls",
+                        help="Page to start from (repeatable; default: Information_retrieval)")
+    parser.add_argument("--large", action="store_true",
+                        help=f"Large-crawl mode: {LARGE_CRAWL['concurrency']} requests per domain, no page or "
+                             f"depth limit, resumable through {DEFAULT_JOB_DIR}")
+    parser.add_argument("--max-pages", type=int, help="New pages to save, 0 = no limit (default: 100)")
+    parser.add_argument("--concurrency", type=int, help="Concurrent requests per domain (default: 1)")
+    parser.add_argument("--delay", type=float, help="Download delay in seconds (default: 1.0)")
+    parser.add_argument("--depth", type=int, help="Link depth limit, 0 = no limit (default: 2)")
+    parser.add_argument("--job-dir", help="Job directory for a resumable crawl (frontier and seen URLs)")
+    parser.add_argument("--log-level", default="INFO")
+    args = parser.parse_args()
+
+    options = dict(LARGE_CRAWL) if args.large else {"concurrency": 1, "download_delay": 1.0,
+                                                    "max_pages": 100, "depth_limit": 2}
+    for key, value in (("concurrency", args.concurrency), ("download_delay", args.delay),
+                       ("max_pages", args.max_pages), ("depth_limit", args.depth)):
+        if value is not None:
+            options[key] = value
+    job_dir = args.job_dir or (DEFAULT_JOB_DIR if args.large else None)
+    output_dir = args.output or (DEFAULT_RECORDS_DIR if args.records else "data/wiki_corpus")
+    run_crawler(output_dir, start_urls=args.start_urls, job_dir=job_dir, log_level=args.log_level,
+                output_format="records" if args.records else "html", **options)
+
+
 if __name__ == "__main__":
     # Run crawler when script is executed directly
     print("Starting Wikipedia crawler")
-    run_crawler()
-    print("Crawling complete")
\ No newline at end of file
+    main()
+    print("Crawling complete")
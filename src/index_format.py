@@ -0,0 +1,416 @@
+# Binary index format - stores the sparse TF-IDF matrix as CSR arrays that load_index can memory-map
+
+import json
+import os
+import shutil
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+from scipy import sparse
+
+try:
+    from src.vocabulary import TermDictionary, TERMS_FILE
+except ModuleNotFoundError:
+    from vocabulary import TermDictionary, TERMS_FILE
+
+FORMAT_NAME = "ir-tfidf-index"
+SHARDED_FORMAT_NAME = "ir-tfidf-sharded-index"
+SHARDED_FORMAT_VERSION = 1
+FORMAT_VERSION = 5  # 2: adds idf.npy, 3: adds counts.npy and manifest.json, 4: term dictionary replaces vocabulary.txt, 5: compacted indexes (scales.npy)
+
+META_FILE = "meta.json"
+DATA_FILE = "data.npy"
+INDICES_FILE = "indices.npy"
+INDPTR_FILE = "indptr.npy"
+DOCUMENT_IDS_FILE = "document_ids.txt"
+VOCABULARY_FILE = "vocabulary.txt"  # Versions 1-3; newer indexes store a TermDictionary
+IDF_FILE = "idf.npy"
+COUNTS_FILE = "counts.npy"
+MANIFEST_FILE = "manifest.json"
+DUPLICATES_FILE = "duplicates.json"
+SHARDS_FILE = "shards.json"
+SCALES_FILE = "scales.npy"  # 8-bit quantised indexes: per-document factor turning codes back into weights
+
+
+def is_binary_index(path) -> bool:  # True if path is a directory written by write_index
+    return (Path(path) / META_FILE).is_file()
+
+
+def is_sharded_index(path) -> bool:  # True if path is a directory written by write_sharded_index
+    return (Path(path) / SHARDS_FILE).is_file()
+
+
+def is_compacted_index(path) -> bool:  # True if path is a binary index written by compaction.compact_index
+    if not is_binary_index(path):
+        return False
+    with (Path(path) / META_FILE).open("r", encoding="utf-8") as f:
+        return "compaction" in json.load(f)
+
+
+def write_index(index_dir, document_ids: List[str], vocabulary: List[str],
+                tfidf_matrix, vectorizer_params: Dict, idf: Optional[np.ndarray] = None,
+                term_counts=None, manifest: Optional[Dict] = None, duplicates: Optional[Dict] = None,
+                scales: Optional[np.ndarray] = None, compaction: Optional[Dict] = None) -> Path:
+    # Write the index as a directory of .npy arrays, a newline-delimited document id list and
+    # the vocabulary as a front-coded term dictionary (which requires it sorted).
+    # term_counts (raw counts, same sparsity pattern as the TF-IDF matrix) and the corpus
+    # manifest are optional and only needed for incremental updates. duplicates records the
+    # near-duplicate documents left out of the index and their canonical documents.
+    # Compacted indexes (see compaction.py) store their matrix in its reduced dtype, with the
+    # per-document scales of 8-bit codes and the compaction settings recorded in meta.json.
+    # Files go to a temporary sibling directory that is published at index_dir once complete
+    # (see _replace_dir), so readers never see a partially written index.
+    index_dir = Path(index_dir)
+    matrix = sparse.csr_matrix(tfidf_matrix)
+    matrix.sort_indices()
+
+    # Keep indices and indptr on the same dtype so scipy can wrap the memmaps without copying
+    idx_dtype = np.int32 if max(matrix.nnz, matrix.shape[1]) < np.iinfo(np.int32).max else np.int64
+
+    tmp_dir = new_index_dir(index_dir)
+    try:
+        np.save(tmp_dir / DATA_FILE, matrix.data)
+        np.save(tmp_dir / INDICES_FILE, matrix.indices.astype(idx_dtype, copy=False))
+        np.save(tmp_dir / INDPTR_FILE, matrix.indptr.astype(idx_dtype, copy=False))
+        _write_lines(tmp_dir / DOCUMENT_IDS_FILE, document_ids)
+        TermDictionary.from_terms(vocabulary).save(tmp_dir)
+        if idf is not None:
+            np.save(tmp_dir / IDF_FILE, np.asarray(idf, dtype=np.float64))
+        if term_counts is not None:
+            np.save(tmp_dir / COUNTS_FILE, _aligned_counts(term_counts, matrix))
+        if manifest is not None:
+            with (tmp_dir / MANIFEST_FILE).open("w", encoding="utf-8") as f:
+                json.dump(manifest, f)
+        if duplicates is not None:
+            write_duplicates(tmp_dir, duplicates)
+        if scales is not None:
+            np.save(tmp_dir / SCALES_FILE, np.asarray(scales, dtype=np.float64))
+
+        write_meta(tmp_dir, matrix.shape, matrix.nnz, matrix.data.dtype, vectorizer_params, compaction=compaction)
+        commit_index_dir(tmp_dir, index_dir)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    return index_dir
+
+
+def write_sharded_index(index_dir, num_shards: int, document_ids: List[str], vocabulary: List[str],
+                        tfidf_matrix, vectorizer_params: Dict, idf: Optional[np.ndarray] = None,
+                        term_counts=None, duplicates: Optional[Dict] = None) -> Path:
+    # Split the documents into num_shards contiguous ranges holding similar numbers of postings
+    # and write each range as an ordinary binary index in shard-NNNNN/. Every shard keeps the
+    # global vocabulary and IDF vector, so it weights and scores its documents exactly as the
+    # whole index would. shards.json (written last) lists the shards and the global position
+    # of each shard's first document; merging shard rankings by (score, position) reproduces
+    # the unsharded ranking, ties included.
+    index_dir = Path(index_dir)
+    matrix = sparse.csr_matrix(tfidf_matrix)
+    counts = sparse.csr_matrix(term_counts) if term_counts is not None else None
+    num_documents = matrix.shape[0]
+    if not 1 <= num_shards <= num_documents:
+        raise ValueError(f"num_shards must be between 1 and the number of documents ({num_documents})")
+
+    bounds = [0] + np.searchsorted(matrix.indptr, matrix.nnz * np.arange(1, num_shards) / num_shards).tolist() + [num_documents]
+    for shard in range(1, num_shards):  # At least one document per shard
+        bounds[shard] = min(max(bounds[shard], bounds[shard - 1] + 1), num_documents - (num_shards - shard))
+
+    tmp_dir = new_index_dir(index_dir)
+    try:
+        shards = []
+        for shard, (start, end) in enumerate(zip(bounds, bounds[1:])):
+            name = f"shard-{shard:05d}"
+            write_index(tmp_dir / name, document_ids[start:end], vocabulary, matrix[start:end],
+                        vectorizer_params, idf=idf, term_counts=counts[start:end] if counts is not None else None)
+            shards.append({"path": name, "first_document": start, "num_documents": end - start,
+                           "nnz": int(matrix.indptr[end] - matrix.indptr[start])})
+        if duplicates is not None:
+            write_duplicates(tmp_dir, duplicates)
+        with (tmp_dir / SHARDS_FILE).open("w", encoding="utf-8") as f:
+            json.dump({
+                "format": SHARDED_FORMAT_NAME,
+                "version": SHARDED_FORMAT_VERSION,
+                "num_documents": num_documents,
+                "num_terms": matrix.shape[1],
+                "vectorizer_params": vectorizer_params,
+                "index_id": uuid.uuid4().hex,
+                "shards": shards,
+            }, f, indent=2)
+        commit_index_dir(tmp_dir, index_dir)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    return index_dir
+
+
+def new_index_dir(index_dir) -> Path:  # Create the temporary sibling directory an index is written into
+    index_dir = Path(index_dir)
+    tmp_dir = index_dir.with_name(f".{index_dir.name}.tmp-{uuid.uuid4().hex[:8]}")
+    tmp_dir.mkdir(parents=True)
+    return tmp_dir
+
+
+def write_meta(index_dir, shape, nnz: int, dtype, vectorizer_params: Dict,
+               compaction: Optional[Dict] = None) -> None:  # Written last: marks the index complete
+    meta = {
+        "format": FORMAT_NAME,
+        "version": FORMAT_VERSION,
+        "num_documents": int(shape[0]),
+        "num_terms": int(shape[1]),
+        "nnz": int(nnz),
+        "dtype": np.dtype(dtype).str,
+        "vectorizer_params": vectorizer_params,
+        "index_id": uuid.uuid4().hex,  # Unique per build, so consumers can tell indexes apart
+    }
+    if compaction is not None:
+        meta["compaction"] = compaction
+    with (Path(index_dir) / META_FILE).open("w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+
+
+def write_duplicates(index_dir, duplicates: Dict) -> None:  # {"params": {...}, "duplicates": {doc_id: canonical_id}}
+    with (Path(index_dir) / DUPLICATES_FILE).open("w", encoding="utf-8") as f:
+        json.dump(duplicates, f)
+
+
+def commit_index_dir(tmp_dir, index_dir) -> None:  # Publish a completed temporary index at index_dir, replacing any previous index (see _replace_dir)
+    _replace_dir(Path(tmp_dir), Path(index_dir))
+
+
+class NpyWriter:
+    # Writes a 1-D .npy file chunk by chunk; the final length must be known up front
+    def __init__(self, path, dtype, length: int):
+        self.dtype = np.dtype(dtype)
+        self.length = length
+        self.written = 0
+        self._file = open(path, "wb")
+        np.lib.format.write_array_header_1_0(
+            self._file, {"descr": np.lib.format.dtype_to_descr(self.dtype),
+                         "fortran_order": False, "shape": (length,)}
+        )
+
+    def write(self, chunk: np.ndarray) -> None:
+        chunk = np.ascontiguousarray(chunk, dtype=self.dtype)
+        self.written += chunk.size
+        if self.written > self.length:
+            raise ValueError(f"Wrote {self.written} items to an array of length {self.length}")
+        self._file.write(chunk.tobytes())
+
+    def close(self) -> None:
+        self._file.close()
+        if self.written != self.length:
+            raise ValueError(f"Wrote {self.written} items to an array of length {self.length}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+
+
+def read_index(index_dir, mmap: bool = True, dequantize: bool = True) -> Dict:
+    # Read an index directory; with mmap=True the CSR arrays stay on disk and are paged in on demand.
+    # The matrix of an 8-bit quantised index is returned as float32 weights, or with
+    # dequantize=False as the stored codes together with their per-document "scales".
+    index_dir = Path(index_dir).resolve()  # Pin the current version: a rebuild may switch index_dir meanwhile
+    with (index_dir / META_FILE).open("r", encoding="utf-8") as f:
+        meta = json.load(f)
+
+    if meta.get("format") != FORMAT_NAME:
+        raise ValueError(f"{index_dir} is not an {FORMAT_NAME} directory")
+    if meta.get("version", 0) > FORMAT_VERSION:
+        raise ValueError(
+            f"Index format version {meta['version']} is newer than supported "
+            f"version {FORMAT_VERSION}; rebuild the index or upgrade"
+        )
+
+    mmap_mode = "r" if mmap else None
+    data = np.load(index_dir / DATA_FILE, mmap_mode=mmap_mode)
+    indices = np.load(index_dir / INDICES_FILE, mmap_mode=mmap_mode)
+    indptr = np.load(index_dir / INDPTR_FILE, mmap_mode=mmap_mode)
+    shape = (meta["num_documents"], meta["num_terms"])
+    tfidf_matrix = sparse.csr_matrix((data, indices, indptr), shape=shape, copy=False)
+    scales = None
+    if (index_dir / SCALES_FILE).exists():
+        scales = np.load(index_dir / SCALES_FILE)
+        if dequantize:
+            weights = np.multiply(data, np.repeat(scales.astype(np.float32), np.diff(indptr)), dtype=np.float32)
+            tfidf_matrix = sparse.csr_matrix((weights, indices, indptr), shape=shape, copy=False)
+            scales = None
+    idf_file = index_dir / IDF_FILE
+    idf = np.load(idf_file) if idf_file.exists() else None  # Version 1 indexes have no IDF vector
+
+    term_counts = None
+    if (index_dir / COUNTS_FILE).exists():  # Counts share indices/indptr with the TF-IDF matrix
+        counts = np.load(index_dir / COUNTS_FILE, mmap_mode=mmap_mode)
+        term_counts = sparse.csr_matrix((counts, indices, indptr), shape=shape, copy=False)
+    manifest = None
+    if (index_dir / MANIFEST_FILE).exists():
+        with (index_dir / MANIFEST_FILE).open("r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    if (index_dir / TERMS_FILE).exists():  # Front-coded, so lookups need no per-term objects
+        vocabulary = TermDictionary.load(index_dir, meta["num_terms"], mmap=mmap)
+    else:
+        vocabulary = _read_lines(index_dir / VOCABULARY_FILE)
+    duplicates = None
+    if (index_dir / DUPLICATES_FILE).exists():
+        with (index_dir / DUPLICATES_FILE).open("r", encoding="utf-8") as f:
+            duplicates = json.load(f)
+
+    return {
+        "document_ids": _read_lines(index_dir / DOCUMENT_IDS_FILE),
+        "vocabulary": vocabulary,
+        "tfidf_matrix": tfidf_matrix,
+        "scales": scales,
+        "idf": idf,
+        "term_counts": term_counts,
+        "manifest": manifest,
+        "duplicates": duplicates,
+        "vectorizer_params": meta["vectorizer_params"],
+        "meta": meta,
+    }
+
+
+def read_shards_manifest(index_dir) -> Dict:  # shards.json of a sharded index, with absolute shard paths
+    index_dir = Path(index_dir).resolve()
+    with (index_dir / SHARDS_FILE).open("r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("format") != SHARDED_FORMAT_NAME:
+        raise ValueError(f"{index_dir} is not an {SHARDED_FORMAT_NAME} directory")
+    if manifest.get("version", 0) > SHARDED_FORMAT_VERSION:
+        raise ValueError(
+            f"Sharded index version {manifest['version']} is newer than supported "
+            f"version {SHARDED_FORMAT_VERSION}; rebuild the index or upgrade"
+        )
+    for shard in manifest["shards"]:
+        shard["path"] = str(index_dir / shard["path"])
+    return manifest
+
+
+def read_sharded_index(index_dir, mmap: bool = True) -> Dict:
+    # Read every shard as one index, with the same keys as read_index. The shards' rows are
+    # concatenated in memory; search a sharded index shard by shard with ShardedQueryProcessor.
+    manifest = read_shards_manifest(index_dir)
+    shards = [read_index(shard["path"], mmap=mmap) for shard in manifest["shards"]]
+    term_counts = None
+    if all(shard["term_counts"] is not None for shard in shards):
+        term_counts = sparse.vstack([shard["term_counts"] for shard in shards], format="csr")
+    duplicates = None
+    if (Path(index_dir) / DUPLICATES_FILE).exists():
+        with (Path(index_dir) / DUPLICATES_FILE).open("r", encoding="utf-8") as f:
+            duplicates = json.load(f)
+    return {
+        "document_ids": [doc_id for shard in shards for doc_id in shard["document_ids"]],
+        "vocabulary": shards[0]["vocabulary"],
+        "tfidf_matrix": sparse.vstack([shard["tfidf_matrix"] for shard in shards], format="csr"),
+        "scales": None,
+        "idf": shards[0]["idf"],
+        "term_counts": term_counts,
+        "manifest": None,
+        "duplicates": duplicates,
+        "vectorizer_params": manifest["vectorizer_params"],
+        "meta": {key: value for key, value in manifest.items() if key != "shards"},
+    }
+
+
+def write_json_index(output_file, document_ids: List[str], vocabulary: List[str],
+                     tfidf_matrix, vectorizer_params: Dict, idf: Optional[np.ndarray] = None) -> Path:
+    # Export the index as the legacy dense JSON document (for inspection/interop, not for serving)
+    output_file = Path(output_file)
+    index_data = {
+        "document_ids": document_ids,
+        "vocabulary": vocabulary,
+        "tfidf_matrix": sparse.csr_matrix(tfidf_matrix).toarray().tolist(),
+        "vectorizer_params": vectorizer_params
+    }
+    if idf is not None:
+        index_data["idf"] = np.asarray(idf).tolist()
+    with output_file.open("w", encoding="utf-8") as f:
+        json.dump(index_data, f, indent=2)
+    return output_file
+
+
+def read_json_index(index_file) -> Dict:  # Read a legacy dense JSON index, converting the matrix to CSR
+    with open(index_file, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return {
+        "document_ids": data["document_ids"],
+        "vocabulary": data["vocabulary"],
+        "tfidf_matrix": sparse.csr_matrix(np.array(data["tfidf_matrix"])),
+        "scales": None,
+        "idf": np.array(data["idf"]) if "idf" in data else None,
+        "term_counts": None,
+        "manifest": None,
+        "duplicates": None,
+        "vectorizer_params": data["vectorizer_params"],
+        "meta": {"format": "json", "version": 0},
+    }
+
+
+def index_size_bytes(path) -> int:  # Total on-disk size of an index directory (with its shards) or JSON file
+    path = Path(path)
+    if path.is_dir():
+        shard_dirs = [p for p in path.glob("shard-*") if p.is_dir()] if is_sharded_index(path) else []
+        return sum(p.stat().st_size for p in path.iterdir() if p.is_file()) + sum(map(index_size_bytes, shard_dirs))
+    return path.stat().st_size
+
+
+def _aligned_counts(term_counts, matrix: sparse.csr_matrix) -> np.ndarray:  # Count values laid out on the TF-IDF matrix's indices
+    counts = sparse.csr_matrix(term_counts)
+    counts.sort_indices()
+    if not (np.array_equal(counts.indptr, matrix.indptr) and np.array_equal(counts.indices, matrix.indices)):
+        raise ValueError("term_counts must have the same sparsity pattern as the TF-IDF matrix")
+    return counts.data.astype(np.int32)
+
+
+def _write_lines(path: Path, items: List[str]) -> None:
+    for item in items:
+        if "\n" in item or "\r" in item:
+            raise ValueError(f"Line break in index entry {item!r}")
+    path.write_text("\n".join(items), encoding="utf-8")
+
+
+def _read_lines(path: Path) -> List[str]:
+    text = path.read_text(encoding="utf-8")
+    return text.split("\n") if text else []
+
+
+def _replace_dir(new_dir: Path, target: Path) -> None:
+    # Publish new_dir at target. Every build moves into its own versioned sibling directory and
+    # target is a symlink to the current version, switched with os.replace, so target always
+    # names a complete index. The previous version is kept until the next build for readers
+    # still loading it (read_index resolves the link once, so a reader sees one version).
+    # Where symlinks are unavailable (e.g. Windows without developer mode), and once when
+    # target is still a plain directory, the old directory is renamed away first: target is
+    # missing between the two renames.
+    if target.is_file():
+        raise FileExistsError(f"{target} exists and is not an index directory")
+    token = uuid.uuid4().hex[:8]
+    version_dir = target.with_name(f".{target.name}.v-{token}")
+    link = target.with_name(f".{target.name}.link-{token}")
+    try:
+        os.symlink(version_dir.name, link, target_is_directory=True)
+    except (OSError, NotImplementedError):
+        link = None
+
+    previous = os.readlink(target) if target.is_symlink() else None
+    old_dir = None
+    if target.exists() and previous is None:
+        old_dir = target.with_name(f".{target.name}.old-{token}")
+        target.rename(old_dir)
+    if link is None:
+        new_dir.rename(target)
+    else:
+        new_dir.rename(version_dir)
+        os.replace(link, target)
+    if old_dir is not None:
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+    prefix = f".{target.name}.v-"  # Older versions than the one just replaced
+    for entry in target.parent.iterdir():
+        if entry.name.startswith(prefix) and entry.name not in (version_dir.name, previous):
+            shutil.rmtree(entry, ignore_errors=True)
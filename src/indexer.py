@@ -1,33 +1,83 @@
 # Document indexer - builds TF-IDF vector space model from HTML files
-import json
+import os
+from collections import Counter
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
+from scipy import sparse
+from sklearn.feature_extraction.text import CountVectorizer, TfidfTransformer
 try:
-    from src.utils import read_clean_html, ensure_directories
+    from src.utils import get_extractor, ensure_directories, file_digest, EXTRACTOR_VERSIONS
+    from src.text_cache import TextCache, DEFAULT_MAX_BYTES
+    from src.index_format import (is_binary_index, is_sharded_index, read_index, read_json_index,
+                                  read_sharded_index, write_index, write_json_index,
+                                  write_sharded_index, index_size_bytes)
+    from src.streaming_index import SpimiIndexWriter
+    from src.profiler import stage
+    from src.record_segments import is_record_dir, iter_records
+    from src.near_duplicates import NearDuplicateDetector
+    from src.vocabulary import DEFAULT_TOKEN_PATTERN, TOKEN_PATTERNS, pruning_enabled, vocabulary_mask
 except ModuleNotFoundError:
-    from utils import read_clean_html, ensure_directories
+    from utils import get_extractor, ensure_directories, file_digest, EXTRACTOR_VERSIONS
+    from text_cache import TextCache, DEFAULT_MAX_BYTES
+    from index_format import (is_binary_index, is_sharded_index, read_index, read_json_index,
+                              read_sharded_index, write_index, write_json_index,
+                              write_sharded_index, index_size_bytes)
+    from streaming_index import SpimiIndexWriter
+    from profiler import stage
+    from record_segments import is_record_dir, iter_records
+    from near_duplicates import NearDuplicateDetector
+    from vocabulary import DEFAULT_TOKEN_PATTERN, TOKEN_PATTERNS, pruning_enabled, vocabulary_mask
 
 class DocumentIndexer:
     # TF-IDF indexer - converts HTML documents into searchable vector space model
     
-    def __init__(self, lowercase=True, stop_words="english", norm="l2"):  # Initialize TF-IDF vectorizer with preprocessing parameters
-        self.vectorizer = TfidfVectorizer(
+    def __init__(self, lowercase=True, stop_words="english", norm="l2", extractor="bs4",
+                 cache_dir: Optional[str] = None, cache_max_bytes: int = DEFAULT_MAX_BYTES,
+                 near_duplicate_threshold: Optional[float] = None, token_pattern: str = DEFAULT_TOKEN_PATTERN,
+                 min_df=1, max_df=1.0, max_features: Optional[int] = None):  # Initialize TF-IDF vectorizer with preprocessing parameters, text extraction backend and optional text cache
+        self.extract_text = get_extractor(extractor)  # "bs4" (BeautifulSoup) or "lxml" (faster, same output)
+        self.extractor = extractor
+        # Cleaned text keyed by file hash, so re-indexing unchanged files skips HTML parsing
+        self.text_cache = TextCache(cache_dir, cache_max_bytes) if cache_dir else None
+        # Counting and TF-IDF weighting run as separate steps (what TfidfVectorizer does internally)
+        # so the raw term counts can be kept for incremental updates.
+        # token_pattern may also name a preset from TOKEN_PATTERNS ("words" drops numbers and debris)
+        token_pattern = TOKEN_PATTERNS.get(token_pattern, token_pattern)
+        self.vectorizer = CountVectorizer(
             lowercase=lowercase,
             stop_words=stop_words,
-            norm=norm
+            token_pattern=token_pattern
         )
         self.document_ids = []
         self.tfidf_matrix = None
+        self.term_counts = None
         self.vocabulary = []
+        self.idf = None
+        self.manifest = None
+        # With a threshold, documents whose estimated Jaccard similarity to an earlier document
+        # reaches it are left out of the index; duplicates maps each one to its canonical document
+        self.near_duplicate_threshold = near_duplicate_threshold
+        self.duplicates = {}
+        self.duplicate_params = None
+        # Terms pruned from the last build by document frequency (min_df, max_df, max_features)
+        self.pruned_terms = 0
+        self.pruned_postings = 0
         self.vectorizer_params = {
             "lowercase": lowercase,
             "stop_words": stop_words,
-            "norm": norm
+            "norm": norm,
+            "token_pattern": token_pattern,
+            "min_df": min_df,
+            "max_df": max_df,
+            "max_features": max_features
         }
     
-    def build_index(self, corpus_dir: str, file_pattern="*.html") -> Dict:  # Build TF-IDF index from HTML files and return statistics
+    def build_index(self, corpus_dir: str, file_pattern="*.html", workers: Optional[int] = 1) -> Dict:  # Build TF-IDF index from HTML files and return statistics
+        if is_record_dir(corpus_dir):  # Crawled straight to record segments: text is already extracted
+            return self.build_index_from_records(corpus_dir)
         corpus_path = Path(corpus_dir)
         html_files = sorted(corpus_path.glob(file_pattern))
         
@@ -35,47 +85,374 @@ class DocumentIndexer:
             raise ValueError(f"No HTML files found in {corpus_dir}")
         
         print(f"\nBuilding index from {len(html_files)} documents")
-        docs = {}    # Load and clean documents
-        for html_file in html_files:
-            doc_id = html_file.stem
-            text = read_clean_html(html_file)
-            if text:  # Only add non-empty documents
-                docs[doc_id] = text
+        with stage("extract"):
+            records = [self._file_record(html_file, html_file.relative_to(corpus_path).as_posix())[0]
+                       for html_file in html_files]
+            texts = self._extract_texts(html_files, workers,    # Load and clean documents
+                                        digests=[record["sha256"] for record in records])
+        docs = {}
+        detector = self._new_duplicate_detector()
+        with stage("dedup") if detector is not None else nullcontext():
+            for html_file, text in zip(html_files, texts):
+                if text and not self._is_near_duplicate(detector, html_file.stem, text):  # Only add non-empty, distinct documents
+                    docs[html_file.stem] = text
         if not docs:
             raise ValueError("No valid documents found after text extraction")
           
         self.document_ids = list(docs.keys())  # Prepare data for vectorization
         doc_texts = [docs[doc_id] for doc_id in self.document_ids]
         
-        self.tfidf_matrix = self.vectorizer.fit_transform(doc_texts)  # Build TF-IDF matrix
-        self.vocabulary = self.vectorizer.get_feature_names_out().tolist()
+        with stage("fit"):
+            self.term_counts = self.vectorizer.fit_transform(doc_texts)  # Count terms, then weight them into the TF-IDF matrix
+            self.vocabulary = self.vectorizer.get_feature_names_out().tolist()
+            self._prune_vocabulary()
+            self._apply_tfidf_weights()
+        for html_file, record, text in zip(html_files, records, texts):
+            record["doc_id"] = html_file.stem if html_file.stem in docs else None
+            if html_file.stem in self.duplicates:
+                record["duplicate_of"] = self.duplicates[html_file.stem]
+        self.manifest = {
+            "corpus_dir": str(corpus_path),
+            "extractor": self.extractor,
+            "files": {record["path"]: record for record in records},
+        }
         stats = self._compute_statistics()  # Calculate statistics
         
-        print(f"Index built successfully")
+        self._print_index_stats(stats)
+        
+        return stats
+    
+    def build_index_from_records(self, records_dir: str) -> Dict:
+        # Build the index from record segments written by the crawler (src/record_segments.py).
+        # Records are streamed one segment at a time straight into the vectorizer, so neither the
+        # HTML nor the corpus text is ever held in memory. Documents keep crawl order; a URL stored
+        # twice is indexed once. There is no file manifest, so --incremental runs a full build.
+        print(f"\nBuilding index from record segments in {records_dir}")
+        document_ids = []
+        detector = self._new_duplicate_detector()
+        
+        def texts():
+            seen = set()
+            for record in iter_records(records_dir):
+                if record["text"] and record["doc_id"] not in seen:  # Only add non-empty documents
+                    seen.add(record["doc_id"])
+                    if self._is_near_duplicate(detector, record["doc_id"], record["text"]):
+                        continue
+                    document_ids.append(record["doc_id"])
+                    yield record["text"]
+        
+        with stage("fit"):
+            self.term_counts = self.vectorizer.fit_transform(texts())
+            self.vocabulary = self.vectorizer.get_feature_names_out().tolist()
+            self._prune_vocabulary()
+            self._apply_tfidf_weights()
+        self.document_ids = document_ids
+        self.manifest = None
+        stats = self._compute_statistics()
+        
+        self._print_index_stats(stats)
+        
+        return stats
+    
+    def build_index_streaming(self, corpus_dir: str, output_path: str, file_pattern="*.html",
+                              workers: Optional[int] = 1, memory_budget_mb: float = 256,
+                              batch_size: int = 256) -> Dict:
+        # Build the binary index straight to output_path without holding the corpus or the matrix
+        # in memory: texts are extracted batch by batch and fed to a SPIMI writer that spills
+        # sorted segments to disk and merges them at the end. The saved index equals
+        # build_index() + save_index(), minus the manifest (so a later --incremental run rebuilds).
+        if is_record_dir(corpus_dir):
+            print(f"\nStreaming index build from record segments in {corpus_dir} (memory budget {memory_budget_mb} MB)")
+            batches = self._record_batches(corpus_dir, batch_size)
+        else:
+            html_files = sorted(Path(corpus_dir).glob(file_pattern))
+            if not html_files:
+                raise ValueError(f"No HTML files found in {corpus_dir}")
+            print(f"\nStreaming index build from {len(html_files)} documents (memory budget {memory_budget_mb} MB)")
+            batches = self._html_batches(html_files, workers, batch_size)
+        writer = SpimiIndexWriter(output_path, self.vectorizer.build_analyzer(), self.vectorizer_params,
+                                  memory_budget_bytes=int(memory_budget_mb * 1024 * 1024))
+        detector = self._new_duplicate_detector()
+        seen = set()
+        try:
+            for batch in batches:
+                with stage("invert"):  # Tokenize and add to the in-memory segment, spilling when full
+                    for doc_id, text in batch:
+                        if text and doc_id not in seen:  # Only add non-empty documents
+                            seen.add(doc_id)
+                            if not self._is_near_duplicate(detector, doc_id, text):
+                                writer.add_document(doc_id, text)
+        except BaseException:
+            writer.abort()
+            raise
+        with stage("merge"):
+            stats = writer.finish(duplicates=self._duplicates_record())
+        stats["near_duplicates"] = len(self.duplicates)
+        
+        self._print_index_stats(stats, f" ({stats['segments']} segments merged)")
+        print(f"\n Index saved: {output_path}")
+        print(f"  Size: {index_size_bytes(output_path) / 1024:.2f} KB")
+        
+        return stats
+    
+    def _html_batches(self, html_files: List[Path], workers: Optional[int], batch_size: int):
+        # (doc_id, text) batches extracted from HTML files
+        for start in range(0, len(html_files), batch_size):
+            batch = html_files[start:start + batch_size]
+            with stage("extract"):
+                texts = self._extract_texts(batch, workers)
+            yield [(html_file.stem, text) for html_file, text in zip(batch, texts)]
+    
+    @staticmethod
+    def _record_batches(records_dir: str, batch_size: int):  # (doc_id, text) batches read from record segments
+        batch = []
+        for record in iter_records(records_dir):
+            batch.append((record["doc_id"], record["text"]))
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+    
+    def update_index(self, corpus_dir: str, index_path: str, file_pattern="*.html",
+                     workers: Optional[int] = 1) -> Dict:
+        # Incrementally update a saved index to match corpus_dir. Files whose size and mtime (or,
+        # failing that, content hash) match the index manifest are not re-read: their stored term
+        # counts are reused. Only new or changed files are extracted, deleted files are dropped, and
+        # IDF weights are recomputed from the counts. The result equals a full build_index().
+        with stage("load"):
+            previous = self.load_index_data(index_path) if is_binary_index(index_path) else None
+        reason = "Record segments have no file manifest" if is_record_dir(corpus_dir) else self._incremental_blocker(previous)
+        if reason:
+            print(f"{reason} - running a full build")
+            return self.build_index(corpus_dir, file_pattern, workers)
+        
+        corpus_path = Path(corpus_dir)
+        html_files = sorted(corpus_path.glob(file_pattern))
+        if not html_files:
+            raise ValueError(f"No HTML files found in {corpus_dir}")
+        
+        previous_files = previous["manifest"]["files"]
+        previous_rows = {doc_id: row for row, doc_id in enumerate(previous["document_ids"])}
+        file_records = {}
+        changed_files = []
+        for html_file in html_files:
+            name = html_file.relative_to(corpus_path).as_posix()
+            record, unchanged = self._file_record(html_file, name, previous_files.get(name))
+            file_records[html_file] = record
+            if not unchanged:
+                changed_files.append(html_file)
+        removed = len(set(previous_files) - {record["path"] for record in file_records.values()})
+        
+        self.pruned_terms = self.pruned_postings = 0
+        print(f"\nUpdating index: {len(changed_files)} new or changed, {removed} removed, "
+              f"{len(html_files) - len(changed_files)} unchanged documents")
+        analyzer = self.vectorizer.build_analyzer()
+        new_counts = {}
+        with stage("extract"):
+            changed_texts = self._extract_texts(changed_files, workers,
+                                                digests=[file_records[html_file]["sha256"] for html_file in changed_files])
+        with stage("fit"):  # Count changed documents and rebuild the matrix from stored and new counts
+            for html_file, text in zip(changed_files, changed_texts):
+                file_records[html_file]["doc_id"] = html_file.stem if text else None
+                if text:
+                    new_counts[html_file] = Counter(analyzer(text))
+        
+            # Rows in corpus order: stored counts for unchanged documents, fresh counts for the rest
+            vocabulary = set(previous["vocabulary"])
+            for counts in new_counts.values():
+                vocabulary.update(counts)
+            vocabulary = sorted(vocabulary)
+            term_ids = {term: term_id for term_id, term in enumerate(vocabulary)}
+            previous_to_new = np.array([term_ids[term] for term in previous["vocabulary"]], dtype=np.int64)
+            previous_counts = previous["term_counts"]
+        
+            document_ids, row_indices, row_data = [], [], []
+            for html_file in html_files:
+                doc_id = file_records[html_file]["doc_id"]
+                if doc_id is None:
+                    continue
+                if html_file in new_counts:
+                    counts = new_counts[html_file]
+                    indices = np.array([term_ids[term] for term in counts], dtype=np.int64)
+                    data = np.array(list(counts.values()), dtype=np.int64)
+                    order = np.argsort(indices)
+                    indices, data = indices[order], data[order]
+                else:
+                    row = previous_rows[doc_id]
+                    start, end = previous_counts.indptr[row], previous_counts.indptr[row + 1]
+                    indices = previous_to_new[previous_counts.indices[start:end]]  # Monotonic, so stays sorted
+                    data = np.asarray(previous_counts.data[start:end], dtype=np.int64)
+                document_ids.append(doc_id)
+                row_indices.append(indices)
+                row_data.append(data)
+            if not document_ids:
+                raise ValueError("No valid documents found after text extraction")
+        
+            indptr = np.zeros(len(document_ids) + 1, dtype=np.int64)
+            np.cumsum([len(indices) for indices in row_indices], out=indptr[1:])
+            indices = np.concatenate(row_indices)
+        
+            # Drop terms that only occurred in removed or changed documents
+            document_frequency = np.bincount(indices, minlength=len(vocabulary))
+            if (document_frequency == 0).any():
+                kept_terms = document_frequency > 0
+                indices = (np.cumsum(kept_terms) - 1)[indices]
+                vocabulary = [term for term, kept in zip(vocabulary, kept_terms) if kept]
+        
+            self.document_ids = document_ids
+            self.vocabulary = vocabulary
+            self.vectorizer.vocabulary_ = {term: term_id for term_id, term in enumerate(vocabulary)}
+            self.term_counts = sparse.csr_matrix(
+                (np.concatenate(row_data), indices, indptr), shape=(len(document_ids), len(vocabulary))
+            )
+            self._apply_tfidf_weights()
+        self.manifest = {
+            "corpus_dir": str(corpus_path),
+            "extractor": self.extractor,
+            "files": {record["path"]: record for record in file_records.values()},
+        }
+        stats = self._compute_statistics()
+        
+        print(f"Index updated successfully")
         print(f"Documents: {stats['num_documents']}")
         print(f"Vocabulary: {stats['num_terms']} unique terms")
-        print(f"Matrix shape: {stats['matrix_shape']}")
-        print(f"Sparsity: {stats['sparsity']:.2f}%")
         
         return stats
     
-    def save_index(self, output_path: str) -> None:  # Save the TF-IDF index to a JSON file
+    def _new_duplicate_detector(self) -> Optional[NearDuplicateDetector]:  # Fresh detector for a build, if deduplication is on
+        self.duplicates = {}
+        if self.near_duplicate_threshold is None:
+            self.duplicate_params = None
+            return None
+        detector = NearDuplicateDetector(threshold=self.near_duplicate_threshold)
+        self.duplicate_params = detector.params()
+        return detector
+    
+    def _is_near_duplicate(self, detector: Optional[NearDuplicateDetector], doc_id: str, text: str) -> bool:
+        # Check doc_id against the documents kept so far, recording it in self.duplicates if it is one
+        if detector is None:
+            return False
+        canonical = detector.add(doc_id, text)
+        if canonical is None:
+            return False
+        self.duplicates[doc_id] = canonical
+        return True
+    
+    def _duplicates_record(self) -> Optional[Dict]:  # What write_index stores as duplicates.json
+        if self.duplicate_params is None:
+            return None
+        return {"params": self.duplicate_params, "duplicates": self.duplicates}
+    
+    def _incremental_blocker(self, previous: Optional[Dict]) -> Optional[str]:  # Reason a previous index cannot be updated in place, if any
+        if previous is None:
+            return "No previous binary index"
+        if self.near_duplicate_threshold is not None or previous.get("duplicates") is not None:
+            return "Near-duplicate detection runs on full builds only"
+        if pruning_enabled(self.vectorizer_params):  # Pruned terms' counts are not stored, so they cannot come back
+            return "Vocabulary pruning runs on full builds only"
+        if previous.get("term_counts") is None or previous.get("manifest") is None:
+            return "Previous index has no term counts or manifest"
+        if previous["vectorizer_params"] != self.vectorizer_params:
+            return "Vectorizer parameters changed"
+        if previous["manifest"].get("extractor") != self.extractor:
+            return "Text extractor changed"
+        return None
+    
+    def _prune_vocabulary(self) -> None:
+        # Drop the terms outside the document-frequency limits from self.term_counts and
+        # self.vocabulary, before IDF weights are computed (as TfidfVectorizer does)
+        counts = sparse.csr_matrix(self.term_counts)
+        document_frequency = np.bincount(counts.indices, minlength=counts.shape[1])
+        term_totals = np.asarray(counts.sum(axis=0)).ravel()
+        kept = vocabulary_mask(document_frequency, term_totals, counts.shape[0], self.vectorizer_params)
+        kept_ids = np.flatnonzero(kept)
+        self.pruned_terms = counts.shape[1] - len(kept_ids)
+        self.pruned_postings = int(document_frequency[~kept].sum())
+        if self.pruned_terms:
+            self.term_counts = counts[:, kept_ids]
+            self.vocabulary = [self.vocabulary[term_id] for term_id in kept_ids]
+    
+    def _apply_tfidf_weights(self) -> None:  # Weight self.term_counts into self.tfidf_matrix and self.idf
+        transformer = TfidfTransformer(norm=self.vectorizer_params["norm"])
+        self.tfidf_matrix = transformer.fit_transform(self.term_counts)
+        self.idf = transformer.idf_  # Persisted so queries get the same IDF weighting as documents
+    
+    @staticmethod
+    def _file_record(html_file: Path, path: str, previous: Optional[Dict] = None) -> Tuple[Dict, bool]:
+        # Manifest record for a file (path relative to the corpus directory), and whether it is
+        # unchanged from its previous record. Matching size and mtime skips hashing.
+        stat = html_file.stat()
+        if previous and previous["size"] == stat.st_size and previous["mtime_ns"] == stat.st_mtime_ns:
+            return previous, True
+        record = {"path": path, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+                  "sha256": file_digest(html_file), "doc_id": None}
+        if previous and previous["sha256"] == record["sha256"]:
+            record["doc_id"] = previous["doc_id"]
+            return record, True
+        return record, False
+    
+    def _extract_texts(self, html_files: List[Path], workers: Optional[int] = 1,
+                       digests: Optional[List[str]] = None) -> List[str]:
+        # Extract text from every file, fanning out over a process pool when workers > 1
+        # (None uses every core). Results come back in file order, so ids match a serial build.
+        # With a text cache, files whose content hash is cached are not parsed at all.
+        texts = [None] * len(html_files)
+        if self.text_cache is not None:
+            digests = digests or [file_digest(html_file) for html_file in html_files]
+            extractor_key = f"{self.extractor}-v{EXTRACTOR_VERSIONS[self.extractor]}"
+            for position, digest in enumerate(digests):
+                texts[position] = self.text_cache.get(digest, extractor_key)
+        pending = [position for position, text in enumerate(texts) if text is None]
+        pending_files = [html_files[position] for position in pending]
+        
+        workers = workers or os.cpu_count() or 1
+        if workers > 1 and len(pending_files) > 1:
+            chunksize = max(1, len(pending_files) // (workers * 4))
+            print(f"Extracting text with {workers} worker processes")
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                extracted = list(executor.map(self.extract_text, pending_files, chunksize=chunksize))
+        else:
+            extracted = [self.extract_text(html_file) for html_file in pending_files]
+        
+        for position, text in zip(pending, extracted):
+            texts[position] = text
+            # The extractors also return "" when reading or parsing fails; caching that would keep
+            # the document empty for good, so empty texts are extracted again on the next build
+            if self.text_cache is not None and text:
+                self.text_cache.put(digests[position], extractor_key, text)
+        if self.text_cache is not None:
+            print(f"Text cache: {len(html_files) - len(pending)} hits, {len(pending)} extracted")
+        return texts
+    
+    def save_index(self, output_path: str, format: str = "binary", num_shards: int = 1) -> None:  # Save the TF-IDF index (binary directory, or dense JSON export); num_shards > 1 splits a binary index into shards
         if self.tfidf_matrix is None:
             raise RuntimeError("Index not built yet. Call build_index() first.")
+        if format not in ("binary", "json"):
+            raise ValueError("format must be 'binary' or 'json'")
+        if num_shards > 1 and format != "binary":
+            raise ValueError("Only binary indexes can be sharded")
         output_file = Path(output_path)
         ensure_directories(output_file.parent) 
-        index_data = {
-            "document_ids": self.document_ids,
-            "vocabulary": self.vocabulary,
-            "tfidf_matrix": self.tfidf_matrix.toarray().tolist(),
-            "vectorizer_params": self.vectorizer_params
-        }
-        with output_file.open("w", encoding="utf-8") as f:
-            json.dump(index_data, f, indent=2)
+        with stage("save"):
+            if format == "json":
+                write_json_index(output_file, self.document_ids, self.vocabulary,
+                                 self.tfidf_matrix, self.vectorizer_params, idf=self.idf)
+            elif num_shards > 1:  # Shards keep the global vocabulary and IDF; there is no manifest for --incremental
+                write_sharded_index(output_file, num_shards, self.document_ids, self.vocabulary,
+                                    self.tfidf_matrix, self.vectorizer_params, idf=self.idf,
+                                    term_counts=self.term_counts, duplicates=self._duplicates_record())
+            else:
+                write_index(output_file, self.document_ids, self.vocabulary,
+                            self.tfidf_matrix, self.vectorizer_params, idf=self.idf,
+                            term_counts=self.term_counts, manifest=self.manifest,
+                            duplicates=self._duplicates_record())
         
-        file_size_kb = output_file.stat().st_size / 1024
+        file_size_kb = index_size_bytes(output_file) / 1024
         print(f"\n Index saved: {output_file}")
         print(f"  Size: {file_size_kb:.2f} KB")
+        if num_shards > 1:
+            print(f"  Shards: {num_shards}")
     
     def _compute_statistics(self) -> Dict:  # Calculate and return index statistics (documents, terms, sparsity)
         sparsity = 1 - (
@@ -87,17 +464,40 @@ class DocumentIndexer:
             "num_documents": self.tfidf_matrix.shape[0],
             "num_terms": self.tfidf_matrix.shape[1],
             "matrix_shape": f"{self.tfidf_matrix.shape[0]} x {self.tfidf_matrix.shape[1]}",
-            "sparsity": sparsity * 100
+            "sparsity": sparsity * 100,
+            "candidate_terms": self.tfidf_matrix.shape[1] + self.pruned_terms,  # Before pruning
+            "pruned_terms": self.pruned_terms,
+            "pruned_postings": self.pruned_postings,
+            "near_duplicates": len(self.duplicates)
         }
     
+    def _print_index_stats(self, stats: Dict, detail: str = "") -> None:  # Report a finished build's statistics
+        print(f"Index built successfully{detail}")
+        print(f"Documents: {stats['num_documents']}")
+        print(f"Vocabulary: {stats['num_terms']} unique terms")
+        print(f"Matrix shape: {stats['matrix_shape']}")
+        print(f"Sparsity: {stats['sparsity']:.2f}%")
+        if self.near_duplicate_threshold is not None:
+            print(f"Near-duplicates left out: {stats['near_duplicates']}")
+        if pruning_enabled(self.vectorizer_params):
+            print(f"Pruned: {stats['pruned_terms']} of {stats['candidate_terms']} terms "
+                  f"({stats['pruned_postings']} postings)")
+    
     @staticmethod
-    def load_index(index_path: str) -> Tuple[List[str], List[str], np.ndarray, Dict]:  # Load index from JSON and return document IDs, vocabulary, matrix, and parameters
-        with open(index_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
+    def load_index_data(index_path: str, mmap: bool = True, dequantize: bool = True) -> Dict:  # Load every stored index component (including IDF) as a dict
+        if is_binary_index(index_path):
+            return read_index(index_path, mmap=mmap, dequantize=dequantize)
+        if is_sharded_index(index_path):  # All shards concatenated into one index
+            return read_sharded_index(index_path, mmap=mmap)
+        return read_json_index(index_path)  # Legacy dense JSON index
+    
+    @staticmethod
+    def load_index(index_path: str, mmap: bool = True) -> Tuple[List[str], List[str], sparse.csr_matrix, Dict]:  # Load index and return document IDs, vocabulary, matrix, and parameters
+        data = DocumentIndexer.load_index_data(index_path, mmap=mmap)
         
         document_ids = data["document_ids"]
         vocabulary = data["vocabulary"]
-        tfidf_matrix = np.array(data["tfidf_matrix"])
+        tfidf_matrix = data["tfidf_matrix"]
         params = data["vectorizer_params"]
         
         print(f"Index loaded from {index_path}")
@@ -106,16 +506,32 @@ class DocumentIndexer:
         
         return document_ids, vocabulary, tfidf_matrix, params
 
-
-def build_and_save_index(corpus_dir: str, output_path: str) -> None:  # Build and save index in one step - convenience wrapper function
-    indexer = DocumentIndexer()
-    indexer.build_index(corpus_dir)
-    indexer.save_index(output_path)
+def build_and_save_index(corpus_dir: str, output_path: str, format: str = "binary",
+                         workers: Optional[int] = 1, incremental: bool = False,
+                         cache_dir: Optional[str] = None, streaming: bool = False,
+                         memory_budget_mb: int = 256,
+                         near_duplicate_threshold: Optional[float] = None,
+                         vocabulary_options: Optional[Dict] = None, num_shards: int = 1) -> None:  # Build and save index in one step - convenience wrapper function
+    # vocabulary_options: DocumentIndexer's token_pattern, min_df, max_df and max_features
+    indexer = DocumentIndexer(cache_dir=cache_dir, near_duplicate_threshold=near_duplicate_threshold,
+                              **(vocabulary_options or {}))
+    if streaming:  # Constant-memory build written directly to output_path
+        if format != "binary" or num_shards > 1:
+            raise ValueError("Streaming builds write a single binary index only")
+        if incremental:
+            raise ValueError("Streaming builds cannot update an index incrementally")
+        indexer.build_index_streaming(corpus_dir, output_path, workers=workers, memory_budget_mb=memory_budget_mb)
+        return
+    if incremental:  # Update the index already at output_path, re-reading only changed files
+        indexer.update_index(corpus_dir, output_path, workers=workers)
+    else:
+        indexer.build_index(corpus_dir, workers=workers)
+    indexer.save_index(output_path, format=format, num_shards=num_shards)
 
 
 if __name__ == "__main__":
     print("Building index for official HTML corpus")
     build_and_save_index(
         corpus_dir="data/html_corpus",
-        output_path="data/output/index.json"
+        output_path="data/output/index"
     )
\ No newline at end of file
@@ -0,0 +1,286 @@
+# Inverted index retrieval - postings lists with per-term max scores, scored term-at-a-time or with WAND
+
+import heapq
+import shutil
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from scipy import sparse
+from sklearn.preprocessing import normalize
+
+try:
+    from src.index_format import is_binary_index, is_compacted_index
+    from src.indexer import DocumentIndexer
+    from src.query_processor import QueryVectorizer, top_k_indices
+except ModuleNotFoundError:
+    from index_format import is_binary_index, is_compacted_index
+    from indexer import DocumentIndexer
+    from query_processor import QueryVectorizer, top_k_indices
+
+POSTINGS_DIR = "postings"
+SEARCH_MODES = ("taat", "wand")
+
+
+class InvertedIndex:
+    # Postings lists - for every term, the ascending document numbers containing it, the
+    # term's weight in each of them, and the largest such weight (the term's score upper bound).
+    # Postings of a compacted index hold its stored weights instead (see from_compacted_matrix).
+    def __init__(self, postings_ptr: np.ndarray, postings_docs: np.ndarray,
+                 postings_weights: np.ndarray, max_weights: np.ndarray, num_documents: int):
+        self.postings_ptr = postings_ptr
+        self.postings_docs = postings_docs
+        self.postings_weights = postings_weights
+        self.max_weights = max_weights
+        self.num_documents = num_documents
+
+    @classmethod
+    def from_matrix(cls, tfidf_matrix, vectorizer_params: Optional[Dict] = None) -> "InvertedIndex":  # Build postings from a (documents x terms) TF-IDF matrix
+        matrix = sparse.csr_matrix(tfidf_matrix, dtype=np.float64)
+        if (vectorizer_params or {}).get("norm", "l2") != "l2":
+            matrix = normalize(matrix)  # Postings hold cosine contributions, so rows must be unit length
+        return cls._from_document_major(matrix)
+
+    @classmethod
+    def from_compacted_matrix(cls, matrix) -> "InvertedIndex":
+        # Postings of a compacted index's stored matrix in its own dtype (float32 weights or uint8
+        # codes), neither normalised nor scaled: QueryProcessor applies the per-document scales
+        # and norms to the scores, as it does for the matrix itself
+        return cls._from_document_major(sparse.csr_matrix(matrix))
+
+    @classmethod
+    def _from_document_major(cls, matrix: sparse.csr_matrix) -> "InvertedIndex":
+        term_major = matrix.tocsc()
+        term_major.sort_indices()
+        postings_ptr = term_major.indptr  # Same index dtype as postings_docs, so term_matrix() needs no copy
+        max_weights = np.zeros(term_major.shape[1], dtype=np.float64)
+        non_empty = np.flatnonzero(np.diff(postings_ptr) > 0)
+        if non_empty.size:
+            max_weights[non_empty] = np.maximum.reduceat(term_major.data, postings_ptr[non_empty])
+
+        return cls(postings_ptr, term_major.indices, term_major.data,
+                   max_weights, term_major.shape[0])
+
+    @classmethod
+    def load(cls, index_dir, mmap: bool = True) -> "InvertedIndex":  # Load postings saved by save() next to an index
+        postings_dir = Path(index_dir) / POSTINGS_DIR
+        mmap_mode = "r" if mmap else None
+        arrays = {
+            name: np.load(postings_dir / f"{name}.npy", mmap_mode=mmap_mode)
+            for name in ("postings_ptr", "postings_docs", "postings_weights", "max_weights")
+        }
+        num_documents = int(np.load(postings_dir / "num_documents.npy"))
+        return cls(num_documents=num_documents, **arrays)
+
+    @staticmethod
+    def exists(index_dir) -> bool:
+        return (Path(index_dir) / POSTINGS_DIR / "max_weights.npy").is_file()
+
+    def save(self, index_dir) -> Path:
+        # Store the postings in a subdirectory of a binary index. They are written to a temporary
+        # directory and renamed into place, so processes building them at the same time (server
+        # workers reloading one index) never read partial postings; the first one stored is kept.
+        postings_dir = Path(index_dir) / POSTINGS_DIR
+        tmp_dir = postings_dir.with_name(f".{POSTINGS_DIR}.tmp-{uuid.uuid4().hex[:8]}")
+        tmp_dir.mkdir(parents=True)
+        try:
+            np.save(tmp_dir / "postings_ptr.npy", self.postings_ptr)
+            np.save(tmp_dir / "postings_docs.npy", self.postings_docs)
+            np.save(tmp_dir / "postings_weights.npy", self.postings_weights)
+            np.save(tmp_dir / "num_documents.npy", np.int64(self.num_documents))
+            np.save(tmp_dir / "max_weights.npy", self.max_weights)
+            if postings_dir.exists() and not InvertedIndex.exists(index_dir):
+                shutil.rmtree(postings_dir)  # Left incomplete by an interrupted save
+            tmp_dir.rename(postings_dir)
+        except OSError:
+            if not InvertedIndex.exists(index_dir):
+                raise
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)  # Already stored by another process
+        return postings_dir
+
+    def postings(self, term_id: int) -> Tuple[np.ndarray, np.ndarray]:  # (document numbers, weights) of one term
+        start, end = self.postings_ptr[term_id], self.postings_ptr[term_id + 1]
+        return self.postings_docs[start:end], self.postings_weights[start:end]
+
+    def term_matrix(self) -> sparse.csr_matrix:  # The postings as a (terms x documents) CSR matrix sharing their (possibly memory-mapped) arrays
+        return sparse.csr_matrix((self.postings_weights, self.postings_docs, self.postings_ptr),
+                                 shape=(len(self.max_weights), self.num_documents), copy=False)
+
+    def document_frequency(self, term_id: int) -> int:
+        return int(self.postings_ptr[term_id + 1] - self.postings_ptr[term_id])
+
+
+class _PostingsCursor:
+    # Position in one query term's postings list during WAND traversal
+    __slots__ = ("docs", "weights", "query_weight", "upper_bound", "position", "doc")
+
+    def __init__(self, docs: np.ndarray, weights: np.ndarray, query_weight: float, max_weight: float):
+        self.docs = docs
+        self.weights = weights
+        self.query_weight = query_weight
+        self.upper_bound = query_weight * max_weight
+        self.position = 0
+        self.doc = int(docs[0])
+
+    def advance_to(self, target_doc: int) -> bool:  # Move to the first posting >= target_doc; False once exhausted
+        self.position += int(np.searchsorted(self.docs[self.position:], target_doc))
+        if self.position >= len(self.docs):
+            return False
+        self.doc = int(self.docs[self.position])
+        return True
+
+    def next(self) -> bool:
+        self.position += 1
+        if self.position >= len(self.docs):
+            return False
+        self.doc = int(self.docs[self.position])
+        return True
+
+
+class RetrievalEngine:
+    # Retrieval engine - scores a query by traversing only the postings of its terms, so query cost
+    # depends on the document frequency of the query terms rather than on the corpus size.
+    # Only documents containing at least one query term are returned.
+    def __init__(self, document_ids: List[str], inverted_index: InvertedIndex,
+                 vectorizer: QueryVectorizer):
+        self.document_ids = document_ids
+        self.inverted_index = inverted_index
+        self.vectorizer = vectorizer
+
+        print(f"Retrieval engine initialized")
+        print(f"  Ready to search {len(self.document_ids)} documents")
+
+    @classmethod
+    def from_index(cls, index_path: str) -> "RetrievalEngine":  # Load an index, using its stored postings if present
+        index_path = Path(index_path).resolve()  # Matrix and postings from the same build
+        data = DocumentIndexer.load_index_data(str(index_path))
+        if InvertedIndex.exists(index_path) and "compaction" not in data["meta"]:  # Compacted postings are unscaled
+            inverted_index = InvertedIndex.load(index_path)
+        else:
+            inverted_index = InvertedIndex.from_matrix(data["tfidf_matrix"], data["vectorizer_params"])
+        vectorizer = QueryVectorizer(data["vocabulary"], data["vectorizer_params"], data["idf"])
+        return cls(data["document_ids"], inverted_index, vectorizer)
+
+    def search(self, query_text: str, top_k: int = 10, mode: str = "taat") -> List[Tuple[int, str, float]]:  # Return (rank, doc_id, score) for the best top_k matching documents
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"mode must be one of {SEARCH_MODES}")
+
+        query_vector = normalize(self.vectorizer.transform([query_text]))
+        terms = query_vector.indices.tolist()
+        query_weights = query_vector.data.tolist()
+        if not terms or top_k < 1:
+            return []
+
+        if mode == "wand":
+            doc_numbers, scores = self._search_wand(terms, query_weights, top_k)
+        else:
+            doc_numbers, scores = self._search_taat(terms, query_weights, top_k)
+
+        return [
+            (rank + 1, self.document_ids[doc_number], score)
+            for rank, (doc_number, score) in enumerate(zip(doc_numbers, scores))
+        ]
+
+    def _search_taat(self, terms: List[int], query_weights: List[float],
+                     top_k: int) -> Tuple[List[int], List[float]]:
+        # Term-at-a-time: concatenate the query terms' postings and sum contributions per document
+        docs_parts = []
+        contribution_parts = []
+        for term_id, query_weight in zip(terms, query_weights):
+            docs, weights = self.inverted_index.postings(term_id)
+            docs_parts.append(docs)
+            contribution_parts.append(weights * query_weight)
+
+        matched_docs, positions = np.unique(np.concatenate(docs_parts), return_inverse=True)
+        scores = np.bincount(positions, weights=np.concatenate(contribution_parts))
+        best = top_k_indices(scores, top_k)  # matched_docs is ascending, so ties keep document order
+        return matched_docs[best].tolist(), scores[best].tolist()
+
+    def _search_wand(self, terms: List[int], query_weights: List[float],
+                     top_k: int) -> Tuple[List[int], List[float]]:
+        # Document-at-a-time WAND: skip documents whose summed term upper bounds cannot beat the
+        # current k-th best score
+        cursors = []
+        for term_id, query_weight in zip(terms, query_weights):
+            docs, weights = self.inverted_index.postings(term_id)
+            if len(docs):
+                cursors.append(_PostingsCursor(docs, weights, query_weight,
+                                               float(self.inverted_index.max_weights[term_id])))
+
+        heap = []  # Min-heap of (score, -doc); on equal scores the later document is evicted first
+        threshold = 0.0
+        while cursors:
+            cursors.sort(key=lambda cursor: cursor.doc)
+
+            # Pivot: first cursor at which the accumulated upper bound can beat the threshold
+            upper_bound = 0.0
+            pivot = None
+            for position, cursor in enumerate(cursors):
+                upper_bound += cursor.upper_bound
+                if upper_bound * (1 + 1e-9) > threshold:
+                    pivot = position
+                    break
+            if pivot is None:
+                break
+            pivot_doc = cursors[pivot].doc
+
+            if cursors[0].doc == pivot_doc:
+                # Every cursor up to the pivot is on pivot_doc: score it fully
+                score = 0.0
+                for cursor in cursors:
+                    if cursor.doc != pivot_doc:
+                        break
+                    score += cursor.query_weight * float(cursor.weights[cursor.position])
+                if len(heap) < top_k:
+                    heapq.heappush(heap, (score, -pivot_doc))
+                elif score > heap[0][0]:
+                    heapq.heapreplace(heap, (score, -pivot_doc))
+                if len(heap) == top_k:
+                    threshold = heap[0][0]
+                cursors = [cursor for cursor in cursors if cursor.doc != pivot_doc or cursor.next()]
+            else:
+                # Documents before pivot_doc cannot make the top k: skip the leading cursors ahead
+                cursors = [
+                    cursor for position, cursor in enumerate(cursors)
+                    if position >= pivot or cursor.advance_to(pivot_doc)
+                ]
+
+        ranked = sorted(((-score, -negative_doc) for score, negative_doc in heap))
+        return [doc for _, doc in ranked], [-negative_score for negative_score, _ in ranked]
+
+
+def ensure_postings(index_path: str) -> bool:
+    # Store the term-major postings of a binary index (compacted or not) unless it already has
+    # them; returns whether it has them. QueryProcessor.from_index memory-maps stored postings, so
+    # every server worker shares them through the page cache instead of building a private
+    # transposed copy.
+    index_path = Path(index_path).resolve()
+    if not is_binary_index(index_path):
+        return False
+    if not InvertedIndex.exists(index_path):
+        print("Building postings for shared memory-mapped serving")
+        build_postings(str(index_path))
+    return True
+
+
+def build_postings(index_path: str) -> InvertedIndex:  # Indexer stage: build postings for a saved index and store them alongside it
+    if is_compacted_index(index_path):
+        data = DocumentIndexer.load_index_data(index_path, dequantize=False)
+        inverted_index = InvertedIndex.from_compacted_matrix(data["tfidf_matrix"])
+    else:
+        data = DocumentIndexer.load_index_data(index_path)
+        inverted_index = InvertedIndex.from_matrix(data["tfidf_matrix"], data["vectorizer_params"])
+    postings_dir = inverted_index.save(index_path)
+    print(f"Postings saved: {postings_dir}")
+    print(f"  Postings: {len(inverted_index.postings_docs)} across {len(inverted_index.max_weights)} terms")
+    return inverted_index
+
+
+if __name__ == "__main__":
+    print("Building postings for official index")
+    build_postings("data/output/index")
+    engine = RetrievalEngine.from_index("data/output/index")
+    for rank, doc_id, score in engine.search("information retrieval", top_k=3, mode="wand"):
+        print(f"    {rank}. {doc_id} (score: {score:.4f})")
@@ -0,0 +1,123 @@
+# Metrics - low-overhead stage timers, counters and histograms rendered in the Prometheus text format
+
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Tuple
+
+# Latency buckets in seconds, from 50 microseconds to 5 seconds
+DEFAULT_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class StageTimings:
+    # Lap timer for one request: lap(stage) charges the time since the previous lap to stage.
+    # One perf_counter call per stage, so it can stay on for every request.
+    __slots__ = ("stages", "started", "_last")
+
+    def __init__(self):
+        self.started = self._last = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+
+    def lap(self, stage: str) -> None:
+        now = time.perf_counter()
+        self.stages[stage] = self.stages.get(stage, 0.0) + now - self._last
+        self._last = now
+
+    def total(self) -> float:
+        return time.perf_counter() - self.started
+
+    def header(self) -> str:  # X-Timing header value, in milliseconds
+        parts = [f"{stage}={seconds * 1000:.3f}" for stage, seconds in self.stages.items()]
+        parts.append(f"total={self.total() * 1000:.3f}")
+        return ", ".join(parts)
+
+
+class Histogram:
+    # Cumulative-bucket histogram (Prometheus semantics: a value is counted in every bucket >= it)
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Iterable[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    # Thread-safe counters and histograms keyed by metric name and labels, plus collectors that
+    # report gauges and counters owned by other objects (e.g. the result cache) at scrape time
+    def __init__(self):
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self._help: Dict[str, Tuple[str, str]] = {}
+        self._collectors: List[Callable[[], Iterable[Tuple[str, str, str, Iterable[Tuple[Labels, float]]]]]] = []
+        self._lock = threading.Lock()
+
+    def describe(self, name: str, metric_type: str, help_text: str) -> None:
+        self._help[name] = (metric_type, help_text)
+
+    def inc(self, name: str, labels: Labels = (), value: float = 1) -> None:
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[labels] = series.get(labels, 0) + value
+
+    def observe(self, name: str, value: float, labels: Labels = ()) -> None:
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(labels)
+            if histogram is None:
+                histogram = series[labels] = Histogram()
+            histogram.observe(value)
+
+    def add_collector(self, collector) -> None:
+        # collector() yields (name, type, help, [(labels, value), ...]) for values computed on scrape
+        self._collectors.append(collector)
+
+    def render(self) -> str:  # Prometheus text exposition format (version 0.0.4)
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                self._header(lines, name, "counter")
+                for labels, value in sorted(series.items()):
+                    lines.append(f"{name}{_labels(labels)} {_number(value)}")
+            for name, series in sorted(self._histograms.items()):
+                self._header(lines, name, "histogram")
+                for labels, histogram in sorted(series.items()):
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else repr(bound)
+                        lines.append(f"{name}_bucket{_labels(labels + (('le', le),))} {cumulative}")
+                    lines.append(f"{name}_sum{_labels(labels)} {_number(histogram.sum)}")
+                    lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+        for collector in self._collectors:
+            for name, metric_type, help_text, samples in collector():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_labels(labels)} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+    def _header(self, lines: List[str], name: str, default_type: str) -> None:
+        metric_type, help_text = self._help.get(name, (default_type, name))
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+
+
+def _labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
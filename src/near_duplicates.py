@@ -0,0 +1,85 @@
+# Near-duplicate detection - MinHash signatures with LSH banding, applied while documents are indexed
+import zlib
+from typing import Dict, List, Optional
+
+import numpy as np
+
+DEFAULT_THRESHOLD = 0.8
+DEFAULT_NUM_PERM = 128
+DEFAULT_BANDS = 16  # 16 bands x 8 rows: pairs above ~0.7 Jaccard almost always share a bucket
+DEFAULT_SHINGLE_SIZE = 5
+
+
+class NearDuplicateDetector:
+    # Online near-duplicate filter. Each document's word shingles are summarised by a MinHash
+    # signature; the signature is cut into bands, and documents sharing any band land in the
+    # same LSH bucket. add() compares a new document only with the kept documents in its buckets
+    # (not with the whole corpus), so detection is roughly linear in the number of documents.
+    # A document whose estimated Jaccard similarity with a kept one reaches threshold is reported
+    # as a duplicate of it; the first document of a cluster (in indexing order) is the canonical one.
+    def __init__(self, threshold: float = DEFAULT_THRESHOLD, num_perm: int = DEFAULT_NUM_PERM,
+                 bands: int = DEFAULT_BANDS, shingle_size: int = DEFAULT_SHINGLE_SIZE, seed: int = 1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.seed = seed
+        rng = np.random.default_rng(seed)
+        # Multiply-shift hash families (arithmetic wraps modulo 2**64; the high 32 bits are used)
+        self._shingle_weights = rng.integers(1, 2 ** 63, size=shingle_size, dtype=np.uint64) | np.uint64(1)
+        self._a = rng.integers(1, 2 ** 63, size=num_perm, dtype=np.uint64) | np.uint64(1)
+        self._b = rng.integers(0, 2 ** 63, size=num_perm, dtype=np.uint64)
+        self._word_hashes: Dict[str, int] = {}
+        self._buckets: List[Dict[bytes, List[int]]] = [{} for _ in range(bands)]
+        self._signatures: List[np.ndarray] = []
+        self._doc_ids: List[str] = []
+
+    def params(self) -> Dict:  # Settings recorded in the index next to the duplicate mapping
+        return {"threshold": self.threshold, "num_perm": self.num_perm, "bands": self.bands,
+                "shingle_size": self.shingle_size, "seed": self.seed}
+
+    def signature(self, text: str) -> np.ndarray:  # MinHash signature (num_perm uint32 values) of the text's word shingles
+        words = text.lower().split()
+        hashes = np.fromiter((self._word_hash(word) for word in words), dtype=np.uint64, count=len(words))
+        size = min(self.shingle_size, len(hashes))
+        shingles = np.zeros(len(hashes) - size + 1, dtype=np.uint64)
+        for offset in range(size):
+            shingles += hashes[offset:len(hashes) - size + 1 + offset] * self._shingle_weights[offset]
+        shingles = np.unique(shingles)
+        signature = np.full(self.num_perm, np.iinfo(np.uint32).max, dtype=np.uint32)
+        for start in range(0, len(shingles), 4096):  # Bounded temporary: num_perm x 4096 values
+            block = shingles[start:start + 4096]
+            permuted = (self._a[:, None] * block[None, :] + self._b[:, None]) >> np.uint64(32)
+            np.minimum(signature, permuted.min(axis=1).astype(np.uint32), out=signature)
+        return signature
+
+    def _word_hash(self, word: str) -> int:  # Deterministic across processes, unlike hash()
+        value = self._word_hashes.get(word)
+        if value is None:
+            encoded = word.encode("utf-8")
+            value = self._word_hashes[word] = (zlib.crc32(encoded) << 32) | zlib.adler32(encoded)
+        return value
+
+    def add(self, doc_id: str, text: str) -> Optional[str]:
+        # Canonical document ID if doc_id near-duplicates a kept document; otherwise keep it and return None
+        signature = self.signature(text)
+        keys = [signature[band * self.rows:(band + 1) * self.rows].tobytes() for band in range(self.bands)]
+        candidates = set()
+        for bucket, key in zip(self._buckets, keys):
+            candidates.update(bucket.get(key, ()))
+        if candidates:
+            candidates = sorted(candidates)  # Ties go to the earliest kept document
+            similarities = [np.count_nonzero(self._signatures[candidate] == signature) for candidate in candidates]
+            best = int(np.argmax(similarities))
+            if similarities[best] >= self.threshold * self.num_perm:  # Estimated Jaccard similarity
+                return self._doc_ids[candidates[best]]
+
+        number = len(self._doc_ids)
+        self._doc_ids.append(doc_id)
+        self._signatures.append(signature)
+        for bucket, key in zip(self._buckets, keys):
+            bucket.setdefault(key, []).append(number)
+        return None
@@ -0,0 +1,213 @@
+# Pipeline profiler - wall time, CPU time and peak memory per pipeline stage, with optional
+# cProfile and tracemalloc dumps per stage
+import cProfile
+import json
+import os
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import Dict, List, Optional
+
+try:
+    import resource  # Peak RSS fallback; not available on Windows
+except ImportError:
+    resource = None
+
+DEFAULT_PROFILE_DIR = "data/output/profile"
+
+_active: Optional["PipelineProfiler"] = None  # Profiler that stage() reports to, if any
+
+
+def stage(name: str):
+    # Context manager timing a (sub-)stage of whichever profiler is active; a no-op otherwise,
+    # so library code (indexer, query processor) can mark its stages unconditionally
+    return nullcontext() if _active is None else _active.stage(name)
+
+
+def current_rss_bytes() -> Optional[int]:  # Resident set size right now (Linux), or None
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def peak_rss_bytes() -> Optional[int]:  # Highest RSS of this process so far
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # Linux reports KB
+
+
+def _cpu_seconds() -> float:  # User + system time of this process and its finished children (e.g. extraction workers)
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+class StageRecord:
+    __slots__ = ("number", "path", "depth", "wall", "cpu", "peak_rss", "traced_peak", "files",
+                 "_wall_start", "_cpu_start", "_profile", "_snapshot")
+
+    def __init__(self, number: int, path: str, depth: int):
+        self.number = number  # Order of entry, used to name the stage's files
+        self.path = path
+        self.depth = depth
+        self.wall = self.cpu = 0.0
+        self.peak_rss = None
+        self.traced_peak = None
+        self.files: List[str] = []
+
+    def to_dict(self) -> Dict:
+        return {"stage": self.path, "wall_seconds": self.wall, "cpu_seconds": self.cpu,
+                "peak_rss_bytes": self.peak_rss, "traced_peak_bytes": self.traced_peak, "files": self.files}
+
+
+class PipelineProfiler:
+    # Records every stage entered through stage(name) while active (`with profiler:`). Stages nest:
+    # "index:official" contains "extract", "fit" and "save". Peak RSS comes from a sampling thread
+    # (every sample_interval seconds, plus stage entry and exit) and covers this process only;
+    # CPU time also counts extraction worker processes once they exit. With cprofile, each stage's
+    # .prof file excludes its nested stages, which get files of their own. With trace_memory,
+    # tracemalloc reports each stage's peak Python allocation and a top-allocations diff.
+    def __init__(self, output_dir: Optional[str] = None, cprofile: bool = False,
+                 trace_memory: bool = False, sample_interval: float = 0.005):
+        self.output_dir = Path(output_dir) if output_dir else None
+        self.cprofile = cprofile
+        self.trace_memory = trace_memory
+        self.sample_interval = sample_interval
+        self.records: List[StageRecord] = []
+        self._stack: List[StageRecord] = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler = None
+        self._started_tracemalloc = False
+        if (cprofile or trace_memory) and self.output_dir is None:
+            raise ValueError("cProfile and tracemalloc output need an output_dir")
+
+    def __enter__(self):
+        global _active
+        if self.output_dir is not None:
+            self.output_dir.mkdir(parents=True, exist_ok=True)
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        if current_rss_bytes() is not None:
+            self._stop.clear()
+            self._sampler = threading.Thread(target=self._sample, name="rss-sampler", daemon=True)
+            self._sampler.start()
+        _active = self
+        return self
+
+    def __exit__(self, *exc_info):
+        global _active
+        _active = None
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+            self._sampler = None
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+        return False
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self.sample_interval):
+            self._observe_rss()
+
+    def _observe_rss(self) -> None:  # Raise the peak of every open stage to the current RSS
+        rss = current_rss_bytes()
+        if rss is None:
+            return
+        with self._lock:
+            for record in self._stack:
+                if record.peak_rss is None or rss > record.peak_rss:
+                    record.peak_rss = rss
+
+    @contextmanager
+    def stage(self, name: str):
+        parent = self._stack[-1] if self._stack else None
+        record = StageRecord(len(self.records) + 1, f"{parent.path}/{name}" if parent else name, len(self._stack))
+        self.records.append(record)
+        if parent is not None and parent._profile is not None:
+            parent._profile.disable()  # Only one profiler can be active; the parent resumes on exit
+        if self.trace_memory:
+            if parent is not None:
+                parent.traced_peak = max(parent.traced_peak or 0, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+            record._snapshot = tracemalloc.take_snapshot()
+        else:
+            record._snapshot = None
+        with self._lock:
+            self._stack.append(record)
+        self._observe_rss()
+        record._profile = cProfile.Profile() if self.cprofile else None
+        record._cpu_start = _cpu_seconds()
+        record._wall_start = time.perf_counter()
+        if record._profile is not None:
+            record._profile.enable()
+        try:
+            yield record
+        finally:
+            if record._profile is not None:
+                record._profile.disable()
+            record.wall = time.perf_counter() - record._wall_start
+            record.cpu = _cpu_seconds() - record._cpu_start
+            self._observe_rss()
+            with self._lock:
+                self._stack.pop()
+            if record.peak_rss is None:
+                record.peak_rss = peak_rss_bytes()  # No RSS sampling here: process high-water mark
+            self._finish(record, parent)
+            if parent is not None and parent._profile is not None:
+                parent._profile.enable()
+
+    def _finish(self, record: StageRecord, parent: Optional[StageRecord]) -> None:  # Write the stage's profile files
+        prefix = f"{record.number:02d}-{re.sub(r'[^A-Za-z0-9_.-]+', '_', record.path)}"
+        if record._profile is not None:
+            path = self.output_dir / f"{prefix}.prof"
+            record._profile.dump_stats(str(path))  # Inspect with: python -m pstats <file>
+            record.files.append(str(path))
+            record._profile = None
+        if self.trace_memory:
+            record.traced_peak = max(record.traced_peak or 0, tracemalloc.get_traced_memory()[1])
+            if parent is not None:
+                parent.traced_peak = max(parent.traced_peak or 0, record.traced_peak)
+            differences = tracemalloc.take_snapshot().compare_to(record._snapshot, "lineno")
+            path = self.output_dir / f"{prefix}.tracemalloc.txt"
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(f"Stage {record.path}: peak traced memory {record.traced_peak / 1024 / 1024:.1f} MB\n")
+                f.write("Largest allocation changes by line:\n")
+                for difference in differences[:30]:
+                    f.write(f"{difference}\n")
+            record.files.append(str(path))
+        record._snapshot = None
+
+    def summary_table(self) -> str:
+        headers = ["stage", "wall s", "cpu s", "cpu %", "peak RSS MB"]
+        if self.trace_memory:
+            headers.append("py peak MB")
+        rows = []
+        for record in self.records:
+            row = ["  " * record.depth + record.path.rsplit("/", 1)[-1], f"{record.wall:.3f}", f"{record.cpu:.3f}",
+                   f"{100 * record.cpu / record.wall:.0f}" if record.wall else "-",
+                   f"{record.peak_rss / 1024 / 1024:.1f}" if record.peak_rss is not None else "-"]
+            if self.trace_memory:
+                row.append(f"{record.traced_peak / 1024 / 1024:.1f}" if record.traced_peak is not None else "-")
+            rows.append(row)
+        widths = [max(len(str(cell)) for cell in column) for column in zip(headers, *rows)]
+        lines = ["  ".join(cell.ljust(width) if column == 0 else cell.rjust(width)
+                           for column, (cell, width) in enumerate(zip(row, widths)))
+                 for row in [headers] + rows]
+        lines.insert(1, "-" * len(lines[0]))
+        return "\n".join(lines)
+
+    def save_summary(self, path: Optional[str] = None) -> Path:  # JSON summary (default: <output_dir>/summary.json)
+        path = Path(path) if path else self.output_dir / "summary.json"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps({"stages": [record.to_dict() for record in self.records]}, indent=2),
+                        encoding="utf-8")
+        return path
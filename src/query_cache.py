@@ -0,0 +1,83 @@
+# Query result cache - bounded LRU (with optional TTL) of ranked results, keyed by analyzed query terms and index version
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional, Tuple
+
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_TOP_N = 100
+
+
+class QueryResultCache:
+    # Caches the best top_n (rank, doc_id, score) results of each query. Keys are built by the
+    # query processor from the analyzed query terms, so "Information Retrieval" and
+    # "retrieval, information!" share an entry. Every entry belongs to an index version, and
+    # attaching a new index clears the cache. Safe to share between request threads.
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, ttl_seconds: Optional[float] = None,
+                 top_n: int = DEFAULT_TOP_N):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.top_n = top_n
+        self.index_version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self._entries: "OrderedDict[Tuple, Tuple[float, List]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def set_index_version(self, index_version: str) -> None:  # Drop every entry when a different index is loaded
+        with self._lock:
+            if index_version != self.index_version:
+                if self._entries:
+                    self.invalidations += 1
+                self._entries.clear()
+                self.index_version = index_version
+
+    def get(self, index_version: str, query_key: Hashable) -> Optional[List[Tuple[int, str, float]]]:  # Cached top_n results, or None on a miss
+        key = (index_version, query_key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl_seconds is not None and time.monotonic() - entry[0] > self.ttl_seconds:
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, index_version: str, query_key: Hashable, results: List[Tuple[int, str, float]]) -> None:
+        if index_version != self.index_version:
+            return  # Results from an index that has since been replaced
+        with self._lock:
+            self._entries[(index_version, query_key)] = (time.monotonic(), results[:self.top_n])
+            self._entries.move_to_end((index_version, query_key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "top_n": self.top_n,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+                "index_version": self.index_version,
+            }
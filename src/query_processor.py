@@ -1,132 +1,393 @@
 # Query processor - vectorizes queries and ranks documents using cosine similarity
 
 import csv
+import uuid
+from collections import Counter
 from pathlib import Path
-from typing import List, Tuple, Dict
+from typing import Iterable, List, Tuple, Dict, Optional, Sequence, Union
 import numpy as np
+from scipy import sparse
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+from sklearn.preprocessing import normalize
+try:
+    from src.metrics import StageTimings
+    from src.profiler import stage
+    from src.query_cache import QueryResultCache
+    from src.index_format import is_sharded_index
+    from src.vocabulary import DEFAULT_TOKEN_PATTERN, TermDictionary
+except ModuleNotFoundError:
+    from metrics import StageTimings
+    from profiler import stage
+    from query_cache import QueryResultCache
+    from index_format import is_sharded_index
+    from vocabulary import DEFAULT_TOKEN_PATTERN, TermDictionary
+
+
+def top_k_indices(scores: np.ndarray, k: Optional[int] = None) -> np.ndarray:
+    # Indices of the k highest scores ordered by descending score, ties broken by document order
+    # (the same order as a stable full sort). Uses partial selection, so cost is O(n + k log k).
+    num_scores = scores.shape[0]
+    if k is None or k >= num_scores:
+        return np.argsort(-scores, kind="stable")
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    
+    kth_score = np.partition(scores, num_scores - k)[num_scores - k]
+    above = np.flatnonzero(scores > kth_score)
+    ties = np.flatnonzero(scores == kth_score)[:k - above.size]  # Lowest document indices win ties
+    candidates = np.concatenate([above, ties])
+    return candidates[np.lexsort((candidates, -scores[candidates]))]
+
+
+def top_k_indices_rows(scores: np.ndarray, k: Optional[int] = None) -> np.ndarray:
+    # Row-wise top_k_indices for a (queries x documents) score matrix: returns a (queries x k)
+    # array of document indices with the same ordering and tie-breaking, without a Python loop
+    num_rows, num_scores = scores.shape
+    if k is None or k >= num_scores:
+        return np.argsort(-scores, axis=1, kind="stable")
+    if k <= 0:
+        return np.empty((num_rows, 0), dtype=np.intp)
+    
+    kth_scores = np.partition(scores, num_scores - k, axis=1)[:, num_scores - k:num_scores - k + 1]
+    above = scores > kth_scores
+    ties = scores == kth_scores
+    # Keep the lowest-index ties needed to fill each row to exactly k documents
+    ties &= np.cumsum(ties, axis=1) <= k - above.sum(axis=1, keepdims=True)
+    rows, candidates = np.nonzero(above | ties)
+    order = np.lexsort((candidates, -scores[rows, candidates], rows))
+    return candidates[order].reshape(num_rows, k)
+
+
+class QueryVectorizer:
+    # Query vectorizer - built once per index; turns query text into TF-IDF vectors using the
+    # index's analyzer, term ids and IDF weights, so each query only tokenizes and looks up terms.
+    # A stored TermDictionary answers term -> ID lookups itself; a plain list is turned into a dict.
+    def __init__(self, vocabulary: Sequence[str], vectorizer_params: Dict,
+                 idf: Optional[np.ndarray] = None):
+        if isinstance(vocabulary, TermDictionary):
+            self.term_ids = vocabulary
+        else:
+            self.term_ids = {term: term_id for term_id, term in enumerate(vocabulary)}
+        self.num_terms = len(vocabulary)
+        self.norm = vectorizer_params.get("norm", "l2")
+        # Legacy indexes without a stored IDF vector fall back to raw term frequencies
+        self.idf = np.asarray(idf, dtype=np.float64) if idf is not None else None
+        self.analyzer = TfidfVectorizer(
+            lowercase=vectorizer_params.get("lowercase", True),
+            stop_words=vectorizer_params.get("stop_words", "english"),
+            token_pattern=vectorizer_params.get("token_pattern", DEFAULT_TOKEN_PATTERN)
+        ).build_analyzer()
+    
+    def analyze(self, query_text: str) -> List[str]:  # Tokens of the query that exist in the index vocabulary
+        return [term for term in self.analyzer(query_text) if self.term_ids.get(term) is not None]
+    
+    def transform(self, query_texts: List[str]) -> sparse.csr_matrix:  # Vectorize queries into a (queries x terms) TF-IDF matrix
+        indptr = [0]
+        indices = []
+        counts = []
+        for query_text in query_texts:
+            term_counts = Counter(self.term_ids.get(term) for term in self.analyzer(query_text))
+            term_counts.pop(None, None)  # Terms outside the index vocabulary
+            indices.extend(term_counts.keys())
+            counts.extend(term_counts.values())
+            indptr.append(len(indices))
+        
+        indices = np.asarray(indices, dtype=np.int32)
+        data = np.asarray(counts, dtype=np.float64)
+        if self.idf is not None:
+            data *= self.idf[indices]
+        query_matrix = sparse.csr_matrix(
+            (data, indices, np.asarray(indptr, dtype=np.int32)),
+            shape=(len(query_texts), self.num_terms)
+        )
+        query_matrix.sort_indices()
+        if self.norm:
+            query_matrix = normalize(query_matrix, norm=self.norm, copy=False)
+        return query_matrix
 
 
 class QueryProcessor:
    # Query processor - ranks documents by cosine similarity to query vector 
-    def __init__(self, document_ids: List[str], vocabulary: List[str], 
-                 tfidf_matrix: np.ndarray, vectorizer_params: Dict):
-        # Initialize query processor with index data (doc IDs, vocab, TF-IDF matrix)
+    def __init__(self, document_ids: List[str], vocabulary: Sequence[str], 
+                 tfidf_matrix: sparse.spmatrix, vectorizer_params: Dict,
+                 idf: Optional[np.ndarray] = None, index_version: Optional[str] = None,
+                 result_cache: Optional[QueryResultCache] = None,
+                 term_matrix: Optional[sparse.csr_matrix] = None,
+                 doc_scales: Optional[np.ndarray] = None):
+        # Initialize query processor with index data (doc IDs, vocab, TF-IDF matrix, IDF weights)
         self.document_ids = document_ids
         self.vocabulary = vocabulary
-        self.tfidf_matrix = tfidf_matrix
+        self.tfidf_matrix = sparse.csr_matrix(tfidf_matrix)
         self.vectorizer_params = vectorizer_params
+        self.vectorizer = QueryVectorizer(vocabulary, vectorizer_params, idf)
+        
+        # Term-major copy of the matrix: row t holds the postings (documents, weights) of term t,
+        # so scoring a query only touches the rows of its terms. A stored copy (the index's
+        # memory-mapped postings) is shared between processes instead of built per process.
+        self._term_matrix = term_matrix if term_matrix is not None else self.tfidf_matrix.T.tocsr()
+        
+        # An 8-bit quantised matrix holds codes: a document's weights are its codes times its
+        # scale, so scores are computed on the codes and multiplied by the scale afterwards
+        self._doc_scales = np.asarray(doc_scales, dtype=np.float64) if doc_scales is not None else None
+        
+        # Rows are L2-normalised by default, making cosine similarity a plain dot product;
+        # other norms need an explicit division by the document lengths
+        self._inverse_doc_norms = None
+        if self.vectorizer_params.get("norm", "l2") != "l2":
+            weights = self.tfidf_matrix.astype(np.float64, copy=False)
+            doc_norms = np.sqrt(np.asarray(weights.multiply(weights).sum(axis=1)).ravel())
+            if self._doc_scales is not None:
+                doc_norms *= self._doc_scales
+            self._inverse_doc_norms = np.divide(
+                1.0, doc_norms, out=np.zeros_like(doc_norms), where=doc_norms > 0
+            )
+        
+        # Per-document factors applied to the raw products (None when there are none)
+        self._score_scales = self._inverse_doc_norms
+        if self._doc_scales is not None:
+            self._score_scales = self._doc_scales if self._inverse_doc_norms is None \
+                else self._doc_scales * self._inverse_doc_norms
+        
+        # Identifies this index in result cache keys. The cache is only keyed to this index by
+        # activate_result_cache, once the processor serves: building a processor for a reload
+        # that then fails must not invalidate the results of the index still being served.
+        self.index_version = index_version or uuid.uuid4().hex
+        self.result_cache = result_cache
         
         print(f"Query processor initialized")
         print(f"  Ready to search {len(self.document_ids)} documents")
     
-    def process_query(self, query_text: str) -> List[Tuple[int, str, float]]:  # Initialize query processor with index data (doc IDs, vocab, TF-IDF matrix)
-        # Vectorize query using same vocabulary as index
-        query_vectorizer = TfidfVectorizer(
-            lowercase=self.vectorizer_params.get("lowercase", True),
-            stop_words=self.vectorizer_params.get("stop_words", "english"),
-            vocabulary=self.vocabulary,
-            norm=self.vectorizer_params.get("norm", "l2")
-        )
+    @classmethod
+    def from_index(cls, index_path: str, result_cache: Optional[QueryResultCache] = None) -> "QueryProcessor":  # Load an index from disk and build a processor for it
+        try:
+            from src.indexer import DocumentIndexer
+            from src.inverted_index import InvertedIndex
+        except ModuleNotFoundError:
+            from indexer import DocumentIndexer
+            from inverted_index import InvertedIndex
+        # A sharded index is read back as one matrix and searched in this process; use
+        # ShardedQueryProcessor to search each shard in its own worker process
+        data_path = str(Path(index_path).resolve())  # Matrix and postings from the same build
+        data = DocumentIndexer.load_index_data(data_path, dequantize=False)
         
-        query_vector = query_vectorizer.fit_transform([query_text]).toarray()
+        # With L2-normalised rows the stored postings are exactly the term-major matrix. Postings
+        # of a compacted index are its stored weights or codes, whatever the norm; the dtype check
+        # skips postings stored in another precision.
+        term_matrix = None
+        compacted = "compaction" in data["meta"]
+        if (data["vectorizer_params"].get("norm", "l2") == "l2" or compacted) and InvertedIndex.exists(data_path):
+            postings = InvertedIndex.load(data_path)
+            if not compacted or postings.postings_weights.dtype == data["tfidf_matrix"].dtype:
+                term_matrix = postings.term_matrix()
         
-        # Compute cosine similarity with all documents
-        similarity_scores = cosine_similarity(query_vector, self.tfidf_matrix)[0]
+        print(f"Index loaded from {index_path}")
+        print(f"Documents: {len(data['document_ids'])}")
+        print(f"Vocabulary: {len(data['vocabulary'])} terms")
+        
+        return cls(data["document_ids"], data["vocabulary"], data["tfidf_matrix"],
+                   data["vectorizer_params"], idf=data["idf"],
+                   index_version=data["meta"].get("index_id"), result_cache=result_cache,
+                   term_matrix=term_matrix, doc_scales=data["scales"])
+    
+    def activate_result_cache(self) -> None:  # Key the result cache to this index, dropping entries of any other
+        if self.result_cache is not None:
+            self.result_cache.set_index_version(self.index_version)
+    
+    def process_query(self, query_text: str, top_k: Optional[int] = None,
+                      timings: Optional[StageTimings] = None) -> List[Tuple[int, str, float]]:  # Rank documents against the query text (all of them, or only the best top_k); timings records per-stage durations
+        query_key = self._cache_key(query_text, top_k)
+        if query_key is not None:
+            cached = self.result_cache.get(self.index_version, query_key)
+            if timings is not None:
+                timings.lap("cache_lookup")
+            if cached is None:
+                cached = self._rank(query_text, self.result_cache.top_n, timings)
+                self.result_cache.put(self.index_version, query_key, cached)
+            return cached[:top_k if top_k is None else max(top_k, 0)]
+        return self._rank(query_text, top_k, timings)
+    
+    def _cache_key(self, query_text: str, top_k: Optional[int]) -> Optional[Tuple[str, ...]]:
+        # Result cache key, or None when there is no cache or top_k is deeper than it stores.
+        # Queries with the same analyzed terms (in any order or case) rank identically.
+        cache = self.result_cache
+        if cache is None or (len(self.document_ids) if top_k is None else top_k) > cache.top_n:
+            return None
+        return tuple(sorted(self.vectorizer.analyze(query_text)))
+    
+    def _rank(self, query_text: str, top_k: Optional[int] = None,
+              timings: Optional[StageTimings] = None) -> List[Tuple[int, str, float]]:  # Uncached process_query
+        # Vectorize query using same vocabulary and IDF weights as index
+        query_vector = self.vectorizer.transform([query_text])
+        if timings is not None:
+            timings.lap("vectorize")
         
-        # Pair documents with their scores
-        doc_score_pairs = list(zip(self.document_ids, similarity_scores))
+        # Compute cosine similarity with all documents
+        similarity_scores = self._score(query_vector)
+        if timings is not None:
+            timings.lap("similarity")
         
-        # Sort by score (descending)
-        doc_score_pairs.sort(key=lambda x: x[1], reverse=True)
+        # Select the top_k documents (or rank all of them) without sorting Python objects
+        top_indices = top_k_indices(similarity_scores, top_k)
+        if timings is not None:
+            timings.lap("top_k")
         
         # Add rank (1-based indexing)
         ranked_results = [
-            (rank + 1, doc_id, score)
-            for rank, (doc_id, score) in enumerate(doc_score_pairs)
+            (rank + 1, self.document_ids[doc_index], similarity_scores[doc_index])
+            for rank, doc_index in enumerate(top_indices)
         ]
+        if timings is not None:
+            timings.lap("rank")
         
         return ranked_results
     
-    def process_queries_from_csv(self, queries_csv: str, 
-                                  output_csv: str = "data/output/results.csv") -> None:  # Process all queries from CSV file and save ranked results to output CSV
-        queries = self._load_queries(queries_csv)
+    def _score(self, query_vector: sparse.csr_matrix) -> np.ndarray:  # Cosine similarity of a (1 x terms) sparse query vector with every document
+        if self._inverse_doc_norms is not None:
+            query_vector = normalize(query_vector)
+        scores = self._term_product(query_vector).toarray().ravel()
+        if self._score_scales is not None:
+            scores *= self._score_scales
+        return scores
+    
+    def _term_product(self, query_matrix: sparse.csr_matrix) -> sparse.csr_matrix:  # (queries x documents) products of query vectors with the term-major matrix
+        if self._term_matrix.dtype == np.float64:
+            return query_matrix @ self._term_matrix
+        # Compacted weights: scipy would convert the whole matrix to float64 for the product,
+        # so only the postings of the terms in these queries are converted
+        terms = np.unique(query_matrix.indices)
+        return query_matrix[:, terms] @ self._term_matrix[terms].astype(np.float64)
+    
+    def process_queries(self, query_texts: List[str], top_k: Union[None, int, Sequence[Optional[int]]] = None,
+                        batch_size: Optional[int] = None) -> List[List[Tuple[int, str, float]]]:  # process_query for many queries at once (top_k may be given per query)
+        per_query_k = list(top_k) if isinstance(top_k, Sequence) else [top_k] * len(query_texts)
+        if self.result_cache is None:
+            return [results for _, results in self._iter_ranked(query_texts, per_query_k, batch_size)]
         
-        print(f"\nProcessing {len(queries)} queries...")
+        # Serve cached queries directly and score only the misses, together
+        keys = [self._cache_key(query_text, k) for query_text, k in zip(query_texts, per_query_k)]
+        results = [self.result_cache.get(self.index_version, key) if key is not None else None for key in keys]
+        misses = [position for position, cached in enumerate(results) if cached is None]
+        miss_k = [self.result_cache.top_n if keys[position] is not None else per_query_k[position]
+                  for position in misses]
+        for miss, ranked in self._iter_ranked([query_texts[position] for position in misses], miss_k, batch_size):
+            position = misses[miss]
+            if keys[position] is not None:
+                self.result_cache.put(self.index_version, keys[position], ranked)
+            results[position] = ranked
+        return [ranked[:k if k is None else max(k, 0)] for ranked, k in zip(results, per_query_k)]
+    
+    def _iter_ranked(self, query_texts: List[str], top_k: Union[None, int, Sequence[Optional[int]]] = None,
+                     batch_size: Optional[int] = None):
+        # Yield (query position, ranked results) in query order. All queries are vectorized into
+        # one sparse matrix and scored batch by batch (see rank_vectors).
+        if not query_texts:
+            return
+        query_matrix = self.vectorizer.transform(query_texts)
+        for position, doc_indices, doc_scores in self.rank_vectors(query_matrix, top_k, batch_size):
+            yield position, [
+                (rank + 1, self.document_ids[doc_index], score)
+                for rank, (doc_index, score) in enumerate(zip(doc_indices.tolist(), doc_scores.tolist()))
+            ]
+    
+    def rank_vectors(self, query_matrix: sparse.csr_matrix, top_k: Union[None, int, Sequence[Optional[int]]] = None,
+                     batch_size: Optional[int] = None):
+        # Yield (query position, document indices, scores) of the best top_k documents for every
+        # row of a query matrix from self.vectorizer, in query order. Each batch is scored with a
+        # single sparse product; batches keep the dense (queries x documents) score block around
+        # 64 MB by default.
+        if self._inverse_doc_norms is not None:
+            query_matrix = normalize(query_matrix)
+        batch_size = batch_size or max(1, (8 * 1024 * 1024) // max(1, len(self.document_ids)))
+        per_query_k = top_k if isinstance(top_k, Sequence) else [top_k] * query_matrix.shape[0]
+        if len(per_query_k) != query_matrix.shape[0]:
+            raise ValueError("top_k must have one entry per query")
         
-        all_results = []
+        for start in range(0, query_matrix.shape[0], batch_size):
+            batch_k = per_query_k[start:start + batch_size]
+            scores = self._term_product(query_matrix[start:start + batch_size]).toarray()
+            if self._score_scales is not None:
+                scores *= self._score_scales
+            # Select the largest k of the batch once; smaller top_k values are prefixes of it
+            top_indices = top_k_indices_rows(scores, None if None in batch_k else max(batch_k))
+            top_scores = np.take_along_axis(scores, top_indices, axis=1)
+            for row, (doc_indices, doc_scores) in enumerate(zip(top_indices, top_scores)):
+                k = batch_k[row]
+                if k is not None:
+                    doc_indices, doc_scores = doc_indices[:max(k, 0)], doc_scores[:max(k, 0)]
+                yield start + row, doc_indices, doc_scores
+    
+    def process_queries_from_csv(self, queries_csv: str, 
+                                  output_csv: str = "data/output/results.csv",
+                                  top_k: Optional[int] = None) -> None:  # Process all queries from CSV file and save ranked results to output CSV
+        queries = load_queries(queries_csv)
+        print(f"\nProcessing {len(queries)} queries...")
+        write_ranked_results(queries, self._iter_ranked([query["query_text"] for query in queries], top_k), output_csv)
+
+
+def load_queries(queries_csv: str) -> List[Dict[str, str]]:  # Read the query_id and query_text of every row of a queries CSV
+    queries = []
+    
+    with open(queries_csv, "r", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        for row in reader:
+            queries.append({
+                "query_id": row["query_id"],
+                "query_text": row["query_text"]
+            })
+    
+    return queries
+
+
+def write_ranked_results(queries: List[Dict[str, str]], ranked: Iterable[Tuple[int, List[Tuple[int, str, float]]]],
+                         output_csv: str) -> None:  # Write (query position, ranked results) pairs to the results CSV
+    output_path = Path(output_csv)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    total_rows = 0
+    
+    # Rows are streamed to the CSV as each batch is ranked rather than collected in memory
+    with output_path.open("w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["query_id", "rank", "document_id"])
         
-        for query in queries:
-            query_id = query["query_id"]
-            query_text = query["query_text"]
+        for position, ranked_docs in ranked:
+            query_id = queries[position]["query_id"]
             
             print(f"\n  Query: {query_id}")
-            print(f"  Text: \"{query_text}\"")
-            
-            # Get ranked documents
-            ranked_docs = self.process_query(query_text)
+            print(f"  Text: \"{queries[position]['query_text']}\"")
             
             # Display top 3 results
             for rank, doc_id, score in ranked_docs[:3]:
                 print(f"    {rank}. {doc_id} (score: {score:.4f})")
             
-            # Collect all results for this query
-            for rank, doc_id, score in ranked_docs:
-                all_results.append({
-                    "query_id": query_id,
-                    "rank": rank,
-                    "document_id": doc_id
-                })
-        
-        # Save results to CSV
-        self._save_results(all_results, output_csv)
-    
-    def _load_queries(self, queries_csv: str) -> List[Dict[str, str]]: # Process all queries from CSV file and save ranked results to output CSV
-        queries = []
-        
-        with open(queries_csv, "r", encoding="utf-8") as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                queries.append({
-                    "query_id": row["query_id"],
-                    "query_text": row["query_text"]
-                })
-        
-        return queries
-    
-    def _save_results(self, results: List[Dict], output_csv: str) -> None:
-        # Save query results to CSV with query_id, rank, and document_id columns
-        output_path = Path(output_csv)
-        output_path.parent.mkdir(parents=True, exist_ok=True)
-        
-        with output_path.open("w", newline="", encoding="utf-8") as f:
-            writer = csv.DictWriter(
-                f, 
-                fieldnames=["query_id", "rank", "document_id"]
-            )
-            writer.writeheader()
-            writer.writerows(results)
-        
-        print(f"\nResults saved: {output_path}")
-        print(f"Total rows: {len(results)}")
-
+            writer.writerows((query_id, rank, doc_id) for rank, doc_id, _ in ranked_docs)
+            total_rows += len(ranked_docs)
+    
+    print(f"\nResults saved: {output_path}")
+    print(f"Total rows: {total_rows}")
 
 def run_queries(index_path: str, queries_csv: str, 
                 output_csv: str = "data/output/results.csv") -> None:
     # Load index and process queries - convenience wrapper function
-    from src.indexer import DocumentIndexer    
-    doc_ids, vocab, tfidf_matrix, params = DocumentIndexer.load_index(index_path) # Load index
-    
-    # Initialize processor and run queries
-    processor = QueryProcessor(doc_ids, vocab, tfidf_matrix, params)
-    processor.process_queries_from_csv(queries_csv, output_csv)
+    if is_sharded_index(index_path):  # One worker process per shard
+        try:
+            from src.sharded_query import ShardedQueryProcessor
+        except ModuleNotFoundError:
+            from sharded_query import ShardedQueryProcessor
+        with stage("load"):
+            processor = ShardedQueryProcessor.from_index(index_path)
+        with processor, stage("rank"):
+            processor.process_queries_from_csv(queries_csv, output_csv)
+        return
+    with stage("load"):
+        processor = QueryProcessor.from_index(index_path)
+    with stage("rank"):
+        processor.process_queries_from_csv(queries_csv, output_csv)
 
 
 if __name__ == "__main__":
     print("Processing queries...")
     run_queries(
-        index_path="data/output/index.json",
+        index_path="data/output/index",
         queries_csv="queries.csv",
         output_csv="data/output/results.csv"
     )
\ No newline at end of file
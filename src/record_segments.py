@@ -0,0 +1,110 @@
+# Record segments - pages extracted at crawl time, stored as gzip-compressed JSONL chunks
+import gzip
+import json
+import re
+import zlib
+from pathlib import Path
+from typing import Dict, Iterator, List, Set
+
+SEGMENT_GLOB = "segment-*.jsonl.gz"
+URLS_SUFFIX = ".urls.txt"  # Sidecar next to each segment: the URLs of its records, one per line
+DEFAULT_SEGMENT_RECORDS = 10000
+DEFAULT_SEGMENT_BYTES = 64 * 1024 * 1024  # Uncompressed JSONL per segment
+
+
+class SegmentWriter:
+    # Appends records (one JSON object per line) to segment-NNNNN.jsonl.gz files in output_dir,
+    # starting a new segment after max_records records or max_bytes of JSON. Each run starts a
+    # new segment after the existing ones, so earlier segments are never rewritten. The gzip
+    # stream is sync-flushed after every record: if the process is killed, every record written
+    # so far can still be read back (see iter_records). The URLs of each record (record_url_list)
+    # also go to a plain-text sidecar, segment-NNNNN.urls.txt, so record_urls never decompresses
+    # a segment.
+    def __init__(self, output_dir: str, max_records: int = DEFAULT_SEGMENT_RECORDS,
+                 max_bytes: int = DEFAULT_SEGMENT_BYTES):
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.max_records = max_records
+        self.max_bytes = max_bytes
+        numbers = [int(match.group(1)) for match in
+                   (re.fullmatch(r"segment-(\d+)\.jsonl\.gz", path.name) for path in self.output_dir.glob(SEGMENT_GLOB))
+                   if match]
+        self.next_number = max(numbers, default=-1) + 1
+        self.records_written = 0
+        self.segments_written = 0
+        self._file = None
+        self._urls_file = None
+        self._records = 0
+        self._bytes = 0
+
+    def write(self, record: Dict) -> None:
+        line = json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n"
+        if self._file is None or self._records >= self.max_records or self._bytes + len(line) > self.max_bytes:
+            self._roll()
+        self._file.write(line)
+        self._file.flush()
+        self._urls_file.write("".join(f"{url}\n" for url in record_url_list(record)))
+        self._urls_file.flush()
+        self._records += 1
+        self._bytes += len(line)
+        self.records_written += 1
+
+    def _roll(self) -> None:  # Close the current segment and open the next one
+        self.close()
+        self._file = gzip.open(self.output_dir / f"segment-{self.next_number:05d}.jsonl.gz", "wb")
+        self._urls_file = open(self.output_dir / f"segment-{self.next_number:05d}{URLS_SUFFIX}", "w", encoding="utf-8")
+        self.next_number += 1
+        self.segments_written += 1
+        self._records = self._bytes = 0
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._urls_file.close()
+            self._file = self._urls_file = None
+
+
+def is_record_dir(path: str) -> bool:  # Whether path holds record segments rather than HTML files
+    path = Path(path)
+    return path.is_dir() and next(path.glob(SEGMENT_GLOB), None) is not None
+
+
+def iter_records(records_dir: str) -> Iterator[Dict]:
+    # Stream every record of every segment in order, one segment open at a time. A segment cut
+    # short by a killed crawl yields the records before the cut, then is skipped with a warning.
+    for path in sorted(Path(records_dir).glob(SEGMENT_GLOB)):
+        yield from _iter_segment(path)
+
+
+def _iter_segment(path: Path) -> Iterator[Dict]:
+    with gzip.open(path, "rb") as f:
+        try:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:  # Partial last line
+                    print(f"[WARN] {path.name} ends in a partial record")
+                    break
+                yield record
+        except (EOFError, zlib.error, gzip.BadGzipFile):
+            print(f"[WARN] {path.name} is truncated - using the records before the cut")
+
+
+def record_url_list(record: Dict) -> List[str]:  # The page's URL, then the URLs that redirected to it
+    return [record["url"]] + record.get("redirect_urls", [])
+
+
+def record_urls(records_dir: str) -> Set[str]:
+    # URLs already stored in records_dir, read from the segments' URL sidecars. Only segments
+    # written without a sidecar are decompressed.
+    urls = set()
+    if not Path(records_dir).is_dir():
+        return urls
+    for path in sorted(Path(records_dir).glob(SEGMENT_GLOB)):
+        sidecar = path.with_name(path.name[:-len(".jsonl.gz")] + URLS_SUFFIX)
+        if sidecar.is_file():
+            urls.update(sidecar.read_text(encoding="utf-8").splitlines())
+        else:
+            for record in _iter_segment(path):
+                urls.update(record_url_list(record))
+    return urls
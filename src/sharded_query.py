@@ -0,0 +1,128 @@
+# Sharded query execution - a coordinator that fans queries out to one worker process per shard and merges the shard rankings
+
+import heapq
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+try:
+    from src.index_format import read_index, read_shards_manifest
+    from src.query_processor import QueryProcessor, QueryVectorizer, load_queries, write_ranked_results
+except ModuleNotFoundError:
+    from index_format import read_index, read_shards_manifest
+    from query_processor import QueryProcessor, QueryVectorizer, load_queries, write_ranked_results
+
+_shard_processor: Optional[QueryProcessor] = None  # The shard a worker process searches
+
+
+def _load_shard(shard_path: str) -> None:  # Worker initializer: load this worker's shard once
+    global _shard_processor
+    _shard_processor = QueryProcessor.from_index(shard_path)
+
+
+def _shard_size() -> int:  # Documents in the worker's shard (also forces the worker to start and load it)
+    return len(_shard_processor.document_ids)
+
+
+def _search_shard(query_matrix, top_k) -> List[Tuple[np.ndarray, np.ndarray]]:  # (document indices, scores) of the shard's best top_k per query
+    return [(doc_indices, doc_scores) for _, doc_indices, doc_scores in _shard_processor.rank_vectors(query_matrix, top_k)]
+
+
+class ShardedQueryProcessor:
+    # Coordinator for an index saved with DocumentIndexer.save_index(num_shards=N). Each shard
+    # is searched by its own worker process, which loads only that shard, so shards are scored
+    # on separate cores and no process holds the whole matrix. Queries are vectorized once with
+    # the global vocabulary and IDF and sent to every shard; each shard returns its best top_k
+    # (document, score) lists, which are merged by descending score and global document order.
+    # Shards hold contiguous document ranges scored with global IDF, so the merged rankings and
+    # scores are identical to those of the unsharded index. With processes=False the shards are
+    # searched one after another in this process (same results, no worker processes).
+    def __init__(self, index_path: str, processes: bool = True):
+        manifest = read_shards_manifest(index_path)
+        self.index_path = index_path
+        self.shards = manifest["shards"]
+        self.index_version = manifest["index_id"]
+        self.vectorizer_params = manifest["vectorizer_params"]
+
+        shard_data = [read_index(shard["path"]) for shard in self.shards]  # Memory-mapped: only IDs and terms are read
+        self.document_ids = [doc_id for data in shard_data for doc_id in data["document_ids"]]
+        self.vocabulary = shard_data[0]["vocabulary"]
+        self.vectorizer = QueryVectorizer(self.vocabulary, self.vectorizer_params, shard_data[0]["idf"])
+
+        self._pools = []
+        self._local = []
+        if processes:
+            self._pools = [ProcessPoolExecutor(max_workers=1, initializer=_load_shard, initargs=(shard["path"],))
+                           for shard in self.shards]
+            sizes = [future.result() for future in [pool.submit(_shard_size) for pool in self._pools]]
+        else:
+            self._local = [QueryProcessor.from_index(shard["path"]) for shard in self.shards]
+            sizes = [len(processor.document_ids) for processor in self._local]
+        if sizes != [shard["num_documents"] for shard in self.shards]:
+            self.close()
+            raise ValueError(f"Shards of {index_path} do not match {index_path}/shards.json")
+
+        print(f"Sharded query processor initialized")
+        print(f"  Ready to search {len(self.document_ids)} documents in {len(self.shards)} shards"
+              f"{' (one worker process each)' if processes else ''}")
+
+    @classmethod
+    def from_index(cls, index_path: str, processes: bool = True) -> "ShardedQueryProcessor":
+        return cls(index_path, processes=processes)
+
+    def process_query(self, query_text: str, top_k: Optional[int] = None) -> List[Tuple[int, str, float]]:  # Rank documents against the query text across all shards
+        return self.process_queries([query_text], [top_k])[0]
+
+    def process_queries(self, query_texts: List[str], top_k: Union[None, int, Sequence[Optional[int]]] = None,
+                        batch_size: Optional[int] = None) -> List[List[Tuple[int, str, float]]]:  # process_query for many queries at once (top_k may be given per query)
+        return [results for _, results in self._iter_ranked(query_texts, top_k, batch_size)]
+
+    def _iter_ranked(self, query_texts: List[str], top_k: Union[None, int, Sequence[Optional[int]]] = None,
+                     batch_size: Optional[int] = None):
+        # Yield (query position, ranked results) in query order: scatter the query matrix to
+        # every shard, then gather and merge. batch_size is accepted for interface compatibility;
+        # each shard batches its own scoring.
+        if not query_texts:
+            return
+        per_query_k = list(top_k) if isinstance(top_k, Sequence) else [top_k] * len(query_texts)
+        if len(per_query_k) != len(query_texts):
+            raise ValueError("top_k must have one entry per query")
+        query_matrix = self.vectorizer.transform(query_texts)
+
+        if self._pools:
+            futures = [pool.submit(_search_shard, query_matrix, per_query_k) for pool in self._pools]
+            shard_results = [future.result() for future in futures]
+        else:
+            shard_results = [[(doc_indices, doc_scores) for _, doc_indices, doc_scores
+                              in processor.rank_vectors(query_matrix, per_query_k)] for processor in self._local]
+
+        for position, k in enumerate(per_query_k):
+            # Each shard list is sorted by (-score, position), so a k-way merge gives the global order
+            shard_lists = [
+                zip((-doc_scores).tolist(), (doc_indices + shard["first_document"]).tolist())
+                for shard, (doc_indices, doc_scores) in zip(self.shards, (results[position] for results in shard_results))
+            ]
+            merged = islice(heapq.merge(*shard_lists), None if k is None else max(k, 0))
+            yield position, [
+                (rank + 1, self.document_ids[doc_index], -negative_score)
+                for rank, (negative_score, doc_index) in enumerate(merged)
+            ]
+
+    def process_queries_from_csv(self, queries_csv: str, output_csv: str = "data/output/results.csv",
+                                 top_k: Optional[int] = None) -> None:  # Same CSV output as an unsharded index
+        queries = load_queries(queries_csv)
+        print(f"\nProcessing {len(queries)} queries...")
+        write_ranked_results(queries, self._iter_ranked([query["query_text"] for query in queries], top_k), output_csv)
+
+    def close(self) -> None:  # Stop the worker processes
+        for pool in self._pools:
+            pool.shutdown()
+        self._pools = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
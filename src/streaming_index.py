@@ -0,0 +1,378 @@
+# Streaming index builder - SPIMI-style construction of the binary index under a fixed memory budget
+
+import heapq
+import shutil
+from array import array
+from collections import Counter
+from itertools import compress
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    from src.index_format import (DATA_FILE, INDICES_FILE, INDPTR_FILE, COUNTS_FILE, IDF_FILE,
+                                  DOCUMENT_IDS_FILE, NpyWriter, new_index_dir,
+                                  write_meta, write_duplicates, commit_index_dir)
+    from src.vocabulary import TermDictionary, vocabulary_mask
+except ModuleNotFoundError:
+    from index_format import (DATA_FILE, INDICES_FILE, INDPTR_FILE, COUNTS_FILE, IDF_FILE,
+                              DOCUMENT_IDS_FILE, NpyWriter, new_index_dir,
+                              write_meta, write_duplicates, commit_index_dir)
+    from vocabulary import TermDictionary, vocabulary_mask
+
+# Rough in-memory cost of the structures the budget covers
+_BYTES_PER_POSTING = 8        # doc number + count in two array('i')
+_BYTES_PER_BLOCK_TERM = 250   # term string, dict slot and two array objects
+_BYTES_PER_SORTED_POSTING = 48  # doc, term, count, weight and sort scratch during the final pass
+_RANGE_POSTING = np.dtype([("doc", np.int32), ("term", np.int64), ("count", np.int32)])  # Spilled by document range
+
+
+class SpimiIndexWriter:
+    # Single-pass in-memory indexing (SPIMI): documents are counted into a term -> postings block
+    # that is flushed to a sorted on-disk segment whenever it reaches its share of the memory
+    # budget. finish() k-way merges the segments into term-major postings, computes IDF and
+    # document norms from them, and writes the document-major CSR arrays of the binary index one
+    # document range at a time, after a single pass that spills the postings by range. Terms
+    # outside the document-frequency limits in vectorizer_params (min_df, max_df,
+    # max_features) are dropped from the merged postings first. Apart from
+    # per-term and per-document scalars (document frequency, norms, row lengths, the encoded
+    # term dictionary), memory stays within memory_budget_bytes regardless of corpus size.
+    # The resulting index equals DocumentIndexer.build_index on the same documents.
+    def __init__(self, output_path: str, analyzer: Callable[[str], List[str]], vectorizer_params: Dict,
+                 memory_budget_bytes: int = 256 * 1024 * 1024):
+        self.output_path = Path(output_path)
+        self.analyzer = analyzer
+        self.vectorizer_params = vectorizer_params
+        self.memory_budget_bytes = memory_budget_bytes
+        self.output_path.parent.mkdir(parents=True, exist_ok=True)
+        self.work_dir = new_index_dir(self.output_path)
+        self.segment_dirs: List[Path] = []
+        self.num_documents = 0
+        self._doc_ids_file = (self.work_dir / DOCUMENT_IDS_FILE).open("w", encoding="utf-8")
+        self._block: Dict[str, Tuple[array, array]] = {}
+        self._block_postings = 0
+
+    def add_document(self, doc_id: str, text: str) -> None:  # Count one document's terms into the current block
+        if "\n" in doc_id or "\r" in doc_id:
+            raise ValueError(f"Line break in index entry {doc_id!r}")
+        doc_number = self.num_documents
+        self._doc_ids_file.write(("\n" if doc_number else "") + doc_id)
+        self.num_documents += 1
+
+        term_counts = Counter(self.analyzer(text))
+        for term, count in term_counts.items():
+            postings = self._block.get(term)
+            if postings is None:
+                postings = self._block[term] = (array("i"), array("i"))
+            postings[0].append(doc_number)
+            postings[1].append(count)
+        self._block_postings += len(term_counts)  # One posting per distinct term of the document
+        if self._block_postings * _BYTES_PER_POSTING + len(self._block) * _BYTES_PER_BLOCK_TERM > self.memory_budget_bytes // 2:
+            self._flush_block()
+
+    def finish(self, duplicates: Optional[Dict] = None) -> Dict:  # Merge segments and write the final index; returns index statistics
+        self._doc_ids_file.close()
+        try:
+            if self.num_documents == 0:
+                raise ValueError("No valid documents found after text extraction")
+            self._flush_block()
+            term_ptr, term_totals = self._merge_segments()
+            candidate_terms, candidate_postings = len(term_ptr) - 1, int(term_ptr[-1])
+            kept = vocabulary_mask(np.diff(term_ptr), term_totals, self.num_documents, self.vectorizer_params)
+            if not kept.all():
+                term_ptr = self._drop_terms(term_ptr, kept)
+            with (self.work_dir / "postings.terms.txt").open("r", encoding="utf-8", newline="\n") as terms_file:
+                TermDictionary.from_terms(compress((line.rstrip("\n") for line in terms_file), kept)).save(self.work_dir)
+            num_terms = len(term_ptr) - 1
+            nnz = int(term_ptr[-1])
+
+            # Smoothed IDF exactly as TfidfTransformer computes it
+            document_frequency = np.diff(term_ptr).astype(np.float64)
+            idf = np.log(float(self.num_documents + 1) / (document_frequency + 1)) + 1
+            np.save(self.work_dir / IDF_FILE, idf)
+
+            row_lengths, inverse_norms = self._document_norms(term_ptr, idf)
+            self._write_document_major(term_ptr, idf, row_lengths, inverse_norms)
+            for path in self.work_dir.glob("postings.*"):
+                path.unlink()
+            if duplicates is not None:
+                write_duplicates(self.work_dir, duplicates)
+            write_meta(self.work_dir, (self.num_documents, num_terms), nnz, np.float64, self.vectorizer_params)
+            commit_index_dir(self.work_dir, self.output_path)
+        except BaseException:
+            self.abort()
+            raise
+
+        density = nnz / max(1, self.num_documents * num_terms)
+        return {
+            "num_documents": self.num_documents,
+            "num_terms": num_terms,
+            "matrix_shape": f"{self.num_documents} x {num_terms}",
+            "sparsity": (1 - density) * 100,
+            "candidate_terms": candidate_terms,
+            "pruned_terms": candidate_terms - num_terms,
+            "pruned_postings": candidate_postings - nnz,
+            "segments": len(self.segment_dirs),
+        }
+
+    def abort(self) -> None:  # Discard the partial build, leaving any existing index untouched
+        self._doc_ids_file.close()
+        self._block = {}
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def _flush_block(self) -> None:  # Write the current block as a segment sorted by term
+        if not self._block:
+            return
+        segment_dir = self.work_dir / f"segment-{len(self.segment_dirs):05d}"
+        segment_dir.mkdir()
+        terms = sorted(self._block)
+        with (segment_dir / "terms.txt").open("w", encoding="utf-8") as f:
+            f.write("\n".join(terms))
+        lengths = np.fromiter((len(self._block[term][0]) for term in terms), dtype=np.int32, count=len(terms))
+        lengths.tofile(segment_dir / "lengths.bin")
+        with (segment_dir / "docs.bin").open("wb") as docs_file, (segment_dir / "counts.bin").open("wb") as counts_file:
+            for term in terms:
+                docs, counts = self._block.pop(term)
+                docs.tofile(docs_file)
+                counts.tofile(counts_file)
+        self.segment_dirs.append(segment_dir)
+        self._block = {}
+        self._block_postings = 0
+
+    def _merge_segments(self) -> Tuple[np.ndarray, np.ndarray]:
+        # k-way merge of the sorted segments into term-major postings files and a term list;
+        # returns the term pointers into the postings and each term's total count. Segments hold
+        # increasing document numbers, so concatenating a term's postings in segment order keeps
+        # them sorted by document.
+        buffer_items = max(1024, self.memory_budget_bytes // (8 * 4 * max(1, len(self.segment_dirs))))
+        readers = [_SegmentReader(segment_dir, buffer_items) for segment_dir in self.segment_dirs]
+        heap = []
+        for segment_number, reader in enumerate(readers):
+            term = reader.next_term()
+            if term is not None:
+                heap.append((term, segment_number))
+        heapq.heapify(heap)
+
+        term_lengths = array("q")
+        term_totals = array("q")
+        docs_out = _BufferedWriter(self.work_dir / "postings.docs.bin", np.int32, buffer_items)
+        counts_out = _BufferedWriter(self.work_dir / "postings.counts.bin", np.int32, buffer_items)
+        with (self.work_dir / "postings.terms.txt").open("w", encoding="utf-8", newline="\n") as terms_file:
+            while heap:
+                term, segment_number = heapq.heappop(heap)
+                segment_numbers = [segment_number]
+                while heap and heap[0][0] == term:
+                    segment_numbers.append(heapq.heappop(heap)[1])
+                length = total = 0
+                for segment_number in sorted(segment_numbers):
+                    docs, counts = readers[segment_number].postings()
+                    docs_out.write(docs)
+                    counts_out.write(counts)
+                    length += len(docs)
+                    total += int(counts.sum())
+                    next_term = readers[segment_number].next_term()
+                    if next_term is not None:
+                        heapq.heappush(heap, (next_term, segment_number))
+                terms_file.write(("\n" if term_lengths else "") + term)
+                term_lengths.append(length)
+                term_totals.append(total)
+        docs_out.close()
+        counts_out.close()
+        for reader in readers:
+            reader.close()
+        for segment_dir in self.segment_dirs:
+            shutil.rmtree(segment_dir)
+
+        term_ptr = np.zeros(len(term_lengths) + 1, dtype=np.int64)
+        np.cumsum(np.frombuffer(term_lengths, dtype=np.int64), out=term_ptr[1:])
+        return term_ptr, np.frombuffer(term_totals, dtype=np.int64)
+
+    def _drop_terms(self, term_ptr: np.ndarray, kept: np.ndarray) -> np.ndarray:
+        # Rewrite the term-major postings without the pruned terms; returns the new term pointers
+        buffer_items = max(1024, self.memory_budget_bytes // (2 * _BYTES_PER_SORTED_POSTING))
+        docs_out = _BufferedWriter(self.work_dir / "postings.kept-docs.bin", np.int32, buffer_items)
+        counts_out = _BufferedWriter(self.work_dir / "postings.kept-counts.bin", np.int32, buffer_items)
+        for docs, terms, counts in self._postings_chunks(term_ptr):
+            in_vocabulary = kept[terms]
+            docs_out.write(docs[in_vocabulary])
+            counts_out.write(counts[in_vocabulary])
+        docs_out.close()
+        counts_out.close()
+        (self.work_dir / "postings.kept-docs.bin").replace(self.work_dir / "postings.docs.bin")
+        (self.work_dir / "postings.kept-counts.bin").replace(self.work_dir / "postings.counts.bin")
+
+        kept_ptr = np.zeros(np.count_nonzero(kept) + 1, dtype=np.int64)
+        np.cumsum(np.diff(term_ptr)[kept], out=kept_ptr[1:])
+        return kept_ptr
+
+    def _postings_chunks(self, term_ptr: np.ndarray) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        # Stream the term-major postings as (docs, terms, counts) chunks in term order
+        chunk_items = max(1024, self.memory_budget_bytes // (2 * _BYTES_PER_SORTED_POSTING))
+        total = int(term_ptr[-1])
+        with (self.work_dir / "postings.docs.bin").open("rb") as docs_file, \
+                (self.work_dir / "postings.counts.bin").open("rb") as counts_file:
+            for start in range(0, total, chunk_items):
+                count = min(chunk_items, total - start)
+                docs = np.fromfile(docs_file, dtype=np.int32, count=count)
+                counts = np.fromfile(counts_file, dtype=np.int32, count=count)
+                terms = np.searchsorted(term_ptr, np.arange(start, start + count), side="right") - 1
+                yield docs, terms, counts
+
+    def _document_norms(self, term_ptr: np.ndarray, idf: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        # Row lengths and 1/norm of every document's TF-IDF vector
+        row_lengths = np.zeros(self.num_documents, dtype=np.int64)
+        norms = np.zeros(self.num_documents, dtype=np.float64)
+        norm = self.vectorizer_params.get("norm", "l2")
+        for docs, terms, counts in self._postings_chunks(term_ptr):
+            row_lengths += np.bincount(docs, minlength=self.num_documents)
+            weights = counts * idf[terms]
+            if norm == "l2":
+                norms += np.bincount(docs, weights=weights * weights, minlength=self.num_documents)
+            elif norm == "l1":
+                norms += np.bincount(docs, weights=weights, minlength=self.num_documents)
+        if norm == "l2":
+            norms = np.sqrt(norms)
+        if norm not in ("l1", "l2"):
+            return row_lengths, np.ones(self.num_documents)
+        inverse_norms = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+        return row_lengths, inverse_norms
+
+    def _write_document_major(self, term_ptr: np.ndarray, idf: np.ndarray,
+                              row_lengths: np.ndarray, inverse_norms: np.ndarray) -> None:
+        # Transpose the term-major postings into CSR rows. The documents are cut into ranges
+        # whose postings fit in memory; one pass over the postings spills every posting to its
+        # range's file, then each range is sorted by document and written in turn
+        nnz = int(term_ptr[-1])
+        indptr = np.zeros(self.num_documents + 1, dtype=np.int64)
+        np.cumsum(row_lengths, out=indptr[1:])
+        idx_dtype = np.int32 if max(nnz, len(term_ptr) - 1) < np.iinfo(np.int32).max else np.int64
+        np.save(self.work_dir / INDPTR_FILE, indptr.astype(idx_dtype))
+
+        pass_items = max(1024, self.memory_budget_bytes // (2 * _BYTES_PER_SORTED_POSTING))
+        bounds = [0]
+        while bounds[-1] < self.num_documents:
+            # Widest document range whose postings fit in one pass (at least one document)
+            end_doc = int(np.searchsorted(indptr, indptr[bounds[-1]] + pass_items, side="right")) - 1
+            bounds.append(min(max(end_doc, bounds[-1] + 1), self.num_documents))
+        range_files = self._partition_postings(term_ptr, np.array(bounds))
+
+        with NpyWriter(self.work_dir / DATA_FILE, np.float64, nnz) as data_out, \
+                NpyWriter(self.work_dir / INDICES_FILE, idx_dtype, nnz) as indices_out, \
+                NpyWriter(self.work_dir / COUNTS_FILE, np.int32, nnz) as counts_out:
+            for range_file in range_files:
+                if not range_file.exists():  # Only empty documents in this range
+                    continue
+                postings = np.fromfile(range_file, dtype=_RANGE_POSTING)
+                range_file.unlink()
+                # Each document's postings were spilled in term order, so a stable sort keeps it
+                postings = postings[np.argsort(postings["doc"], kind="stable")]
+                docs, terms, counts = postings["doc"], postings["term"], postings["count"]
+                data_out.write(counts * idf[terms] * inverse_norms[docs])
+                indices_out.write(terms)
+                counts_out.write(counts)
+
+    def _partition_postings(self, term_ptr: np.ndarray, bounds: np.ndarray) -> List[Path]:
+        # Append every posting to the file of the document range (bounds[i], bounds[i + 1]) it
+        # belongs to, in a single pass; returns the range files in document order. Pending
+        # postings are buffered up to the pass budget and then appended to their files.
+        range_files = [self.work_dir / f"postings.range-{number:05d}.bin" for number in range(len(bounds) - 1)]
+        pending = [[] for _ in range_files]
+        pending_items = 0
+        flush_items = max(1024, self.memory_budget_bytes // (2 * _BYTES_PER_SORTED_POSTING))
+        for docs, terms, counts in self._postings_chunks(term_ptr):
+            order = np.argsort(docs, kind="stable")  # Keeps term order within each document
+            postings = np.empty(len(docs), dtype=_RANGE_POSTING)
+            postings["doc"], postings["term"], postings["count"] = docs[order], terms[order], counts[order]
+            cuts = np.searchsorted(postings["doc"], bounds)
+            for number in np.flatnonzero(cuts[1:] > cuts[:-1]):
+                pending[number].append(postings[cuts[number]:cuts[number + 1]])
+            pending_items += len(postings)
+            if pending_items >= flush_items:
+                _append_pending(range_files, pending)
+                pending_items = 0
+        _append_pending(range_files, pending)
+        return range_files
+
+
+def _append_pending(range_files: List[Path], pending: List[List[np.ndarray]]) -> None:  # Append and clear the buffered postings of every range
+    for range_file, parts in zip(range_files, pending):
+        if parts:
+            with range_file.open("ab") as f:
+                for part in parts:
+                    part.tofile(f)
+            parts.clear()
+
+
+class _SegmentReader:
+    # Sequential reader over one segment's terms and postings
+    def __init__(self, segment_dir: Path, buffer_items: int):
+        self._terms = (segment_dir / "terms.txt").open("r", encoding="utf-8", newline="\n")
+        self._lengths = _BufferedReader(segment_dir / "lengths.bin", np.int32, buffer_items)
+        self._docs = _BufferedReader(segment_dir / "docs.bin", np.int32, buffer_items)
+        self._counts = _BufferedReader(segment_dir / "counts.bin", np.int32, buffer_items)
+        self._length = 0
+
+    def next_term(self) -> Optional[str]:
+        line = self._terms.readline()
+        if not line:
+            return None
+        self._length = int(self._lengths.read(1)[0])
+        return line.rstrip("\n")
+
+    def postings(self) -> Tuple[np.ndarray, np.ndarray]:  # Postings of the term last returned by next_term
+        return self._docs.read(self._length), self._counts.read(self._length)
+
+    def close(self) -> None:
+        for reader in (self._terms, self._lengths, self._docs, self._counts):
+            reader.close()
+
+
+class _BufferedReader:
+    # Reads a raw binary array sequentially through a fixed-size buffer
+    def __init__(self, path: Path, dtype, buffer_items: int):
+        self._file = path.open("rb")
+        self._dtype = dtype
+        self._buffer_items = buffer_items
+        self._buffer = np.empty(0, dtype=dtype)
+        self._position = 0
+
+    def read(self, count: int) -> np.ndarray:
+        if self._position + count <= len(self._buffer):
+            chunk = self._buffer[self._position:self._position + count]
+            self._position += count
+            return chunk
+        head = self._buffer[self._position:]
+        self._buffer = np.fromfile(self._file, dtype=self._dtype,
+                                   count=max(self._buffer_items, count - len(head)))
+        self._position = count - len(head)
+        return np.concatenate([head, self._buffer[:self._position]])
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class _BufferedWriter:
+    # Appends arrays to a raw binary file, flushing once buffer_items are pending
+    def __init__(self, path: Path, dtype, buffer_items: int):
+        self._file = path.open("wb")
+        self._dtype = dtype
+        self._buffer_items = buffer_items
+        self._pending = []
+        self._pending_items = 0
+
+    def write(self, chunk: np.ndarray) -> None:
+        self._pending.append(chunk)
+        self._pending_items += len(chunk)
+        if self._pending_items >= self._buffer_items:
+            self.flush()
+
+    def flush(self) -> None:
+        if self._pending:
+            np.concatenate(self._pending).astype(self._dtype, copy=False).tofile(self._file)
+        self._pending = []
+        self._pending_items = 0
+
+    def close(self) -> None:
+        self.flush()
+        self._file.close()
@@ -0,0 +1,67 @@
+# Extracted-text cache - stores cleaned document text on disk, keyed by file content hash and extractor version
+
+import os
+import uuid
+from pathlib import Path
+from typing import Dict, Optional
+
+DEFAULT_TEXT_CACHE_DIR = "data/cache/text"
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+class TextCache:
+    # Size-bounded cache of extracted text. Entries are plain UTF-8 files named after the content
+    # hash and extractor version, so a changed file or extractor simply misses. When the cache
+    # grows past max_bytes the least recently used entries (oldest mtime) are evicted.
+    def __init__(self, cache_dir: str = DEFAULT_TEXT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._size = sum(entry.stat().st_size for entry in self._entries())
+
+    def get(self, content_hash: str, extractor_key: str) -> Optional[str]:  # Cached text, or None on a miss
+        entry = self._entry_path(content_hash, extractor_key)
+        try:
+            text = entry.read_text(encoding="utf-8")
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        os.utime(entry)  # Mark as recently used for eviction
+        self.hits += 1
+        return text
+
+    def put(self, content_hash: str, extractor_key: str, text: str) -> None:
+        entry = self._entry_path(content_hash, extractor_key)
+        entry.parent.mkdir(exist_ok=True)
+        previous_size = entry.stat().st_size if entry.exists() else 0
+        tmp_entry = entry.with_name(f".{entry.name}.{uuid.uuid4().hex[:8]}")
+        tmp_entry.write_text(text, encoding="utf-8")
+        os.replace(tmp_entry, entry)  # Concurrent builds never read a partial entry
+        self._size += entry.stat().st_size - previous_size
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def evict(self) -> None:  # Remove least recently used entries until the cache fits in max_bytes
+        entries = sorted(
+            ((entry.stat(), entry) for entry in self._entries()),
+            key=lambda item: item[0].st_mtime_ns
+        )
+        self._size = sum(stat.st_size for stat, _ in entries)
+        for stat, entry in entries:
+            if self._size <= self.max_bytes:
+                break
+            entry.unlink(missing_ok=True)
+            self._size -= stat.st_size
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "size_bytes": self._size}
+
+    def _entry_path(self, content_hash: str, extractor_key: str) -> Path:
+        return self.cache_dir / content_hash[:2] / f"{content_hash}.{extractor_key}.txt"
+
+    def _entries(self):
+        return (entry for entry in self.cache_dir.glob("*/*.txt") if not entry.name.startswith("."))
@@ -1,8 +1,16 @@
 # Utility functions - HTML parsing and text extraction helpers
 
+import hashlib
 from pathlib import Path
+from typing import Callable
 from bs4 import BeautifulSoup
+from lxml import etree
 import re
+
+# Tags whose strings BeautifulSoup's get_text() leaves out (script/style are also decomposed by read_clean_html)
+_SKIPPED_TEXT_TAGS = ("script", "style", "template", "rt", "rp")
+_HTML_PARSER = etree.HTMLParser(encoding="utf-8")
+
 def read_clean_html(path: Path) -> str:  # Extract and clean text from HTML file, removing tags and normalizing whitespace
     try:
         with path.open("r", encoding="utf-8", errors="ignore") as f:
@@ -18,6 +26,52 @@ def read_clean_html(path: Path) -> str:  # Extract and clean text from HTML file
         print(f"[WARN] Failed to read {path}: {exc}")
         return ""
 
+def clean_html_bytes(raw: bytes) -> str:  # Extract normalised text from raw HTML bytes with lxml - same output as read_clean_html
+    root = etree.fromstring(raw, _HTML_PARSER) if raw.strip() else None
+    if root is None:
+        return ""
+    for element in list(root.iter(*_SKIPPED_TEXT_TAGS)):  # Drop content but keep the tail text that follows
+        element.clear(keep_tail=True)
+    text = " ".join(" ".join(root.itertext()).split())  # itertext yields each text node separately, like get_text(separator=" ")
+    
+    # lxml substitutes U+FFFD for undecodable bytes where the text-mode read drops them
+    if "\ufffd" in text and b"\xef\xbf\xbd" not in raw:
+        cleaned = raw.decode("utf-8", errors="ignore").encode("utf-8")
+        if cleaned != raw:
+            return clean_html_bytes(cleaned)
+    return text
+
+def read_clean_html_lxml(path: Path) -> str:  # Faster read_clean_html: reads raw bytes and walks the lxml tree directly, no BeautifulSoup
+    try:
+        return clean_html_bytes(path.read_bytes())
+    except Exception as exc:
+        print(f"[WARN] Failed to read {path}: {exc}")
+        return ""
+
+EXTRACTORS = {
+    "bs4": read_clean_html,
+    "lxml": read_clean_html_lxml,
+}
+
+# Bump an extractor's version whenever its output changes, so cached text from the old version is not reused
+EXTRACTOR_VERSIONS = {
+    "bs4": 1,
+    "lxml": 1,
+}
+
+def get_extractor(name: str) -> Callable[[Path], str]:  # Look up a text extraction backend by name
+    try:
+        return EXTRACTORS[name]
+    except KeyError:
+        raise ValueError(f"Unknown extractor {name!r}; choose from {sorted(EXTRACTORS)}") from None
+
+def file_digest(path: Path, chunk_size: int = 1 << 20) -> str:  # SHA-256 hex digest of a file's contents
+    digest = hashlib.sha256()
+    with Path(path).open("rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
 def ensure_directories(*paths):  # Extract and clean text from HTML file, removing tags and normalizing whitespace
     for path in paths:
         path = Path(path)
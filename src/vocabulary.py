@@ -0,0 +1,209 @@
+# Vocabulary - token patterns, document-frequency pruning and the compact front-coded term dictionary
+
+from array import array
+from collections.abc import Sequence
+from itertools import islice
+from numbers import Integral
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+import numpy as np
+
+DEFAULT_TOKEN_PATTERN = r"(?u)\b\w\w+\b"  # scikit-learn's default: runs of 2+ word characters
+# Words only: 2-40 letters or digits, starting with a letter. Drops numbers, identifiers with
+# underscores and overlong runs of markup debris (hex ids, base64, concatenated CSS classes)
+WORD_TOKEN_PATTERN = r"(?u)\b[^\W\d_][^\W_]{1,39}\b"
+TOKEN_PATTERNS = {"default": DEFAULT_TOKEN_PATTERN, "words": WORD_TOKEN_PATTERN}
+
+TERMS_FILE = "terms.npy"
+TERM_BLOCKS_FILE = "term_blocks.npy"
+TERM_BLOCK_SIZE = 16
+_SMALL_VARINTS = [bytes((value,)) for value in range(0x80)]  # Lengths below 128 take one byte
+
+
+def pruning_enabled(vectorizer_params: Dict) -> bool:  # Whether the parameters drop any terms by document frequency
+    min_df = vectorizer_params.get("min_df", 1)
+    max_df = vectorizer_params.get("max_df", 1.0)
+    return (not (min_df == 1 and isinstance(min_df, Integral))
+            or not (max_df == 1.0 and not isinstance(max_df, Integral))
+            or vectorizer_params.get("max_features") is not None)
+
+
+def vocabulary_mask(document_frequency: np.ndarray, term_totals: np.ndarray, num_documents: int,
+                    vectorizer_params: Dict) -> np.ndarray:
+    # Boolean mask of the terms kept by the pruning parameters, with scikit-learn's meaning:
+    # min_df and max_df are document counts (int) or fractions of the corpus (float), then
+    # max_features keeps the remaining terms with the largest total counts (ties: earlier term)
+    min_df = vectorizer_params.get("min_df", 1)
+    max_df = vectorizer_params.get("max_df", 1.0)
+    max_features = vectorizer_params.get("max_features")
+    min_count = min_df if isinstance(min_df, Integral) else min_df * num_documents
+    max_count = max_df if isinstance(max_df, Integral) else max_df * num_documents
+    if max_count < min_count:
+        raise ValueError("max_df corresponds to fewer documents than min_df")
+
+    kept = (document_frequency >= min_count) & (document_frequency <= max_count)
+    if max_features is not None and np.count_nonzero(kept) > max_features:
+        candidates = np.flatnonzero(kept)
+        order = np.argsort(-np.asarray(term_totals)[candidates], kind="stable")[:max_features]
+        kept = np.zeros_like(kept)
+        kept[candidates[order]] = True
+    if len(kept) and not kept.any():
+        raise ValueError("After pruning, no terms remain. Try a lower min_df or a higher max_df")
+    return kept
+
+
+class TermDictionary(Sequence):
+    # Read-only sorted vocabulary, usable like the list of terms it replaces (len, indexing,
+    # iteration, `in`, ==). Terms are stored as UTF-8 in blocks of block_size: each block
+    # starts with a complete term, and every following term is stored as the length of the
+    # prefix it shares with the previous term plus its remaining bytes (front coding).
+    # block_ptr holds the byte offset of every block. A term -> ID lookup binary-searches the
+    # block heads and scans one block, and ID -> term decodes one block, so nothing is built
+    # per term on load: the two arrays can stay memory-mapped.
+    def __init__(self, data: np.ndarray, block_ptr: np.ndarray, num_terms: int,
+                 block_size: int = TERM_BLOCK_SIZE):
+        self.data = data
+        self.block_ptr = block_ptr
+        self.num_terms = num_terms
+        self.block_size = block_size
+        self.num_blocks = len(block_ptr) - 1
+        # Plain buffer views: slicing them is several times cheaper than slicing numpy arrays
+        self._data_view = memoryview(np.ascontiguousarray(data)).cast("B")
+        self._block_offsets = memoryview(np.ascontiguousarray(block_ptr, dtype=np.int64)).cast("B").cast("q")
+
+    @classmethod
+    def from_terms(cls, terms: Iterable[str], block_size: int = TERM_BLOCK_SIZE) -> "TermDictionary":  # Encode terms, which must be strictly increasing
+        data = bytearray()
+        block_ptr = array("q")
+        previous = None
+        num_terms = 0
+        for term in terms:
+            encoded = term.encode("utf-8")
+            if previous is not None and encoded <= previous:  # UTF-8 byte order is code point order
+                raise ValueError(f"Terms must be sorted and unique: {term!r} follows {previous.decode('utf-8')!r}")
+            if num_terms % block_size == 0:
+                block_ptr.append(len(data))
+                data += _encode_varint(len(encoded)) + encoded
+            else:
+                shared = 0
+                limit = min(len(previous), len(encoded))
+                while shared < limit and previous[shared] == encoded[shared]:
+                    shared += 1
+                data += _encode_varint(shared) + _encode_varint(len(encoded) - shared) + encoded[shared:]
+            previous = encoded
+            num_terms += 1
+        block_ptr.append(len(data))
+        return cls(np.frombuffer(bytes(data), dtype=np.uint8), np.frombuffer(block_ptr, dtype=np.int64),
+                   num_terms, block_size)
+
+    @classmethod
+    def load(cls, directory, num_terms: int, mmap: bool = True) -> "TermDictionary":  # Load a dictionary stored by save()
+        directory = Path(directory)
+        data = np.load(directory / TERMS_FILE, mmap_mode="r" if mmap and num_terms else None)
+        return cls(data, np.load(directory / TERM_BLOCKS_FILE), num_terms)
+
+    def save(self, directory) -> None:
+        directory = Path(directory)
+        np.save(directory / TERMS_FILE, self.data)
+        np.save(directory / TERM_BLOCKS_FILE, self.block_ptr)
+
+    @property
+    def nbytes(self) -> int:  # Size of the encoded dictionary
+        return self.data.nbytes + self.block_ptr.nbytes
+
+    def get(self, term: str, default: Optional[int] = None) -> Optional[int]:  # Term ID of term, or default if it is not in the dictionary
+        encoded = term.encode("utf-8")
+        low, high = 0, self.num_blocks  # Find the last block whose head is <= term
+        while low < high:
+            middle = (low + high) // 2
+            if self._head(middle) <= encoded:
+                low = middle + 1
+            else:
+                high = middle
+        if low == 0:
+            return default
+        block = low - 1
+        for offset, candidate in enumerate(self._iter_block(block)):
+            if candidate == encoded:
+                return block * self.block_size + offset
+            if candidate > encoded:
+                break
+        return default
+
+    def index(self, term: str, start: int = 0, stop: Optional[int] = None) -> int:
+        term_id = self.get(term) if isinstance(term, str) else None
+        if term_id is None or term_id < start or (stop is not None and term_id >= stop):
+            raise ValueError(f"{term!r} is not in the term dictionary")
+        return term_id
+
+    def __contains__(self, term) -> bool:
+        return isinstance(term, str) and self.get(term) is not None
+
+    def __len__(self) -> int:
+        return self.num_terms
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self[term_id] for term_id in range(*position.indices(self.num_terms))]
+        if position < 0:
+            position += self.num_terms
+        if not 0 <= position < self.num_terms:
+            raise IndexError("term ID out of range")
+        block, offset = divmod(position, self.block_size)
+        return next(islice(self._iter_block(block), offset, None)).decode("utf-8")
+
+    def __iter__(self) -> Iterator[str]:
+        for block in range(self.num_blocks):
+            for term in self._iter_block(block):
+                yield term.decode("utf-8")
+
+    def __eq__(self, other) -> bool:  # Equal to a list, tuple or dictionary holding the same terms in order
+        if not isinstance(other, (TermDictionary, list, tuple)):
+            return NotImplemented
+        return len(self) == len(other) and all(term == other_term for term, other_term in zip(self, other))
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f"TermDictionary({self.num_terms} terms, {self.nbytes} bytes)"
+
+    def _head(self, block: int) -> bytes:  # First (complete) term of a block
+        start = self._block_offsets[block]
+        length, position = _decode_varint(self._data_view, start)
+        return bytes(self._data_view[position:position + length])
+
+    def _iter_block(self, block: int) -> Iterator[bytes]:  # The terms of a block in order, UTF-8 encoded
+        raw = bytes(self._data_view[self._block_offsets[block]:self._block_offsets[block + 1]])
+        length, position = _decode_varint(raw, 0)
+        term = raw[position:position + length]
+        position += length
+        yield term
+        while position < len(raw):
+            shared, position = _decode_varint(raw, position)
+            length, position = _decode_varint(raw, position)
+            term = term[:shared] + raw[position:position + length]
+            position += length
+            yield term
+
+
+def _encode_varint(value: int) -> bytes:  # LEB128: 7 bits per byte, high bit set on all but the last byte
+    if value < 0x80:
+        return _SMALL_VARINTS[value]
+    encoded = bytearray()
+    while value >= 0x80:
+        encoded.append((value & 0x7F) | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return bytes(encoded)
+
+
+def _decode_varint(raw, position: int) -> Tuple[int, int]:  # (value, position after it)
+    value = shift = 0
+    while True:
+        byte = raw[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, position
+        shift += 7
@@ -2,6 +2,9 @@
 import sys
 from pathlib import Path
 
+# Separate from the pipeline's output, so a test run never rewrites the committed results.csv
+OUTPUT_DIR = Path("data/output/system_test")
+
 def check_files():  # Check if required files exist
     print("\n[Checking Files]")
     
@@ -29,7 +32,7 @@ def test_indexer():
         
         indexer = DocumentIndexer()
         stats = indexer.build_index("data/html_corpus")
-        indexer.save_index("data/output/index.json")
+        indexer.save_index(str(OUTPUT_DIR / "index"))
         
         print(f"Indexed {stats['num_documents']} documents")
         print(f"Vocabulary: {stats['num_terms']} terms")
@@ -50,12 +53,12 @@ def test_queries(): # Process queries and generate results
         from src.query_processor import run_queries
         
         run_queries(
-            index_path="data/output/index.json",
+            index_path=str(OUTPUT_DIR / "index"),
             queries_csv="queries.csv",
-            output_csv="data/output/results.csv"
+            output_csv=str(OUTPUT_DIR / "results.csv")
         )
         
-        print("Results saved to results.csv")
+        print(f"Results saved to {OUTPUT_DIR / 'results.csv'}")
         return True
         
     except Exception as e:
@@ -73,8 +76,8 @@ def main():
       
         print("All tests passed!")
         print("\nGenerated files:")
-        print("data/output/index.json")
-        print("data/output/results.csv")
+        print(OUTPUT_DIR / "index")
+        print(OUTPUT_DIR / "results.csv")
     else:
         print("\nSome tests failed")
 
@@ -0,0 +1,319 @@
+# Tests for the search endpoints in api/app.py
+import asyncio
+import json
+import shutil
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import api.app as api_app
+from api.asgi import AsyncSearchApp, MicroBatcher, score_and_serialize
+from api.reloader import IndexReloader, index_signature
+from api.serve import prepare_index
+from src.indexer import DocumentIndexer
+
+
+@pytest.fixture(scope="module")
+def client(tmp_path_factory):
+    index_path = tmp_path_factory.mktemp("index") / "index"
+    indexer = DocumentIndexer()
+    indexer.build_index("data/wiki_corpus")
+    indexer.save_index(str(index_path))
+    api_app.initialize_index(str(index_path))
+    yield api_app.app.test_client()
+    api_app.query_processor = None
+
+
+def test_batch_search_matches_single_searches(client):
+    queries = [{"query": "information overload", "top_k": 5}, "google search", {"query": "folk art"}]
+    response = client.post("/search/batch", json={"queries": queries, "top_k": 2})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body["count"] == 3
+
+    expected = [("information overload", 5), ("google search", 2), ("folk art", 2)]
+    for result, (query_text, top_k) in zip(body["results"], expected):
+        single = client.post("/search", json={"query": query_text, "top_k": top_k}).get_json()
+        assert result == single
+
+
+@pytest.mark.parametrize("payload", [
+    {},
+    {"queries": []},
+    {"queries": "information"},
+    {"queries": ["ok", "  "]},
+    {"queries": [{"query": "ok", "top_k": 0}]},
+    {"queries": [{"query": "ok", "top_k": "5"}]},
+    {"queries": ["x" * (api_app.MAX_QUERY_LENGTH + 1)]},
+    {"queries": ["ok"] * (api_app.MAX_BATCH_QUERIES + 1)},
+])
+def test_batch_search_rejects_invalid_requests(client, payload):
+    response = client.post("/search/batch", json=payload)
+    assert response.status_code == 400
+    assert "error" in response.get_json()
+
+
+def test_batch_search_rejects_oversized_body(client):
+    response = client.post("/search/batch", data=b"x" * (api_app.app.config["MAX_CONTENT_LENGTH"] + 1),
+                           content_type="application/json")
+    assert response.status_code == 413
+
+
+def test_health_reports_result_cache(client):
+    client.post("/search", json={"query": "information overload", "top_k": 3})
+    client.post("/search", json={"query": "Overload, information!", "top_k": 2})
+    body = client.get("/health").get_json()
+    assert body["index_version"] == body["cache"]["index_version"]
+    assert body["cache"]["hits"] >= 1
+
+
+def test_timing_header_breaks_down_search_stages(client):
+    response = client.post("/search", json={"query": "information overload"})
+    assert "X-Timing" not in response.headers
+    response = client.post("/search", json={"query": "folk art museum", "top_k": 3}, headers={"X-Timing": "1"})
+    stages = dict(part.split("=") for part in response.headers["X-Timing"].split(", "))
+    assert ["validate", "cache_lookup", "vectorize", "similarity", "top_k", "rank", "format", "serialize"] \
+        == list(stages)[:-1]
+    assert float(stages["total"]) >= sum(float(ms) for stage, ms in stages.items() if stage != "total")
+
+
+def test_metrics_endpoint_exposes_prometheus_counters_and_histograms(client):
+    client.post("/search", json={"query": "information overload"})
+    client.post("/search", json={"query": "  "})
+    text = client.get("/metrics").data.decode("utf-8")
+    samples = dict(line.rsplit(" ", 1) for line in text.splitlines() if not line.startswith("#"))
+    assert int(samples['ir_http_requests_total{endpoint="/search",method="POST",status="200"}']) >= 1
+    assert int(samples['ir_http_requests_total{endpoint="/search",method="POST",status="400"}']) >= 1
+    assert "# TYPE ir_search_stage_duration_seconds histogram" in text
+    vectorize = 'ir_search_stage_duration_seconds_{}{{endpoint="/search",stage="vectorize"{}}}'
+    assert samples[vectorize.format("bucket", ',le="+Inf"')] == samples[vectorize.format("count", "")]
+    assert int(samples["ir_index_documents"]) == len(api_app.query_processor.document_ids)
+    assert "ir_result_cache_hits_total" in samples
+
+
+def test_create_app_serves_memory_mapped_postings(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(api_app, "query_processor", api_app.query_processor)  # Restored after the test
+    monkeypatch.setattr(api_app, "result_cache", api_app.result_cache)
+    expected = client.post("/search", json={"query": "information overload", "top_k": 5}).get_json()
+
+    index_path = tmp_path / "index"
+    indexer = DocumentIndexer()
+    indexer.build_index("data/wiki_corpus")
+    indexer.save_index(str(index_path))
+    prepare_index(str(index_path))
+    app = api_app.create_app(str(index_path), cache_size=0)
+
+    term_matrix = api_app.query_processor._term_matrix
+    assert not term_matrix.data.flags.owndata and not term_matrix.indices.flags.owndata  # Views of the mapped files
+    assert app.test_client().post("/search", json={"query": "information overload", "top_k": 5}).get_json() == expected
+
+
+@pytest.fixture
+def reloadable_app(client, tmp_path, monkeypatch):
+    for name in ("query_processor", "result_cache", "index_reloader"):
+        monkeypatch.setattr(api_app, name, getattr(api_app, name))  # Restored after the test
+    index_path = tmp_path / "index"
+    indexer = DocumentIndexer()
+    indexer.build_index("data/html_corpus")
+    indexer.save_index(str(index_path))
+    return api_app.create_app(str(index_path)).test_client(), index_path
+
+
+def test_admin_reload_swaps_in_rebuilt_index(reloadable_app):
+    client, index_path = reloadable_app
+    before = client.get("/health").get_json()
+    assert before["documents_loaded"] == 3
+
+    indexer = DocumentIndexer()
+    indexer.build_index("data/wiki_corpus")
+    indexer.save_index(str(index_path))
+    response = client.post("/admin/reload", json={"wait": True})
+    assert response.status_code == 200
+
+    after = client.get("/health").get_json()
+    assert after["documents_loaded"] == 100
+    term_matrix = api_app.query_processor._term_matrix  # Stored postings, not a private transposed copy
+    assert not term_matrix.data.flags.writeable and not term_matrix.indices.flags.writeable
+    assert after["index_version"] != before["index_version"]
+    assert after["reload"]["last_reload"]["status"] == "ok"
+    assert after["reload"]["last_reload"]["duration_seconds"] >= 0
+    assert after["cache"]["index_version"] == after["index_version"]
+
+    # A failed reload keeps serving the current index
+    shutil.rmtree(index_path.resolve())
+    index_path.unlink()
+    assert client.post("/admin/reload", json={"wait": True}).status_code == 500
+    assert client.get("/health").get_json()["index_version"] == after["index_version"]
+    assert client.post("/search", json={"query": "information overload"}).status_code == 200
+
+
+def test_admin_reload_requires_token_when_configured(reloadable_app, monkeypatch):
+    client, _ = reloadable_app
+    monkeypatch.setenv("IR_ADMIN_TOKEN", "secret")
+    assert client.post("/admin/reload").status_code == 403
+    response = client.post("/admin/reload", json={"wait": True}, headers={"X-Admin-Token": "secret"})
+    assert response.status_code == 200
+
+
+def test_reloader_serves_old_index_until_new_one_is_loaded(tmp_path):
+    index_path = tmp_path / "index.json"
+    index_path.write_text("{}")
+    release = threading.Event()
+    installed = []
+
+    def slow_load(path):
+        release.wait(10)
+        return "new processor"
+
+    reloader = IndexReloader(str(index_path), slow_load, installed.append)
+    reloader.loads = 1  # Pretend an index is already being served
+    assert reloader.reload(wait=False)
+    assert reloader.status()["reloading"] and installed == []
+    assert not reloader.reload(wait=False)  # Reloads never overlap
+    release.set()
+    for _ in range(100):
+        if installed:
+            break
+        time.sleep(0.05)
+    assert installed == ["new processor"] and not reloader.status()["reloading"]
+
+
+def test_reloader_watches_for_rebuilt_index(tmp_path):
+    index_path = tmp_path / "index.json"
+    index_path.write_text("{}")
+    installed = []
+    reloader = IndexReloader(str(index_path), lambda path: Path(path).read_text(), installed.append,
+                             poll_interval=0.05)
+    reloader.reload()
+    reloader.ensure_watching()
+
+    time.sleep(0.01)
+    index_path.write_text('{"rebuilt": true}')
+    for _ in range(100):
+        if len(installed) == 2:
+            break
+        time.sleep(0.05)
+    assert installed == ["{}", '{"rebuilt": true}']
+
+
+def call_asgi(app, method, path, payload=None, body=None, content_type=b"application/json"):
+    # Drive one request through an ASGI app; returns (status, body, parsed if it is JSON)
+    if body is None:
+        body = json.dumps(payload).encode("utf-8") if payload is not None else b""
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    async def run():
+        scope = {"type": "http", "method": method, "path": path, "headers": [(b"content-type", content_type)],
+                 "client": ("127.0.0.1", 50000)}
+        await app(scope, receive, send)
+        headers = dict(sent[0]["headers"])
+        if headers[b"content-type"].startswith(b"application/json"):
+            return sent[0]["status"], json.loads(sent[1]["body"])
+        return sent[0]["status"], sent[1]["body"]
+
+    return run()
+
+
+def test_async_search_matches_flask_and_batches_concurrent_requests(client):
+    app = AsyncSearchApp(MicroBatcher(score_and_serialize, max_workers=1))
+    requests = [{"query": query, "top_k": k} for query in ["information overload", "folk art", "google"]
+                for k in [1, 3, 5]] * 3
+
+    async def run_all():
+        return await asyncio.gather(*(call_asgi(app, "POST", "/search", payload) for payload in requests))
+
+    responses = asyncio.run(run_all())
+    for payload, (status, body) in zip(requests, responses):
+        assert status == 200
+        assert body == client.post("/search", json=payload).get_json()
+    stats = app.batcher.stats()
+    assert stats["requests"] == len(requests) and stats["largest_batch"] > 1  # Queued requests were coalesced
+
+    batch = {"queries": ["information overload", {"query": "folk art", "top_k": 5}]}
+    status, body = asyncio.run(call_asgi(app, "POST", "/search/batch", batch))
+    assert status == 200, body
+    assert body == client.post("/search/batch", json=batch).get_json()
+    status, body = asyncio.run(call_asgi(app, "GET", "/health"))
+    assert status == 200 and body["async"]["batches"] >= 1
+    app.batcher.shutdown()
+
+
+def test_async_search_errors(client, monkeypatch):
+    app = AsyncSearchApp(MicroBatcher(score_and_serialize, max_workers=2, window_ms=5))
+    assert asyncio.run(call_asgi(app, "POST", "/search", {"query": "x"}, content_type=b"text/plain"))[0] == 400
+    assert asyncio.run(call_asgi(app, "POST", "/search", {"top_k": 3}))[0] == 400
+    assert asyncio.run(call_asgi(app, "POST", "/search", body=b"not json"))[0] == 400
+    assert asyncio.run(call_asgi(app, "GET", "/nowhere"))[0] == 404
+    for body in [b"{}", b"null", b"[]", b'{"queries": []}', b"not json"]:  # Same validation and messages as Flask
+        for path in ["/search", "/search/batch"]:
+            expected = client.post(path, data=body, content_type="application/json")
+            assert asyncio.run(call_asgi(app, "POST", path, body=body)) == (400, expected.get_json()), (path, body)
+    oversized = b"x" * (api_app.app.config["MAX_CONTENT_LENGTH"] + 1)
+    assert asyncio.run(call_asgi(app, "POST", "/search", body=oversized))[0] == 413
+    monkeypatch.setattr(api_app, "query_processor", None)
+    assert asyncio.run(call_asgi(app, "POST", "/search", {"query": "information"}))[0] == 503
+    app.batcher.shutdown()
+
+
+def test_async_app_serves_other_routes_through_flask(client):
+    app = AsyncSearchApp(MicroBatcher(score_and_serialize, max_workers=1))
+    status, body = asyncio.run(call_asgi(app, "GET", "/"))
+    assert status == 200 and body == client.get("/").data  # Web UI
+    assert asyncio.run(call_asgi(app, "GET", "/api/info")) == (200, client.get("/api/info").get_json())
+    status, body = asyncio.run(call_asgi(app, "POST", "/admin/reload", {"wait": True}))
+    assert status == 200 and body["reload"]["last_reload"]["status"] == "ok"
+    assert asyncio.run(call_asgi(app, "GET", "/search"))[0] == 405
+    app.batcher.shutdown()
+
+
+def test_default_index_path_falls_back_to_committed_json_index(tmp_path, monkeypatch):
+    monkeypatch.delenv("IR_INDEX_PATH", raising=False)
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data/output").mkdir(parents=True)
+    shutil.copy(Path(__file__).parent.parent / api_app.LEGACY_INDEX_PATH, api_app.LEGACY_INDEX_PATH)
+    assert api_app.default_index_path() == api_app.LEGACY_INDEX_PATH  # Fresh checkout: nothing built yet
+    assert api_app.load_processor(api_app.default_index_path()).process_query("information retrieval", top_k=1)
+
+    (tmp_path / api_app.DEFAULT_INDEX_PATH).mkdir()  # Built by the pipeline
+    assert api_app.default_index_path() == api_app.DEFAULT_INDEX_PATH
+    monkeypatch.setenv("IR_INDEX_PATH", "elsewhere")
+    assert api_app.default_index_path() == "elsewhere"
+
+
+def test_result_cache_follows_the_installed_index(reloadable_app, tmp_path):
+    client, _ = reloadable_app
+    client.post("/search", json={"query": "information overload", "top_k": 5})
+    served = api_app.query_processor.index_version
+    assert api_app.result_cache.index_version == served and api_app.result_cache.stats()["entries"] == 1
+
+    other_path = tmp_path / "other"
+    indexer = DocumentIndexer()
+    indexer.build_index("data/wiki_corpus")
+    indexer.save_index(str(other_path))
+    api_app.load_processor(str(other_path))  # Loaded but never installed, as in a reload that fails
+    assert api_app.result_cache.index_version == served and api_app.result_cache.stats()["entries"] == 1
+    hits = api_app.result_cache.hits
+    client.post("/search", json={"query": "information overload", "top_k": 5})
+    assert api_app.result_cache.hits == hits + 1
+
+
+def test_index_signature_tracks_sharded_index_rebuilds(tmp_path):
+    index_path = tmp_path / "sharded"
+    indexer = DocumentIndexer()
+    indexer.build_index("data/html_corpus")
+    indexer.save_index(str(index_path), num_shards=2)
+    signature = index_signature(str(index_path))
+    assert signature is not None
+    indexer.save_index(str(index_path), num_shards=2)
+    assert index_signature(str(index_path)) not in (None, signature)
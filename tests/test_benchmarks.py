@@ -0,0 +1,43 @@
+# Smoke test for benchmarks/bench_suite.py on a tiny synthetic corpus
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from benchmarks.bench_suite import METRIC_DIRECTIONS, compare_reports
+
+STAGES = {"extraction", "build", "load", "query", "search_api"}
+
+
+def test_bench_suite_runs_on_a_tiny_corpus(tmp_path):
+    output = tmp_path / "bench.json"
+    result = subprocess.run(
+        [sys.executable, "benchmarks/bench_suite.py", "--sizes", "20", "--queries", "5",
+         "--work-dir", str(tmp_path / "work"), "--output", str(output)],
+        capture_output=True, text=True, timeout=300)
+    assert result.returncode == 0, result.stderr
+
+    report = json.loads(output.read_text(encoding="utf-8"))
+    assert {"commit", "timestamp", "machine", "config", "sizes"} <= set(report)
+    assert report["config"]["num_queries"] == 5
+    assert list(report["sizes"]) == ["20"]
+    stages = report["sizes"]["20"]
+    assert set(stages) == STAGES
+    assert stages["extraction"]["documents"] == 20
+
+    # Every timed metric the suite reports has a direction, and every direction is reported
+    reported = {name for metrics in stages.values() for name in metrics}
+    assert set(METRIC_DIRECTIONS) <= reported
+    assert all(METRIC_DIRECTIONS[name] == -1 for name in METRIC_DIRECTIONS if name.endswith(("_seconds", "_ms", "_bytes")))
+    assert all(METRIC_DIRECTIONS[name] == 1 for name in METRIC_DIRECTIONS if name.endswith("_per_sec"))
+    for name in reported - set(METRIC_DIRECTIONS):
+        assert name in {"documents", "num_terms", "nnz", "top_k"}
+
+    # A slower build and a lower throughput count as regressions; unchanged metrics do not
+    assert compare_reports(report, report) == 0
+    slower = json.loads(json.dumps(report))
+    slower["sizes"]["20"]["build"]["build_seconds"] = stages["build"]["build_seconds"] * 2
+    slower["sizes"]["20"]["query"]["queries_per_sec"] = stages["query"]["queries_per_sec"] / 2
+    assert compare_reports(report, slower) == 2
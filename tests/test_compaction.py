@@ -0,0 +1,136 @@
+# Tests for float32 / 8-bit quantised and pruned serving indexes in src/compaction.py
+import json
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+from scipy import sparse
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.compaction import compact_index, compact_matrix, evaluate_compaction, prune_documents, quantize_rows
+from src.indexer import DocumentIndexer
+from src.inverted_index import RetrievalEngine, ensure_postings
+from src.query_processor import QueryProcessor
+
+QUERIES = ["information retrieval", "search engine index", "world war history", "zzzunknownterm", ""]
+
+
+@pytest.fixture(scope="module")
+def index_path(tmp_path_factory):
+    index_path = tmp_path_factory.mktemp("index") / "index"
+    indexer = DocumentIndexer(extractor="lxml")
+    indexer.build_index("data/wiki_corpus")
+    indexer.save_index(str(index_path))
+    return index_path
+
+
+def test_prune_documents_keeps_highest_weights_per_document():
+    matrix = sparse.csr_matrix(np.array([
+        [0.1, 0.5, 0.0, 0.3, 0.3],
+        [0.0, 0.0, 0.0, 0.0, 0.0],
+        [0.0, 0.0, 0.2, 0.0, 0.0],
+    ]))
+    pruned = prune_documents(matrix, 0.5)
+    assert pruned.toarray().tolist() == [
+        [0.0, 0.5, 0.0, 0.3, 0.0],  # ceil(4 * 0.5) = 2 postings; the tie goes to the lower term ID
+        [0.0, 0.0, 0.0, 0.0, 0.0],
+        [0.0, 0.0, 0.2, 0.0, 0.0],  # Every document keeps at least one term
+    ]
+    assert pruned.has_sorted_indices
+    assert (prune_documents(matrix, 1.0) != matrix).nnz == 0
+    with pytest.raises(ValueError, match="keep_fraction"):
+        prune_documents(matrix, 0)
+
+
+def test_quantize_rows_scales_each_document():
+    matrix = sparse.csr_matrix(np.array([[0.2, 0.0, 0.1, 0.0001], [0.0, 0.0, 0.0, 0.0], [0.0, 4.0, 0.0, 2.0]]))
+    codes, scales = quantize_rows(matrix)
+    assert codes.dtype == np.uint8
+    assert codes.toarray().tolist() == [[255, 0, 128, 0], [0, 0, 0, 0], [0, 255, 0, 128]]
+    assert codes.nnz == 4  # The weight that rounds to 0 is dropped
+    assert np.allclose(scales, [0.2 / 255, 0.0, 4.0 / 255])
+    weights = codes.multiply(scales[:, None]).toarray()
+    assert np.abs(weights - matrix.toarray()).max() <= 4.0 / 510
+    with pytest.raises(ValueError, match="non-negative"):
+        quantize_rows(-matrix)
+    with pytest.raises(ValueError, match="precision"):
+        compact_matrix(matrix, "int4")
+
+
+def test_float32_index_ranks_like_the_full_index(index_path, tmp_path):
+    stats = compact_index(str(index_path), str(tmp_path / "compact"), precision="float32")
+    assert stats["pruned_postings"] == 0
+    assert stats["matrix_bytes"] < stats["source_matrix_bytes"]
+    full = QueryProcessor.from_index(str(index_path))
+    compact = QueryProcessor.from_index(str(tmp_path / "compact"))
+    assert compact.tfidf_matrix.dtype == np.float32
+    for expected, actual in zip(full.process_queries(QUERIES, top_k=10), compact.process_queries(QUERIES, top_k=10)):
+        assert [doc_id for _, doc_id, score in actual if score > 0] == \
+            [doc_id for _, doc_id, score in expected if score > 0]
+        assert np.allclose([score for *_, score in actual], [score for *_, score in expected], atol=1e-6)
+
+
+@pytest.mark.parametrize("keep_fraction", [1.0, 0.3])
+def test_quantized_index_scores_its_dequantized_weights(index_path, tmp_path, keep_fraction):
+    compact_path = tmp_path / "compact"
+    stats = compact_index(str(index_path), str(compact_path), precision="uint8", keep_fraction=keep_fraction)
+    meta = json.loads((compact_path / "meta.json").read_text())
+    assert meta["dtype"] == "|u1"
+    assert meta["compaction"]["precision"] == "uint8"
+    assert meta["compaction"]["keep_fraction"] == keep_fraction
+    assert stats["matrix_bytes"] < stats["source_matrix_bytes"] / 2
+
+    # Other loaders see the dequantized weights; the query processor scores the stored codes
+    data = DocumentIndexer.load_index_data(str(compact_path))
+    assert data["tfidf_matrix"].dtype == np.float32 and data["scales"] is None
+    processor = QueryProcessor.from_index(str(compact_path))
+    assert processor.tfidf_matrix.dtype == np.uint8
+    reference = QueryProcessor(data["document_ids"], data["vocabulary"], data["tfidf_matrix"].astype(np.float64),
+                               data["vectorizer_params"], idf=data["idf"])
+    for expected, actual in zip(reference.process_queries(QUERIES), processor.process_queries(QUERIES)):
+        assert [doc_id for _, doc_id, _ in actual] == [doc_id for _, doc_id, _ in expected]
+        assert np.allclose([score for *_, score in actual], [score for *_, score in expected], atol=1e-6)
+    assert [processor.process_query(query, top_k=5) for query in QUERIES] == processor.process_queries(QUERIES, top_k=5)
+
+    # Stored postings keep the codes and are memory-mapped like those of a full index
+    assert ensure_postings(str(compact_path))
+    mapped = QueryProcessor.from_index(str(compact_path))
+    assert mapped._term_matrix.dtype == np.uint8 and not mapped._term_matrix.data.flags.writeable
+    assert mapped.process_queries(QUERIES) == processor.process_queries(QUERIES)
+    engine = RetrievalEngine.from_index(str(compact_path))  # Still scores the dequantized weights
+    for expected, actual in zip(processor.process_queries(QUERIES, top_k=5), [engine.search(query, top_k=5) for query in QUERIES]):
+        assert np.allclose([score for *_, score in actual], [score for *_, score in expected if score > 0], atol=1e-6)
+
+    report = evaluate_compaction(str(index_path), str(compact_path), "queries.csv", top_k=10)
+    assert report["queries"] == 3
+    assert 0.5 <= report["overlap"] <= 1.0
+    assert report["max_score_error"] < 0.05
+    with pytest.raises(ValueError, match="already compacted"):
+        compact_index(str(compact_path), str(tmp_path / "again"))
+
+
+def test_quantized_index_without_l2_norm(tmp_path):
+    indexer = DocumentIndexer(extractor="lxml", norm=None)
+    indexer.build_index("data/wiki_corpus")
+    indexer.save_index(str(tmp_path / "index"))
+    compact_index(str(tmp_path / "index"), str(tmp_path / "compact"))
+    full = QueryProcessor.from_index(str(tmp_path / "index"))
+    compact = QueryProcessor.from_index(str(tmp_path / "compact"))
+    for expected, actual in zip(full.process_queries(QUERIES, top_k=3), compact.process_queries(QUERIES, top_k=3)):
+        assert np.allclose([score for *_, score in actual], [score for *_, score in expected], atol=0.01)
+
+    ensure_postings(str(tmp_path / "compact"))  # Unnormalised codes: the document norms still apply
+    mapped = QueryProcessor.from_index(str(tmp_path / "compact"))
+    assert not mapped._term_matrix.data.flags.writeable
+    assert mapped.process_queries(QUERIES) == compact.process_queries(QUERIES)
+
+
+def test_pipeline_rejects_compacting_a_sharded_index():
+    import subprocess
+
+    result = subprocess.run([sys.executable, "run_pipeline.py", "--indexer-only", "--shards", "2", "--compact", "uint8"],
+                            capture_output=True, text=True, timeout=60)
+    assert result.returncode == 2  # Rejected by the argument parser, before anything is built
+    assert "--compact cannot be combined with --shards" in result.stderr
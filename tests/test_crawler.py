@@ -0,0 +1,176 @@
+# Tests for src/crawler.py and src/record_segments.py against a local HTTP server (no network)
+import hashlib
+import subprocess
+import sys
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.crawler import page_filename
+from src.indexer import DocumentIndexer
+from src.record_segments import SegmentWriter, iter_records, record_urls
+
+# Fixture site: /wiki/<title> -> linked titles
+SITE = {
+    "Start": ["Alpha", "Beta", "Gamma", "Delta", "Special:Random", "Alpha?action=edit"],
+    "Alpha": ["Epsilon", "Zeta"],
+    "Beta": ["Start", "Old_name"],
+    "Gamma": [],
+    "Delta": ["Alpha"],
+    "Epsilon": ["Is_Google_Making_Us_Stupid%3F"],
+    "Zeta": ["I%27m_Feeling_Lucky_(book)"],
+    "Is_Google_Making_Us_Stupid%3F": ["Start"],
+    "I%27m_Feeling_Lucky_(book)": [],
+    "Renamed": [],
+}
+REDIRECTS = {"Old_name": "Renamed"}
+
+
+@pytest.fixture
+def site():
+    hits = Counter()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            hits[self.path] += 1
+            title = self.path[len("/wiki/"):] if self.path.startswith("/wiki/") else None
+            if title in REDIRECTS:
+                self.send_response(301)
+                self.send_header("Location", f"/wiki/{REDIRECTS[title]}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            if title not in SITE:
+                self.send_error(404)
+                return
+            links = "".join(f'<li><a href="/wiki/{link}">{link}</a></li>' for link in SITE[title])
+            body = (f"<html><head><title>{title}</title></head><body><h1>{title}</h1>"
+                    f'<ul>{links}<li><a href="https://example.com/">external</a></li></ul></body></html>')
+            encoded = body.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(encoded)))
+            self.end_headers()
+            self.wfile.write(encoded)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}", hits
+    server.shutdown()
+    server.server_close()
+
+
+def crawl(base_url, output_dir, *options):  # Each crawl needs its own process: Twisted's reactor cannot restart
+    command = [sys.executable, "src/crawler.py", "--output", str(output_dir), "--start-url", f"{base_url}/wiki/Start",
+               "--concurrency", "4", "--delay", "0", "--depth", "0", "--log-level", "WARNING", *options]
+    subprocess.run(command, check=True, capture_output=True, timeout=120)
+
+
+def test_page_filename_matches_corpus_naming():
+    assert page_filename("https://en.wikipedia.org/wiki/Is_Google_Making_Us_Stupid%3F") \
+        == "Is_Google_Making_Us_Stupid%3F.html"
+    assert page_filename("https://en.wikipedia.org/wiki/I'm_Feeling_Lucky_(book)") \
+        == page_filename("https://en.wikipedia.org/wiki/I%27m_Feeling_Lucky_(book)") == "I%27m_Feeling_Lucky_(book).html"
+    assert page_filename("https://en.wikipedia.org/wiki/Ecce_Homo_(Garc%C3%ADa_Mart%C3%ADnez_and_Gim%C3%A9nez)") \
+        == "Ecce_Homo_(Garc%C3%ADa_Mart%C3%ADnez_and_Gim%C3%A9nez).html"
+    assert page_filename("https://example.com/a/b") == "example.com%2Fa%2Fb.html"
+    # Revision and action views never overwrite the article's file, or each other
+    article = "https://en.wikipedia.org/wiki/Information_retrieval"
+    names = {page_filename(article), page_filename(f"{article}?oldid=1"),
+             page_filename(f"{article}?oldid=2"), page_filename(f"{article}?action=edit")}
+    assert len(names) == 4 and all(name.startswith("Information_retrieval") for name in names)
+    long_name = page_filename("https://en.wikipedia.org/wiki/" + "x" * 500)
+    assert len(long_name) <= 205 and long_name != page_filename("https://en.wikipedia.org/wiki/" + "x" * 501)
+    # Every page in the demo corpus keeps its name
+    for html_file in Path("data/wiki_corpus").glob("*.html"):
+        assert page_filename(f"https://en.wikipedia.org/wiki/{html_file.stem}") == html_file.name
+
+
+def test_crawl_resumes_from_job_dir_without_refetching(site, tmp_path):
+    base_url, hits = site
+    output_dir, job_dir = tmp_path / "corpus", tmp_path / "job"
+    expected = {page_filename(f"{base_url}/wiki/{title}") for title in SITE}
+
+    crawl(base_url, output_dir, "--job-dir", str(job_dir), "--max-pages", "3")  # Stops early
+    first_run = {path.name for path in output_dir.glob("*.html")}
+    assert 3 <= len(first_run) < len(expected)
+
+    crawl(base_url, output_dir, "--job-dir", str(job_dir), "--max-pages", "0")  # Resumes the frontier
+    assert {path.name for path in output_dir.glob("*.html")} == expected
+    assert not list(output_dir.glob(".*.tmp"))
+    page_hits = {path: count for path, count in hits.items() if path != "/robots.txt"}
+    assert set(page_hits) == {f"/wiki/{title}" for title in [*SITE, *REDIRECTS]}
+    assert set(page_hits.values()) == {1}  # No page was downloaded twice
+
+    hits.clear()
+    crawl(base_url, output_dir)  # New job, same corpus: known pages come from disk, redirects included
+    assert {path.name for path in output_dir.glob("*.html")} == expected
+    assert not any(path.startswith("/wiki/") for path in hits)
+
+
+def test_records_crawl_indexes_like_html_crawl(site, tmp_path):
+    base_url, hits = site
+    html_dir, records_dir = tmp_path / "html", tmp_path / "records"
+    crawl(base_url, html_dir)
+    crawl(base_url, records_dir, "--records")
+    assert not list(records_dir.glob("*.html"))
+    records = list(iter_records(records_dir))
+    assert {record["doc_id"] for record in records} == {path.stem for path in html_dir.glob("*.html")}
+    assert records[0]["title"] == "Start" and records[0]["url"] == f"{base_url}/wiki/Start"
+    assert records[0]["sha256"] == hashlib.sha256((html_dir / "Start.html").read_bytes()).hexdigest()
+    renamed = next(record for record in records if record["doc_id"] == "Renamed")
+    assert renamed["redirect_urls"] == [f"{base_url}/wiki/Old_name"]
+    urls = {url for record in records for url in [record["url"], *record.get("redirect_urls", [])]}
+    assert record_urls(str(records_dir)) == urls
+
+    from_html, from_records = DocumentIndexer(), DocumentIndexer()
+    from_html.build_index(str(html_dir))
+    from_records.build_index(str(records_dir))
+    assert from_records.vocabulary == from_html.vocabulary
+    rows = [from_html.document_ids.index(doc_id) for doc_id in from_records.document_ids]
+    assert abs(from_records.tfidf_matrix - from_html.tfidf_matrix[rows]).max() < 1e-12
+
+    streamed = tmp_path / "streamed"
+    DocumentIndexer().build_index_streaming(str(records_dir), str(streamed), batch_size=3)
+    data = DocumentIndexer.load_index_data(str(streamed))
+    assert data["document_ids"] == from_records.document_ids
+    assert abs(data["tfidf_matrix"] - from_records.tfidf_matrix).max() < 1e-12
+
+    hits.clear()
+    crawl(base_url, records_dir, "--records")  # Stored URLs are not fetched again
+    assert not any(path.startswith("/wiki/") for path in hits)
+    assert len(list(iter_records(records_dir))) == len(records)
+
+
+def test_segments_roll_over_and_survive_truncation(tmp_path):
+    records = [{"url": f"http://example.com/{number}", "text": "word " * number} for number in range(7)]
+    writer = SegmentWriter(str(tmp_path), max_records=3)
+    for record in records:
+        writer.write(record)
+    writer.close()
+    segments = sorted(tmp_path.glob("segment-*.jsonl.gz"))
+    assert [path.name for path in segments] == ["segment-00000.jsonl.gz", "segment-00001.jsonl.gz",
+                                                "segment-00002.jsonl.gz"]
+    assert list(iter_records(str(tmp_path))) == records
+    assert SegmentWriter(str(tmp_path)).next_number == 3  # A new run never appends to old segments
+    assert (tmp_path / "segment-00001.urls.txt").read_text().splitlines() == [record["url"] for record in records[3:6]]
+    (tmp_path / "segment-00002.urls.txt").unlink()  # Segments without a sidecar are read in full
+    assert record_urls(str(tmp_path)) == {record["url"] for record in records}
+
+    # A crawl killed mid-write leaves a segment without its gzip trailer
+    with open(segments[1], "r+b") as f:
+        f.truncate(segments[1].stat().st_size - 8)
+    assert list(iter_records(str(tmp_path))) == records
+    with open(segments[1], "r+b") as f:
+        f.truncate(segments[1].stat().st_size - 20)
+    recovered = list(iter_records(str(tmp_path)))
+    assert recovered == records[:len(recovered) - 1] + records[6:] and len(recovered) >= 5
@@ -0,0 +1,36 @@
+# Equivalence tests for the text extraction backends in src/utils.py
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.utils import clean_html_bytes, read_clean_html, read_clean_html_lxml
+
+CORPUS_FILES = sorted(Path("data/html_corpus").glob("*.html")) + sorted(Path("data/wiki_corpus").glob("*.html"))
+
+EDGE_CASES = {
+    "invalid_utf8": b"<html><body><p>caf\xe9 ok \xff\xfe done</p></body></html>",
+    "empty": b"",
+    "whitespace": b"   \n ",
+    "bom": b"\xef\xbb\xbf<p>h\xc3\xa9llo</p>",
+    "meta_charset": b'<html><head><meta charset="iso-8859-1"></head><body>h\xc3\xa9llo</body></html>',
+    "comments_cdata_pi": b"<p>a<![CDATA[x]]>b</p><!-- c -->d<?pi x?>e",
+    "nul_byte": b"<p>a\x00b</p>",
+    "template_ruby": b"<template><p>tpl</p></template>w<noscript>ns</noscript><ruby>k<rt>r</rt><rp>(</rp></ruby>",
+    "script_tails": b"<p>a<script>if(a<b){x}</script>tail<style>s</style>z</p><svg><style>q</style>k</svg>",
+    "entities": b"<p>&nbsp;x&#160;y&lt;&gt; &unknown; &#x1F600;</p>",
+}
+
+
+@pytest.mark.parametrize("path", CORPUS_FILES, ids=lambda path: path.name)
+def test_lxml_backend_matches_bs4_on_corpus(path):
+    assert read_clean_html_lxml(path) == read_clean_html(path)
+
+
+@pytest.mark.parametrize("name", sorted(EDGE_CASES))
+def test_lxml_backend_matches_bs4_on_edge_cases(name, tmp_path):
+    path = tmp_path / f"{name}.html"
+    path.write_bytes(EDGE_CASES[name])
+    assert clean_html_bytes(EDGE_CASES[name]) == read_clean_html(path)
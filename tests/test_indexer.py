@@ -0,0 +1,318 @@
+# Tests for incremental, cached and streaming index builds in src/indexer.py
+import json
+import os
+import shutil
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.indexer import DocumentIndexer
+from src.profiler import PipelineProfiler, stage
+from src.utils import read_clean_html_lxml
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    corpus_dir = tmp_path / "corpus"
+    shutil.copytree("data/wiki_corpus", corpus_dir)
+    return corpus_dir
+
+
+def assert_same_index(indexer, expected):
+    assert indexer.document_ids == expected.document_ids
+    assert indexer.vocabulary == expected.vocabulary
+    np.testing.assert_array_equal(indexer.idf, expected.idf)
+    assert abs(indexer.term_counts - expected.term_counts).max() == 0
+    assert abs(indexer.tfidf_matrix - expected.tfidf_matrix).max() == 0
+
+
+def test_parallel_build_matches_serial_build(corpus):
+    serial = DocumentIndexer(extractor="lxml")
+    serial.build_index(str(corpus), workers=1)
+    parallel = DocumentIndexer(extractor="lxml")
+    parallel.build_index(str(corpus), workers=2)
+    assert_same_index(parallel, serial)
+
+
+def test_update_index_matches_full_build(corpus, tmp_path):
+    index_path = str(tmp_path / "index")
+    initial = DocumentIndexer(extractor="lxml")
+    initial.build_index(str(corpus))
+    initial.save_index(index_path)
+
+    (corpus / "Folk_art.html").write_text("<html><body>rewritten folk zebraword page</body></html>")
+    (corpus / "AAA_new.html").write_text("<html><body>new xylophonequark google page</body></html>")
+    (corpus / "Blank.html").write_text("<html><body> </body></html>")
+    os.remove(corpus / "Tradition.html")
+    os.utime(corpus / "Folklore.html", None)  # Touched but unchanged
+
+    updated = DocumentIndexer(extractor="lxml")
+    updated.update_index(str(corpus), index_path)
+    rebuilt = DocumentIndexer(extractor="lxml")
+    rebuilt.build_index(str(corpus))
+    assert_same_index(updated, rebuilt)
+    assert "zebraword" in updated.vocabulary and "Tradition" not in updated.document_ids
+
+    # A saved update can be updated again without re-reading anything
+    updated.save_index(index_path)
+    again = DocumentIndexer(extractor="lxml")
+    again.extract_text = None  # Any extraction would fail
+    again.update_index(str(corpus), index_path)
+    assert_same_index(again, rebuilt)
+
+
+def test_update_index_rebuilds_when_parameters_change(corpus, tmp_path):
+    index_path = str(tmp_path / "index")
+    initial = DocumentIndexer(extractor="lxml")
+    initial.build_index(str(corpus))
+    initial.save_index(index_path)
+
+    updated = DocumentIndexer(extractor="lxml", stop_words=None)
+    updated.update_index(str(corpus), index_path)
+    rebuilt = DocumentIndexer(extractor="lxml", stop_words=None)
+    rebuilt.build_index(str(corpus))
+    assert_same_index(updated, rebuilt)
+
+
+def test_text_cache_skips_extraction_on_rebuild(tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    first = DocumentIndexer(extractor="lxml", cache_dir=cache_dir)
+    first.build_index("data/html_corpus")
+    assert first.text_cache.stats()["misses"] == 3
+
+    # Different vectorizer parameters, same files: every document comes from the cache
+    second = DocumentIndexer(extractor="lxml", stop_words=None, cache_dir=cache_dir)
+    second.extract_text = None  # Any extraction would fail
+    second.build_index("data/html_corpus")
+    expected = DocumentIndexer(extractor="lxml", stop_words=None)
+    expected.build_index("data/html_corpus")
+    assert second.text_cache.stats()["hits"] == 3
+    assert abs(second.tfidf_matrix - expected.tfidf_matrix).max() == 0
+
+
+def test_text_cache_does_not_keep_failed_extractions(tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    failing = DocumentIndexer(extractor="lxml", cache_dir=cache_dir)
+    failing.extract_text = lambda path: "" if path.name.startswith("1") else read_clean_html_lxml(path)  # As on a read error
+    failing.build_index("data/html_corpus")
+    assert "1F648A7F-2C64-458C-BFAF-463A071530ED" not in failing.document_ids  # Empty documents are skipped
+
+    retried = DocumentIndexer(extractor="lxml", cache_dir=cache_dir)
+    retried.build_index("data/html_corpus")
+    assert retried.text_cache.stats()["hits"] == 2 and retried.text_cache.stats()["misses"] == 1
+    expected = DocumentIndexer(extractor="lxml")
+    expected.build_index("data/html_corpus")
+    assert abs(retried.tfidf_matrix - expected.tfidf_matrix).max() == 0
+
+
+def test_text_cache_evicts_least_recently_used(tmp_path):
+    from src.text_cache import TextCache
+
+    cache = TextCache(str(tmp_path / "cache"), max_bytes=250)
+    for number in range(5):
+        cache.put(f"{number:064x}", "lxml-v1", "x" * 100)
+        if number == 1:
+            os.utime(cache._entry_path(f"{0:064x}", "lxml-v1"), ns=(0, 0))
+    assert cache.stats()["size_bytes"] <= 250
+    assert cache.get(f"{4:064x}", "lxml-v1") == "x" * 100
+    assert cache.get(f"{0:064x}", "lxml-v1") is None
+
+
+@pytest.mark.parametrize("norm", ["l2", None])
+def test_streaming_build_matches_in_memory_build(corpus, tmp_path, norm):
+    (corpus / "Blank.html").write_text("<html><body> </body></html>")
+    expected = DocumentIndexer(extractor="lxml", norm=norm)
+    expected.build_index(str(corpus))
+
+    index_path = tmp_path / "index"
+    streamed = DocumentIndexer(extractor="lxml", norm=norm)
+    stats = streamed.build_index_streaming(str(corpus), str(index_path), memory_budget_mb=0.05, batch_size=7)
+    assert stats["segments"] > 1  # The budget forces spilling and a multi-way merge
+    # Temporary segments are cleaned up; only the published version of the index remains
+    assert sorted(os.listdir(tmp_path)) == sorted(["corpus", "index", os.readlink(index_path)])
+
+    data = DocumentIndexer.load_index_data(str(index_path))
+    assert data["document_ids"] == expected.document_ids
+    assert data["vocabulary"] == expected.vocabulary
+    np.testing.assert_array_equal(data["idf"], expected.idf)
+    assert abs(data["term_counts"] - expected.term_counts).max() == 0
+    assert abs(data["tfidf_matrix"] - expected.tfidf_matrix).max() < 1e-12
+
+
+@pytest.mark.parametrize("options, message", [
+    (["--shards", "2"], "--streaming cannot be combined with --shards"),
+    (["--incremental"], "--streaming cannot be combined with --incremental"),
+])
+def test_pipeline_rejects_streaming_with_sharded_or_incremental_builds(options, message):
+    import subprocess
+
+    result = subprocess.run([sys.executable, "run_pipeline.py", "--indexer-only", "--streaming", *options],
+                            capture_output=True, text=True, timeout=60)
+    assert result.returncode == 2  # Rejected by the argument parser, before anything is built
+    assert message in result.stderr
+
+
+def test_profiler_records_build_stages(tmp_path):
+    corpus_dir = tmp_path / "corpus"
+    corpus_dir.mkdir()
+    for html_file in sorted(Path("data/wiki_corpus").glob("*.html"))[:5]:
+        shutil.copy(html_file, corpus_dir)
+    profiler = PipelineProfiler(str(tmp_path / "profile"), cprofile=True, trace_memory=True)
+    with profiler:
+        with stage("index"):
+            indexer = DocumentIndexer()
+            indexer.build_index(str(corpus_dir))
+            indexer.save_index(str(tmp_path / "index"))
+    assert [record.path for record in profiler.records] == ["index", "index/extract", "index/fit", "index/save"]
+    index, extract, fit, save = profiler.records
+    assert index.wall >= extract.wall + fit.wall + save.wall
+    assert all(record.peak_rss and record.traced_peak and len(record.files) == 2 for record in profiler.records)
+    assert index.traced_peak >= max(extract.traced_peak, fit.traced_peak, save.traced_peak)
+    assert "extract" in profiler.summary_table()
+    assert profiler.save_summary().exists()
+    with stage("inactive"):  # No active profiler: a no-op
+        pass
+    assert len(profiler.records) == 4
+
+
+def test_near_duplicates_are_left_out_and_recorded(corpus, tmp_path):
+    expected = DocumentIndexer(extractor="lxml")
+    expected.build_index(str(corpus))
+
+    original = (corpus / "Folk_art.html").read_text(encoding="utf-8")
+    (corpus / "Folk_art_(mirror).html").write_text(
+        original.replace("<body", "<body><p>Mirrored copy - retrieved from the original site</p", 1), encoding="utf-8")
+    shutil.copy(corpus / "Desktop_search.html", corpus / "zz_Desktop_search_copy.html")
+
+    indexer = DocumentIndexer(extractor="lxml", near_duplicate_threshold=0.8)
+    stats = indexer.build_index(str(corpus))
+    assert indexer.duplicates == {"Folk_art_(mirror)": "Folk_art",
+                                  "zz_Desktop_search_copy": "Desktop_search"}
+    assert stats["near_duplicates"] == 2
+    assert_same_index(indexer, expected)  # Left-out documents do not affect IDF either
+    assert indexer.manifest["files"]["zz_Desktop_search_copy.html"]["duplicate_of"] == "Desktop_search"
+
+    indexer.save_index(str(tmp_path / "index"))
+    stored = DocumentIndexer.load_index_data(str(tmp_path / "index"))["duplicates"]
+    assert stored["duplicates"] == indexer.duplicates and stored["params"]["threshold"] == 0.8
+
+    DocumentIndexer(extractor="lxml", near_duplicate_threshold=0.8).build_index_streaming(str(corpus), str(tmp_path / "streamed"))
+    streamed = DocumentIndexer.load_index_data(str(tmp_path / "streamed"))
+    assert streamed["document_ids"] == expected.document_ids
+    assert streamed["duplicates"]["duplicates"] == indexer.duplicates
+
+
+def test_vocabulary_pruning_matches_tfidf_vectorizer(corpus, tmp_path):
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from src.utils import read_clean_html
+    from src.vocabulary import WORD_TOKEN_PATTERN
+
+    indexer = DocumentIndexer(extractor="lxml", token_pattern="words", min_df=2, max_df=0.5)
+    stats = indexer.build_index(str(corpus))
+    texts = [read_clean_html(corpus / f"{doc_id}.html") for doc_id in indexer.document_ids]
+    vectorizer = TfidfVectorizer(stop_words="english", token_pattern=WORD_TOKEN_PATTERN, min_df=2, max_df=0.5)
+    expected = vectorizer.fit_transform(texts)
+    assert indexer.vocabulary == vectorizer.get_feature_names_out().tolist()
+    assert abs(indexer.tfidf_matrix - expected).max() < 1e-12
+    assert not any(term[0].isdigit() for term in indexer.vocabulary)
+    unpruned = DocumentIndexer(extractor="lxml", token_pattern="words")
+    assert stats["candidate_terms"] == unpruned.build_index(str(corpus))["num_terms"]
+    assert stats["pruned_terms"] == stats["candidate_terms"] - stats["num_terms"] > 0
+    assert stats["pruned_postings"] == unpruned.term_counts.nnz - indexer.term_counts.nnz
+
+    # The streaming build prunes the same terms from its merged postings
+    streamed = DocumentIndexer(extractor="lxml", token_pattern="words", min_df=2, max_df=0.5)
+    streamed_stats = streamed.build_index_streaming(str(corpus), str(tmp_path / "streamed"),
+                                                    memory_budget_mb=0.05, batch_size=7)
+    assert streamed_stats["pruned_postings"] == stats["pruned_postings"]
+    data = DocumentIndexer.load_index_data(str(tmp_path / "streamed"))
+    assert data["vocabulary"] == indexer.vocabulary
+    assert abs(data["term_counts"] - indexer.term_counts).max() == 0
+    assert abs(data["tfidf_matrix"] - indexer.tfidf_matrix).max() < 1e-12
+
+    # max_features keeps the terms with the largest total counts
+    limited = DocumentIndexer(extractor="lxml", token_pattern="words", max_features=300)
+    limited.build_index(str(corpus))
+    totals = dict(zip(unpruned.vocabulary, np.asarray(unpruned.term_counts.sum(axis=0)).ravel()))
+    kept = set(limited.vocabulary)
+    assert len(kept) == 300
+    assert min(totals[term] for term in kept) >= max(total for term, total in totals.items() if term not in kept)
+
+    with pytest.raises(ValueError, match="no terms remain"):
+        DocumentIndexer(extractor="lxml", min_df=500, max_df=500).build_index(str(corpus))
+    indexer.save_index(str(tmp_path / "index"))
+    again = DocumentIndexer(extractor="lxml", token_pattern="words", min_df=2, max_df=0.5)
+    again.update_index(str(corpus), str(tmp_path / "index"))  # Falls back to a full build
+    assert again.vocabulary == indexer.vocabulary
+
+
+def test_term_dictionary_front_codes_the_vocabulary(tmp_path):
+    from src.query_processor import QueryProcessor
+    from src.vocabulary import TermDictionary, TERMS_FILE
+
+    terms = sorted({"ab", "abc", "abd", "b", "über", "übung", "x" * 300, "zz"} | {f"term{n:04d}" for n in range(100)})
+    dictionary = TermDictionary.from_terms(terms, block_size=4)
+    assert dictionary == terms and list(dictionary) == terms and dictionary[-1] == "übung" and dictionary[2:5] == terms[2:5]
+    assert [dictionary.get(term) for term in terms] == list(range(len(terms)))
+    assert dictionary.get("abcd") is None and dictionary.get("a") is None and "zzz" not in dictionary
+    assert dictionary.nbytes < sum(len(term.encode("utf-8")) + 1 for term in terms)
+    with pytest.raises(ValueError, match="sorted"):
+        TermDictionary.from_terms(["b", "a"])
+
+    indexer = DocumentIndexer(extractor="lxml")
+    indexer.build_index("data/html_corpus")
+    indexer.save_index(str(tmp_path / "index"))
+    assert (tmp_path / "index" / TERMS_FILE).exists() and not (tmp_path / "index" / "vocabulary.txt").exists()
+    data = DocumentIndexer.load_index_data(str(tmp_path / "index"))
+    assert isinstance(data["vocabulary"], TermDictionary) and data["vocabulary"] == indexer.vocabulary
+    processor = QueryProcessor.from_index(str(tmp_path / "index"))
+    in_memory = QueryProcessor(indexer.document_ids, indexer.vocabulary, indexer.tfidf_matrix,
+                               indexer.vectorizer_params, idf=indexer.idf)
+    for query in ["information overload", "database server hardware specs", "zzzz"]:
+        assert processor.process_query(query) == in_memory.process_query(query)
+
+
+def test_binary_index_round_trip(tmp_path):
+    from src.index_format import read_index
+
+    indexer = DocumentIndexer(extractor="lxml")
+    indexer.build_index("data/html_corpus")
+    index_path = tmp_path / "index"
+    indexer.save_index(str(index_path))
+    for mmap in (True, False):
+        data = read_index(index_path, mmap=mmap)
+        assert data["tfidf_matrix"].data.flags.writeable != mmap  # Read-only pages of the mapped file
+        assert data["document_ids"] == indexer.document_ids and data["vocabulary"] == indexer.vocabulary
+        np.testing.assert_array_equal(data["idf"], indexer.idf)
+        assert abs(data["tfidf_matrix"] - indexer.tfidf_matrix).max() == 0
+        assert data["vectorizer_params"] == indexer.vectorizer_params
+
+    # A rebuild switches index_path to a new version; a reader of the previous one keeps working
+    previous = read_index(index_path)
+    indexer.save_index(str(index_path))
+    indexer.save_index(str(index_path))
+    assert index_path.is_symlink() and read_index(index_path)["meta"]["index_id"] != previous["meta"]["index_id"]
+    assert len(list(tmp_path.glob(".index.v-*"))) == 2  # Current and previous version only
+    assert abs(previous["tfidf_matrix"] - indexer.tfidf_matrix).max() == 0
+
+    # Dense JSON export, the original JSON index and pre-term-dictionary binary indexes still load
+    indexer.save_index(str(tmp_path / "index.json"), format="json")
+    exported = DocumentIndexer.load_index_data(str(tmp_path / "index.json"))
+    assert exported["document_ids"] == indexer.document_ids and exported["vocabulary"] == indexer.vocabulary
+    assert abs(exported["tfidf_matrix"] - indexer.tfidf_matrix).max() < 1e-12
+    legacy = DocumentIndexer.load_index_data("data/output/index.json")
+    assert legacy["tfidf_matrix"].shape == (len(legacy["document_ids"]), len(legacy["vocabulary"]))
+    assert legacy["idf"] is None
+
+    version_3 = tmp_path / "version_3"
+    shutil.copytree(index_path.resolve(), version_3)
+    for name in ("terms.npy", "term_blocks.npy"):
+        (version_3 / name).unlink()
+    (version_3 / "vocabulary.txt").write_text("\n".join(indexer.vocabulary), encoding="utf-8")
+    meta = json.loads((version_3 / "meta.json").read_text())
+    (version_3 / "meta.json").write_text(json.dumps({**meta, "version": 3}))
+    assert read_index(version_3)["vocabulary"] == indexer.vocabulary
@@ -0,0 +1,41 @@
+# Tests for postings-based retrieval in src/inverted_index.py
+import random
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.indexer import DocumentIndexer
+from src.inverted_index import InvertedIndex, RetrievalEngine, build_postings
+from src.query_processor import QueryProcessor
+
+
+@pytest.fixture(scope="module")
+def index_path(tmp_path_factory):
+    index_path = tmp_path_factory.mktemp("index") / "index"
+    indexer = DocumentIndexer()
+    indexer.build_index("data/wiki_corpus")
+    indexer.save_index(str(index_path))
+    return index_path
+
+
+def random_queries(vocabulary, count=50, seed=7):
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(vocabulary) for _ in range(rng.randint(1, 4))) for _ in range(count)]
+
+
+@pytest.mark.parametrize("mode", ["taat", "wand"])
+def test_engine_matches_exhaustive_ranking(index_path, mode):
+    build_postings(str(index_path))
+    assert InvertedIndex.exists(index_path)
+    processor = QueryProcessor.from_index(str(index_path))
+    engine = RetrievalEngine.from_index(str(index_path))
+
+    for query in random_queries(processor.vocabulary) + ["information retrieval", "zzzz"]:
+        for top_k in (1, 3, 10):
+            expected = [result for result in processor.process_query(query, top_k=top_k) if result[2] > 0]
+            results = engine.search(query, top_k=top_k, mode=mode)
+            assert [doc_id for _, doc_id, _ in results] == [doc_id for _, doc_id, _ in expected]
+            assert [score for _, _, score in results] == pytest.approx([score for _, _, score in expected])
@@ -0,0 +1,215 @@
+# Tests for query vectorization, ranking and result caching in src/query_processor.py
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.indexer import DocumentIndexer
+from src.query_cache import QueryResultCache
+from src.query_processor import QueryProcessor, QueryVectorizer, top_k_indices, top_k_indices_rows
+from src.utils import read_clean_html
+
+QUERIES = ["information overload", "database server hardware specs", "search engine open sorce"]
+
+
+@pytest.fixture(scope="module")
+def indexer():
+    indexer = DocumentIndexer()
+    indexer.build_index("data/html_corpus")
+    return indexer
+
+
+@pytest.fixture(scope="module")
+def processor(indexer, tmp_path_factory):
+    index_path = tmp_path_factory.mktemp("index") / "index"
+    indexer.save_index(str(index_path))
+    return QueryProcessor.from_index(str(index_path))
+
+
+@pytest.fixture(scope="module")
+def fitted_vectorizer(indexer):
+    texts = [read_clean_html(Path("data/html_corpus") / f"{doc_id}.html") for doc_id in indexer.document_ids]
+    vectorizer = TfidfVectorizer(stop_words="english")
+    vectorizer.fit(texts)
+    return vectorizer
+
+
+def test_index_matches_tfidf_vectorizer(indexer, fitted_vectorizer):
+    assert indexer.vocabulary == fitted_vectorizer.get_feature_names_out().tolist()
+    np.testing.assert_array_equal(indexer.idf, fitted_vectorizer.idf_)
+
+
+def test_query_vectors_match_fitted_vectorizer(indexer, fitted_vectorizer):
+    vectorizer = QueryVectorizer(indexer.vocabulary, indexer.vectorizer_params, indexer.idf)
+    expected = fitted_vectorizer.transform(QUERIES)
+    assert abs(vectorizer.transform(QUERIES) - expected).max() < 1e-12
+
+
+def test_loaded_index_reuses_its_stored_idf_vectorizer(processor, fitted_vectorizer, monkeypatch):
+    import src.query_processor as query_processor
+
+    np.testing.assert_array_equal(processor.vectorizer.idf, fitted_vectorizer.idf_)  # Read back from idf.npy
+    expected = fitted_vectorizer.transform(QUERIES)
+    monkeypatch.setattr(query_processor, "TfidfVectorizer", None)  # Queries must not build a vectorizer
+    assert abs(processor.vectorizer.transform(QUERIES) - expected).max() < 1e-12
+    assert processor.process_query(QUERIES[0], top_k=3)
+
+
+def test_scores_are_cosine_similarities(indexer, fitted_vectorizer, processor):
+    matrix = indexer.tfidf_matrix.toarray()
+    for query in QUERIES:
+        query_vector = fitted_vectorizer.transform([query]).toarray()[0]
+        expected = matrix @ query_vector / np.linalg.norm(query_vector)
+        scores = {doc_id: score for _, doc_id, score in processor.process_query(query)}
+        got = np.array([scores[doc_id] for doc_id in indexer.document_ids])
+        np.testing.assert_allclose(got, expected, atol=1e-12)
+
+
+def test_sparse_scoring_matches_dense_cosine_similarity(tmp_path):
+    from scipy import sparse
+    from sklearn.metrics.pairwise import cosine_similarity
+
+    indexer = DocumentIndexer(norm=None)  # Unnormalised rows: cosine needs the document lengths
+    indexer.build_index("data/html_corpus")
+    indexer.save_index(str(tmp_path / "index"))
+    processor = QueryProcessor.from_index(str(tmp_path / "index"))
+    assert sparse.isspmatrix_csr(processor.tfidf_matrix)
+    query_matrix = processor.vectorizer.transform(QUERIES)
+    assert sparse.isspmatrix_csr(query_matrix)
+    expected = cosine_similarity(query_matrix.toarray(), indexer.tfidf_matrix.toarray())
+    for query, expected_scores in zip(QUERIES, expected):
+        scores = {doc_id: score for _, doc_id, score in processor.process_query(query)}
+        np.testing.assert_allclose([scores[doc_id] for doc_id in indexer.document_ids], expected_scores, atol=1e-12)
+
+
+def test_top_k_matches_full_ranking(processor):
+    for query in QUERIES:
+        full = processor.process_query(query)
+        for k in range(1, len(full) + 2):
+            assert processor.process_query(query, top_k=k) == full[:k]
+
+
+def test_top_k_indices_breaks_ties_by_document_order():
+    scores = np.array([0.5, 1.0, 0.5, 0.0, 0.5, 1.0])
+    assert top_k_indices(scores, 3).tolist() == [1, 5, 0]
+    assert top_k_indices(scores, 4).tolist() == [1, 5, 0, 2]
+    assert top_k_indices(scores).tolist() == [1, 5, 0, 2, 4, 3]
+
+
+def test_top_k_indices_rows_matches_per_row_selection():
+    rng = np.random.default_rng(0)
+    scores = rng.integers(0, 4, size=(20, 15)).astype(float)  # Many ties
+    for k in [None, 0, 1, 5, 14, 15, 20]:
+        expected = [top_k_indices(row, k).tolist() for row in scores]
+        assert top_k_indices_rows(scores, k).tolist() == expected
+
+
+def test_batched_queries_match_single_queries(processor, tmp_path):
+    queries = QUERIES + ["", "zzzunknownterm"]
+    for top_k in [None, 2]:
+        batched = processor.process_queries(queries, top_k=top_k, batch_size=2)
+        assert batched == [processor.process_query(query, top_k=top_k) for query in queries]
+
+    queries_csv = tmp_path / "queries.csv"
+    queries_csv.write_text("query_id,query_text\n" + "".join(f"q{i},{q}\n" for i, q in enumerate(queries)))
+    output_csv = tmp_path / "results.csv"
+    processor.process_queries_from_csv(str(queries_csv), str(output_csv), top_k=2)
+    rows = output_csv.read_text().splitlines()
+    assert rows[0] == "query_id,rank,document_id"
+    assert rows[1:] == [f"q{i},{rank},{doc_id}" for i, query in enumerate(queries)
+                        for rank, doc_id, _ in processor.process_query(query, top_k=2)]
+
+
+def test_result_cache_returns_uncached_rankings(indexer, processor):
+    cache = QueryResultCache(top_n=2)
+    cached = QueryProcessor(indexer.document_ids, indexer.vocabulary, indexer.tfidf_matrix,
+                            indexer.vectorizer_params, idf=indexer.idf, result_cache=cache)
+    cached.activate_result_cache()
+    for query in QUERIES:
+        for top_k in [1, 2, 3, None]:
+            assert cached.process_query(query, top_k=top_k) == processor.process_query(query, top_k=top_k)
+    # top_k 1 and 2 fit the cached top 2; 3 and None bypass the cache
+    assert (cache.hits, cache.misses) == (len(QUERIES), len(QUERIES))
+
+    # Case, word order and stop words do not change the cache key
+    cached.process_query("Overload INFORMATION the", top_k=1)
+    assert cache.hits == len(QUERIES) + 1
+
+
+def test_result_cache_evicts_expires_and_invalidates(indexer, monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr("src.query_cache.time.monotonic", lambda: now[0])
+    cache = QueryResultCache(max_entries=2, ttl_seconds=10)
+    cache.set_index_version("v1")
+    for key in ["a", "b", "c"]:
+        cache.put("v1", key, [(1, key, 1.0)])
+    assert cache.get("v1", "a") is None and cache.evictions == 1  # Least recently used
+    assert cache.get("v1", "b") == [(1, "b", 1.0)]
+
+    now[0] = 11.0
+    assert cache.get("v1", "c") is None and cache.expirations == 1
+
+    cache.put("v1", "d", [(1, "d", 1.0)])
+    processor = QueryProcessor(indexer.document_ids, indexer.vocabulary, indexer.tfidf_matrix,
+                               indexer.vectorizer_params, idf=indexer.idf, result_cache=cache)
+    assert cache.stats()["entries"] == 2  # Loading an index that is not served yet keeps the cache
+    processor.activate_result_cache()  # Serving it
+    assert cache.stats()["entries"] == 0 and cache.invalidations == 1
+    cache.put("v1", "e", [(1, "e", 1.0)])  # Late results from the old index are dropped
+    assert cache.stats()["entries"] == 0
+
+
+def test_batched_queries_use_result_cache(indexer, processor):
+    cache = QueryResultCache(top_n=2)
+    cached = QueryProcessor(indexer.document_ids, indexer.vocabulary, indexer.tfidf_matrix,
+                            indexer.vectorizer_params, idf=indexer.idf, result_cache=cache)
+    cached.activate_result_cache()
+    top_ks = [1, 2, 3, None, 2, 1]
+    queries = QUERIES + QUERIES
+    expected = [processor.process_query(query, top_k=k) for query, k in zip(queries, top_ks)]
+    assert cached.process_queries(queries, top_k=top_ks) == expected
+    assert (cache.hits, cache.misses) == (0, 4)  # Queries with top_k 3 or None bypass the cache
+    assert cached.process_queries(queries, top_k=top_ks) == expected
+    assert (cache.hits, cache.misses) == (4, 4)
+    assert cached.process_queries(queries[:2], top_k=top_ks[:2]) == expected[:2]  # All hits: nothing to score
+    assert cached.process_queries([]) == []
+
+
+@pytest.mark.parametrize("norm", ["l2", None])
+def test_sharded_index_matches_unsharded_rankings(tmp_path, norm):
+    from src.sharded_query import ShardedQueryProcessor
+
+    indexer = DocumentIndexer(extractor="lxml", norm=norm)
+    indexer.build_index("data/wiki_corpus")
+    indexer.save_index(str(tmp_path / "index"))
+    indexer.save_index(str(tmp_path / "sharded"), num_shards=3)
+    data = DocumentIndexer.load_index_data(str(tmp_path / "sharded"))
+    assert data["document_ids"] == indexer.document_ids
+    assert abs(data["tfidf_matrix"] - indexer.tfidf_matrix).max() == 0  # Global IDF in every shard
+
+    unsharded = QueryProcessor.from_index(str(tmp_path / "index"))
+    queries = QUERIES + ["information retrieval", "search engine index", "", "zzzunknownterm"]
+    top_ks = [None, 0, 1, 3, 10, 200, 5]
+    with ShardedQueryProcessor.from_index(str(tmp_path / "sharded")) as sharded:
+        assert len(sharded.shards) == 3
+        assert sum(shard["num_documents"] for shard in sharded.shards) == len(indexer.document_ids)
+        assert [shard["first_document"] for shard in sharded.shards][1:] == \
+            list(np.cumsum([shard["num_documents"] for shard in sharded.shards])[:-1])
+        for top_k in [None, 10]:
+            assert sharded.process_queries(queries, top_k=top_k) == unsharded.process_queries(queries, top_k=top_k)
+        assert sharded.process_query("information retrieval", top_k=5) == \
+            unsharded.process_query("information retrieval", top_k=5)
+    in_process = ShardedQueryProcessor.from_index(str(tmp_path / "sharded"), processes=False)
+    assert in_process.process_queries(queries, top_k=top_ks) == unsharded.process_queries(queries, top_k=top_ks)
+
+    queries_csv = tmp_path / "queries.csv"
+    queries_csv.write_text("query_id,query_text\n" + "".join(f"q{i},{q}\n" for i, q in enumerate(queries)))
+    in_process.process_queries_from_csv(str(queries_csv), str(tmp_path / "sharded.csv"), top_k=3)
+    unsharded.process_queries_from_csv(str(queries_csv), str(tmp_path / "unsharded.csv"), top_k=3)
+    assert (tmp_path / "sharded.csv").read_text() == (tmp_path / "unsharded.csv").read_text()
+    with pytest.raises(ValueError, match="num_shards"):
+        indexer.save_index(str(tmp_path / "too_many"), num_shards=len(indexer.document_ids) + 1)